@@ -0,0 +1,88 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Batch Routing
+
+This file finds the journeys for a large number of (source, destination) station pairs read from a
+csv file, using SystemMap.route_many, and writes out the path, weight and fare of each journey.
+
+Usage:
+    python batch_routing.py pairs.csv journeys.csv --unit min --ael --workers 4
+
+The input csv has a header and then one <source station code>,<destination station code> pair per
+row. Pairs are read and routed in chunks of CHUNK_SIZE so that the whole file never has to fit in
+memory.
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+import argparse
+import csv
+from collections.abc import Iterator
+
+from classes import SystemMap
+from fares import FareTable, get_fare_table, OCT_ADT
+from snapshot import get_systems
+
+# Number of pairs routed with each call to SystemMap.route_many
+CHUNK_SIZE = 200000
+
+
+def read_pairs(filename: str) -> Iterator[list[tuple[str, str]]]:
+    """Reads the (source, destination) station code pairs from the given csv file, yielding them
+    in lists of at most CHUNK_SIZE pairs.
+    """
+    try:
+        with open(filename, encoding="utf8") as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            chunk = []
+            for row in reader:
+                if len(row) >= 2:
+                    chunk.append((row[0], row[1]))
+                if len(chunk) == CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+    except FileNotFoundError:
+        raise Exception(f"The file `{filename}` could not be found.")
+
+
+def route_file(pairs_file: str, out_file: str, system: SystemMap, fares: FareTable,
+               ael: bool = False, workers: int = 1) -> None:
+    """Routes every pair in pairs_file and writes one row per pair to out_file containing the
+    source, destination, weight, path (station codes separated by spaces) and adult octopus fare.
+    The weight, path and fare are left empty if no path (or fare) was found.
+    """
+    with open(out_file, 'w+', newline='', encoding='utf8') as file:
+        writer = csv.writer(file, delimiter=',')
+        writer.writerow(["Source", "Destination", "Weight", "Path", "Fare"])
+        for chunk in read_pairs(pairs_file):
+            for (src, dst), (path, weight) in zip(chunk, system.route_many(chunk, ael, workers)):
+                if path is None:
+                    writer.writerow([src, dst, "", "", ""])
+                    continue
+                prices = fares.lookup_name(system.stations[src].english_name,
+                                           system.stations[dst].english_name)
+                fare = "" if prices is None else f"{prices[OCT_ADT]:.2f}"
+                writer.writerow([src, dst, round(weight, 4), " ".join(path), fare])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the journeys for many station pairs.")
+    parser.add_argument("pairs", help="csv file of <source>,<destination> station codes")
+    parser.add_argument("output", help="csv file to write the journeys to")
+    parser.add_argument("--unit", choices=["km", "min"], default="min")
+    parser.add_argument("--ael", action="store_true", help="allow the airport express")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes to use")
+    args = parser.parse_args()
+
+    main_system = get_systems("data/lines.csv", "data/modified_lines_and_stations.csv",
+                              "data/append.csv", "data/modified_lines_and_stations_APPENDED.csv",
+                              "data/system_snapshot.pickle")[args.unit == "min"]
+    fare_table = get_fare_table("data/mtr_lines_fares.csv", "data/fare_table")
+    route_file(args.pairs, args.output, main_system, fare_table, args.ael, args.workers)
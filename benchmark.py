@@ -0,0 +1,520 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Benchmarks
+
+This file times the parts of the program that are run the most (loading, routing, reachability,
+fares, click detection and drawing), measures the memory used by a loaded system and prints the
+results as JSON. Results can be saved and later compared against, to check whether a change made
+any of them slower.
+
+Usage (from the same folder as main.py):
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json
+    python benchmark.py --synthetic 10k --seed 1
+
+With --synthetic, a network of the given size is generated (see synthetic_network.py) and used
+instead of the MTR data. The click and drawing benchmarks need the MTR map, so they are skipped.
+
+When comparing, the program exits with status 1 if any benchmark became slower by more than the
+tolerance (10% by default).
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+# Drawing is benchmarked without opening a window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+from classes import SystemMap
+from contraction import contract
+from data_collection import load_utf8_csv
+from fares import get_fare_table
+from hub_labels import build_hub_labels
+from information_processing import load_csv_lines, load_csv_stations, load_system
+from pareto import ParetoRouter
+from main import build_click_index, draw_base_layer, draw_frame, generate_box_mapping, \
+    get_click_station, get_price_info
+from synthetic_network import generate_size
+from timetable import generate_timetable
+from visualization import initialize_screen, LayeredScreen
+
+LINES_FILE = "data/lines.csv"
+STATIONS_FILE = "data/modified_lines_and_stations_APPENDED.csv"
+FARES_FILE = "data/mtr_lines_fares.csv"
+FARE_PREFIX = "data/fare_table"
+COORDS_FILE = "data/coord_mappings.csv"
+
+# Number of times each benchmark is repeated (the median time is reported)
+REPEAT = 5
+
+# Most pairs of stations used by the routing and fare benchmarks (every pair of MTR stations fits).
+# Networks with more pairs than this use the same random sample of pairs every time.
+MAX_PAIRS = 10000
+
+# MAX_PAIRS used for generated networks, whose searches take much longer
+SYNTHETIC_PAIRS = 1000
+
+# Budget (minutes) of the reachability benchmark, as used by "30 minutes from X" heatmaps
+REACHABLE_BUDGET = 30
+
+# Service hours of the timetable used by the timetable benchmark (minutes after midnight) and the
+# departure time of its journeys. Only the morning peak is generated, since a full day of trains
+# on a large generated network does not fit in memory.
+TIMETABLE_HOURS = (7 * 60, 10 * 60)
+DEPARTURE = 8 * 60
+
+# Number of alternative paths asked for by the k shortest paths benchmark, the most overlap they
+# may have (see SystemMap.k_shortest), and the step between the pairs of sample_pairs it uses
+K_ALTERNATIVES = 3
+K_MAX_OVERLAP = 0.7
+K_PAIR_STEP = 10
+
+# Largest difference allowed between the weights found by bidirectional and one-directional search
+BIDIRECTIONAL_TOLERANCE = 1e-9
+
+
+def time_median(func: Callable[[], Any], repeat: int = REPEAT) -> float:
+    """Return the median time (in seconds) taken by func over repeat calls."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def result(seconds: float, ops: int) -> dict[str, float]:
+    """Return the results of a benchmark which ran ops operations in the given time."""
+    return {"seconds": seconds, "ops": ops, "us_per_op": seconds / ops * 1e6}
+
+
+def sample_pairs(codes: list[str]) -> list[tuple[str, str]]:
+    """Return every pair of the given station codes, or MAX_PAIRS of them chosen at random (the
+    same ones every time) if there are more than that.
+    """
+    if len(codes) ** 2 <= MAX_PAIRS:
+        return [(src, dst) for src in codes for dst in codes]
+    rand = random.Random(0)
+    return [(rand.choice(codes), rand.choice(codes)) for _ in range(MAX_PAIRS)]
+
+
+def use_network(directory: str) -> None:
+    """Run the benchmarks on the network in directory (see write_network in
+    synthetic_network.py) instead of the MTR data, using at most SYNTHETIC_PAIRS pairs of stations.
+    """
+    global LINES_FILE, STATIONS_FILE, FARES_FILE, FARE_PREFIX, MAX_PAIRS
+    MAX_PAIRS = SYNTHETIC_PAIRS
+    LINES_FILE = os.path.join(directory, "lines.csv")
+    STATIONS_FILE = os.path.join(directory, "stations.csv")
+    FARES_FILE = os.path.join(directory, "fares.csv")
+    FARE_PREFIX = os.path.join(directory, "fare_table")
+
+
+def load_systems() -> dict[bool, SystemMap]:
+    """Return the systems used by the benchmarks, mapped as {time : system}."""
+    return {time_mode: load_system(LINES_FILE, STATIONS_FILE, time_mode)
+            for time_mode in (True, False)}
+
+
+def load_click_boxes() -> dict[str, tuple[int, int]]:
+    """Return the click box mapping used by main.py."""
+    coords = [(int(row[0]), int(row[1])) for row in load_utf8_csv(COORDS_FILE)[::-1]]
+    return generate_box_mapping(load_utf8_csv("data/modified_lines_and_stations.csv"), coords)
+
+
+def bench_load_lines() -> dict[str, float]:
+    """Time load_csv_lines."""
+    return result(time_median(lambda: load_csv_lines(LINES_FILE), REPEAT * 4), 1)
+
+
+def bench_load_stations() -> dict[str, float]:
+    """Time a cold start of a system: load_csv_lines followed by load_csv_stations, once with
+    time weights and once with distance weights.
+    """
+    def load() -> None:
+        for time_mode in (True, False):
+            system = SystemMap()
+            for line in load_csv_lines(LINES_FILE):
+                system.add_line(line)
+            load_csv_stations(STATIONS_FILE, system, time_mode)
+    return result(time_median(load), 2)
+
+
+def bench_memory() -> dict[str, float]:
+    """Measure the memory used by a system with time weights (see load_system), as traced by
+    tracemalloc while it is loaded. The total is reported per station and per edge (every
+    neighbour of every station), along with the time taken to load it while tracing.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    system = load_system(LINES_FILE, STATIONS_FILE, True)
+    seconds = time.perf_counter() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    edges = sum(len(station.neighbours) + len(station.ael_neighbours)
+                for station in system.stations.values())
+    results = result(seconds, 1)
+    results.update({"bytes": size, "bytes_per_station": size / len(system.stations),
+                    "bytes_per_edge": size / edges})
+    return results
+
+
+def bench_dijkstra(bidirectional: bool = False) -> dict[str, float]:
+    """Time SystemMap.dijkstra between every pair of stations (see sample_pairs), for both
+    airport express modes and both weight modes.
+    """
+    systems = load_systems()
+    for system in systems.values():
+        system.compile()
+    pairs = sample_pairs(list(systems[True].stations))
+
+    def run() -> None:
+        for system in systems.values():
+            for ael in (False, True):
+                for src, dst in pairs:
+                    system.dijkstra(src, dst, ael, bidirectional)
+    return result(time_median(run, 3), len(pairs) * 4)
+
+
+def bidirectional_difference(system: SystemMap, pairs: list[tuple[str, str]]) -> float:
+    """Returns the largest difference between the weights found by SystemMap.dijkstra with and
+    without bidirectional search between the given pairs of stations, for both airport express
+    modes. This is used to check that bidirectional search gives the same journeys.
+
+    inf is returned if only one of the searches finds a path, or if a bidirectional path does not
+    go from the first to the second station of its pair along edges adding up to its weight.
+    """
+    compiled = system.compile()
+    diff = 0.0
+    for ael in (False, True):
+        weights = compiled.ael_weights if ael else compiled.weights
+        for src, dst in pairs:
+            path, weight = system.dijkstra(src, dst, ael, True)
+            expected_path, expected = system.dijkstra(src, dst, ael)
+            if (path is None) != (expected_path is None):
+                return float('inf')
+            if path is None:
+                continue
+            if path[0] != src or path[-1] != dst:
+                return float('inf')
+            total = 0.0
+            for station_a, station_b in zip(path, path[1:]):
+                edge = compiled.edge(compiled.index[station_a], compiled.index[station_b])
+                total += float('inf') if edge == -1 else weights[edge]
+            diff = max(diff, abs(weight - expected), abs(total - weight))
+    return diff
+
+
+def bench_bidirectional() -> dict[str, float]:
+    """Time SystemMap.dijkstra with bidirectional search, the same way as bench_dijkstra. Its
+    journeys are first checked against one-directional search (see bidirectional_difference).
+    """
+    systems = load_systems()
+    pairs = sample_pairs(list(systems[True].stations))
+    for system in systems.values():
+        difference = bidirectional_difference(system, pairs)
+        assert difference < BIDIRECTIONAL_TOLERANCE, \
+            f"Bidirectional search differs from dijkstra by {difference}"
+    return bench_dijkstra(True)
+
+
+def bench_contraction() -> dict[str, float]:
+    """Time contraction hierarchy queries between every pair of stations (see sample_pairs), for
+    both airport express modes (time weights). The preprocessing time, number of shortcuts and
+    speedup over SystemMap.dijkstra are also reported.
+    """
+    system = load_systems()[True]
+    pairs = sample_pairs(list(system.stations))
+    start = time.perf_counter()
+    hierarchies = [contract(system.compile(), ael) for ael in (False, True)]
+    preprocess = time.perf_counter() - start
+
+    def run_dijkstra() -> None:
+        for ael in (False, True):
+            for src, dst in pairs:
+                system.dijkstra(src, dst, ael)
+
+    def run() -> None:
+        for hierarchy in hierarchies:
+            for src, dst in pairs:
+                hierarchy.journey(src, dst)
+    dijkstra_seconds = time_median(run_dijkstra, 3)
+    results = result(time_median(run, 3), len(pairs) * 2)
+    results.update({"preprocess_seconds": preprocess,
+                    "shortcuts": sum(hierarchy.shortcut_count() for hierarchy in hierarchies),
+                    "speedup": dijkstra_seconds / results["seconds"]})
+    return results
+
+
+def bench_hub_labels() -> dict[str, float]:
+    """Time HubLabels.distance between every pair of stations (see sample_pairs), for both
+    airport express modes (time weights). The preprocessing time, average label size and speedup
+    over SystemMap.dijkstra are also reported.
+    """
+    system = load_systems()[True]
+    pairs = sample_pairs(list(system.stations))
+    start = time.perf_counter()
+    labels = build_hub_labels(system)
+    preprocess = time.perf_counter() - start
+
+    def run_dijkstra() -> None:
+        for ael in (False, True):
+            for src, dst in pairs:
+                system.dijkstra(src, dst, ael)
+
+    def run() -> None:
+        for ael in (False, True):
+            for src, dst in pairs:
+                labels.distance(src, dst, ael)
+    dijkstra_seconds = time_median(run_dijkstra, 3)
+    results = result(time_median(run, 3), len(pairs) * 2)
+    results.update({"preprocess_seconds": preprocess,
+                    "label_size": (labels.label_size(False) + labels.label_size(True)) / 2,
+                    "speedup": dijkstra_seconds / results["seconds"]})
+    return results
+
+
+def bench_reachable() -> dict[str, float]:
+    """Time SystemMap.reachable_matrix from the source stations of sample_pairs (every station for
+    the MTR data) within REACHABLE_BUDGET, without the airport express (time weights). The speedup
+    over finding the same weights with SystemMap.dijkstra to every station is also reported.
+    """
+    system = load_systems()[True]
+    system.compile()
+    pairs = sample_pairs(list(system.stations))
+    sources = sorted({src for src, _ in pairs})
+
+    def run_dijkstra() -> None:
+        for src, dst in pairs:
+            system.dijkstra(src, dst)
+    dijkstra_seconds = time_median(run_dijkstra, 3) / len(pairs) * len(system.stations)
+    results = result(time_median(lambda: system.reachable_matrix(sources, REACHABLE_BUDGET), 3),
+                     len(sources))
+    results["speedup"] = dijkstra_seconds / (results["seconds"] / len(sources))
+    return results
+
+
+def bench_timetable() -> dict[str, float]:
+    """Time Timetable.journey between every pair of stations (see sample_pairs) leaving at
+    DEPARTURE, without the airport express. The time taken to generate the timetable and its
+    number of connections are also reported.
+    """
+    system = load_systems()[True]
+    pairs = sample_pairs(list(system.stations))
+    start = time.perf_counter()
+    timetable = generate_timetable(system, None, *TIMETABLE_HOURS)
+    preprocess = time.perf_counter() - start
+
+    def run() -> None:
+        for src, dst in pairs:
+            timetable.journey(src, dst, DEPARTURE)
+    results = result(time_median(run, 3), len(pairs))
+    results.update({"preprocess_seconds": preprocess, "connections": len(timetable)})
+    return results
+
+
+def bench_pareto() -> dict[str, float]:
+    """Time ParetoRouter.journeys (weight, changes and fare) between every pair of stations (see
+    sample_pairs), without the airport express (time weights). The average number of journeys
+    found and the time taken compared to SystemMap.dijkstra are also reported.
+    """
+    system = load_systems()[True]
+    system.compile()
+    router = ParetoRouter(system, get_fare_table(FARES_FILE, FARE_PREFIX))
+    pairs = sample_pairs(list(system.stations))
+    journeys = [len(router.journeys(src, dst)) for src, dst in pairs]
+
+    def run_dijkstra() -> None:
+        for src, dst in pairs:
+            system.dijkstra(src, dst)
+
+    def run() -> None:
+        for src, dst in pairs:
+            router.journeys(src, dst)
+    dijkstra_seconds = time_median(run_dijkstra, 3)
+    results = result(time_median(run, 3), len(pairs))
+    results.update({"journeys": sum(journeys) / len(pairs),
+                    "dijkstra_ratio": results["seconds"] / dijkstra_seconds})
+    return results
+
+
+def bench_k_shortest() -> dict[str, float]:
+    """Time SystemMap.k_shortest (K_ALTERNATIVES paths that overlap by at most K_MAX_OVERLAP)
+    between every K_PAIR_STEP-th pair of stations of sample_pairs, without the airport express
+    (time weights). The average number of paths found and the time taken compared to
+    SystemMap.dijkstra are also reported.
+    """
+    system = load_systems()[True]
+    system.compile()
+    pairs = sample_pairs(list(system.stations))[::K_PAIR_STEP]
+    paths = [len(system.k_shortest(src, dst, K_ALTERNATIVES, False, K_MAX_OVERLAP))
+             for src, dst in pairs]
+
+    def run_dijkstra() -> None:
+        for src, dst in pairs:
+            system.dijkstra(src, dst)
+
+    def run() -> None:
+        for src, dst in pairs:
+            system.k_shortest(src, dst, K_ALTERNATIVES, False, K_MAX_OVERLAP)
+    dijkstra_seconds = time_median(run_dijkstra, 3)
+    results = result(time_median(run, 3), len(pairs))
+    results.update({"paths": sum(paths) / len(pairs),
+                    "dijkstra_ratio": results["seconds"] / dijkstra_seconds})
+    return results
+
+
+def bench_fares() -> dict[str, float]:
+    """Time get_price_info between every pair of stations (see sample_pairs)."""
+    system = load_systems()[True]
+    fares = get_fare_table(FARES_FILE, FARE_PREFIX)
+    paths = [[src, dst] for src, dst in sample_pairs(list(system.stations))]
+
+    def run() -> None:
+        for path in paths:
+            get_price_info(path, system, fares)
+    return result(time_median(run), len(paths))
+
+
+class _Click:
+    """A stand in for a pygame click event, only containing a position."""
+    pos: tuple[int, int]
+
+    def __init__(self, pos: tuple[int, int]) -> None:
+        """Initialize a click at the given position."""
+        self.pos = pos
+
+
+def bench_click() -> dict[str, float]:
+    """Time get_click_station over a grid of clicks covering the map."""
+    click_index = build_click_index(load_click_boxes())
+    clicks = [_Click((x, y)) for x in range(0, 1300, 10) for y in range(0, 1000, 10)]
+
+    def run() -> None:
+        for click in clicks:
+            get_click_station(click, click_index)
+    return result(time_median(run), len(clicks))
+
+
+def bench_draw() -> dict[str, float]:
+    """Time drawing one frame of run_main (with a path shown) using a dummy display."""
+    mapping = load_click_boxes()
+    system = load_systems()[True]
+    path = system.dijkstra("TUC", "POA", True)[0]
+    image = pygame.image.load(r'data/mtrmap.png')
+    screen = initialize_screen((image.get_width(), image.get_height() + 100),
+                               [pygame.MOUSEBUTTONDOWN], "Benchmark")
+    layers = LayeredScreen(screen, draw_base_layer(image, None, screen.get_size()))
+    frames = 20
+
+    def run() -> None:
+        for i in range(frames):
+            draw_frame(layers, image, mapping,
+                       (path, "TUC", "POA", i % 2 == 0, f"This journey is {i} min(s)"))
+    seconds = time_median(run)
+    pygame.display.quit()
+    return result(seconds, frames)
+
+
+BENCHMARKS = {
+    "load_csv_lines": bench_load_lines,
+    "load_csv_stations": bench_load_stations,
+    "system_memory": bench_memory,
+    "dijkstra_all_pairs": bench_dijkstra,
+    "bidirectional_all_pairs": bench_bidirectional,
+    "contraction_all_pairs": bench_contraction,
+    "hub_label_all_pairs": bench_hub_labels,
+    "reachable_within": bench_reachable,
+    "timetable_journey": bench_timetable,
+    "pareto_journeys": bench_pareto,
+    "k_shortest_paths": bench_k_shortest,
+    "get_price_info": bench_fares,
+    "get_click_station": bench_click,
+    "draw_frame": bench_draw
+}
+
+# Benchmarks that only work on the MTR data
+MTR_ONLY = ["get_click_station", "draw_frame"]
+
+
+def run_benchmarks(names: list[str]) -> dict[str, Any]:
+    """Run the benchmarks with the given names and return their results along with information
+    about the machine they were run on.
+    """
+    results = {}
+    for name in names:
+        results[name] = BENCHMARKS[name]()
+        print(f"{name}: {results[name]['us_per_op']:.2f} us/op", file=sys.stderr)
+    return {"python": platform.python_version(), "machine": platform.machine(),
+            "benchmarks": results}
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any],
+            tolerance: float) -> list[str]:
+    """Return a message for every benchmark in both results and baseline that became slower by
+    more than tolerance (a fraction, e.g. 0.1 = 10%).
+    """
+    messages = []
+    for name, current in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        old = baseline["benchmarks"][name]["us_per_op"]
+        change = current["us_per_op"] / old - 1 if old > 0 else 0.0
+        if change > tolerance:
+            messages.append(f"{name} is {change:.0%} slower "
+                            f"({old:.2f} -> {current['us_per_op']:.2f} us/op)")
+    return messages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the MTR journey planner.")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS),
+                        help="benchmarks to run (default: all)")
+    parser.add_argument("--output", help="file to save the results to")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--synthetic", choices=["1k", "10k", "100k"],
+                        help="size of a generated network to use instead of the MTR data")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated network")
+    args = parser.parse_args()
+
+    selected = args.only
+    if args.synthetic is not None:
+        network_dir = f"data/synthetic_{args.synthetic}_{args.seed}"
+        generate_size(network_dir, args.synthetic, args.seed)
+        use_network(network_dir)
+        if selected is None:
+            selected = [name for name in BENCHMARKS if name not in MTR_ONLY]
+    all_results = run_benchmarks(list(BENCHMARKS) if selected is None else selected)
+    all_results["network"] = "mtr" if args.synthetic is None else network_dir
+    print(json.dumps(all_results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w+') as file:
+            json.dump(all_results, file, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = compare(all_results, json.load(file), args.tolerance)
+        for message in regressions:
+            print(message, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
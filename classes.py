@@ -16,21 +16,154 @@ please consult our Course Syllabus.
 This file is Copyright (c) 2021 Vijay Sambamurthy.
 """
 from __future__ import annotations
+import copy
+import hashlib
+import math
+import os
+import sys
+from array import array
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
 from heapq import heappop, heappush
-from typing import Optional
+from typing import Any, Optional
 
 import geopy.distance
+import numpy as np
+
+from metrics import SearchStats, get_metrics
 
 
 LINES = ["AEL", "DRL", "EAL", "ISL", "KTL", "TML", "TCL", "TKL", "TWL", "WRL", "KTL", "SIL"]
 
+# Lines that are walked instead of being run by trains, so they can be used at any time
+WALKING_LINES = {"WLK"}
+
+# Every tuple of line codes used by a station, mapped to itself (see _line_codes)
+_LINE_CODE_TUPLES = {}
+
+# Most paths CompiledMap.k_shortest_paths skips for overlapping, per path asked for
+MAX_SKIPPED_FACTOR = 20
+
+
+class Adjacency:
+    """The neighbours of many stations, stored together in flat arrays so that no dictionary or
+    float object is needed per neighbour. Station codes are given small integer ids, and each
+    station (node) has one linked list of edges for regular neighbours and one for airport
+    express neighbours.
+
+    The edges of node n are found by starting at heads[2 * n] (heads[2 * n + 1] for airport
+    express neighbours) and following links until -1, newest edge first.
+
+    Instance Attributes:
+        - codes: the station codes in id order, which are the only copy of each code used by the
+        stations sharing this Adjacency
+        - ids: a dictionary mapping containing {station_code : id}
+        - heads: position of the newest edge of each list of each node (-1 if it is empty)
+        - targets: id of the station at the end of each edge
+        - weights: weight of each edge
+        - links: position of the next (older) edge in the same list (-1 at the end of the list)
+    """
+    __slots__ = ("codes", "ids", "heads", "targets", "weights", "links")
+    codes: list[str]
+    ids: dict[str, int]
+    heads: array
+    targets: array
+    weights: array
+    links: array
+
+    def __init__(self) -> None:
+        """Initialize an empty Adjacency with no nodes or edges."""
+        self.codes = []
+        self.ids = {}
+        self.heads = array('i')
+        self.targets = array('i')
+        self.weights = array('d')
+        self.links = array('i')
+
+    def station_id(self, code: str) -> int:
+        """Return the id of the given station code, giving it a new one if it has none."""
+        if code not in self.ids:
+            self.ids[code] = len(self.codes)
+            self.codes.append(code)
+        return self.ids[code]
+
+    def add_node(self) -> int:
+        """Return a new node with no neighbours."""
+        self.heads.extend((-1, -1))
+        return len(self.heads) // 2 - 1
+
+    def find(self, node: int, ael: bool, code: str) -> int:
+        """Return the position of the newest edge from node to the station with the given code,
+        or -1 if there is none.
+        """
+        target = self.ids.get(code, -1)
+        edge = self.heads[2 * node + ael]
+        while edge != -1 and self.targets[edge] != target:
+            edge = self.links[edge]
+        return edge
+
+    def set_weight(self, node: int, ael: bool, code: str, weight: float) -> None:
+        """Set the weight of the edge from node to the station with the given code, adding the
+        edge if there is none.
+        """
+        edge = self.find(node, ael, code)
+        if edge != -1:
+            self.weights[edge] = weight
+            return
+        self.targets.append(self.station_id(code))
+        self.weights.append(weight)
+        self.links.append(self.heads[2 * node + ael])
+        self.heads[2 * node + ael] = len(self.targets) - 1
+
+    def neighbours(self, node: int, ael: bool) -> dict[str, float]:
+        """Return a dictionary mapping containing {station_code : weight} of the neighbours of
+        node, in the order they were added.
+
+        A neighbour can be in a list more than once after merge. The newest weight is used, at
+        the position of the oldest edge, the same as setting it in a dictionary more than once.
+        """
+        edges = []
+        edge = self.heads[2 * node + ael]
+        while edge != -1:
+            edges.append(edge)
+            edge = self.links[edge]
+        result = {}
+        for edge in reversed(edges):
+            result[self.codes[self.targets[edge]]] = self.weights[edge]
+        return result
+
+    def merge(self, node: int, other: int) -> None:
+        """Add the edges of node other to node by joining the lists of other in front of the lists
+        of node, without copying any edges. Weights of other replace those of node for the same
+        neighbour.
+
+        Preconditions:
+            - other is not used on its own afterwards (its lists now continue into those of node)
+        """
+        if node == other:
+            return
+        for ael in (0, 1):
+            edge = self.heads[2 * other + ael]
+            if edge == -1:
+                continue
+            while self.links[edge] != -1:
+                edge = self.links[edge]
+            self.links[edge] = self.heads[2 * node + ael]
+            self.heads[2 * node + ael] = self.heads[2 * other + ael]
+            self.heads[2 * other + ael] = -1
+
 
 class Station:
     """A station object.
 
+    Station objects use __slots__ and their codes are interned (line codes with sys.intern and
+    station codes by their Adjacency), so that many stations take little memory. Neighbours are
+    stored in an Adjacency, which is shared with the other stations of a system (see
+    SystemMap.adjacency).
+
     Instance Attributes:
         - line_codes: The line codes for this given station (multiple because stations can be on
-        multiple lines)
+        multiple lines). Stations on the same lines share the same tuple.
         - station_code: The three letter code for the current station
         - chinese_name: Traditional chinese name for the station
         - coords: coordinates for this current station
@@ -39,41 +172,80 @@ class Station:
         (Note that weight could be either time or distance depending on load_csv_stations)
         - ael_neighbours: Airport Express neighbours for this station stored similarly to
         neighbours
+
+    Note: neighbours and ael_neighbours are generated from the Adjacency every time they are used,
+    so changing them does not change the station (see add_neighbour).
     """
-    line_codes: set[str]
+    __slots__ = ("line_codes", "station_code", "coords", "english_name", "_adjacency", "_node")
+    line_codes: tuple[str, ...]
     station_code: str
     coords: tuple[float, float]
     english_name: str
-    neighbours: dict[str, float]
-    ael_neighbours: dict[str, float]
+
+    # Private Instance Attributes:
+    #   - _adjacency: the Adjacency the neighbours of this station are stored in
+    #   - _node: the node of this station in _adjacency
+    _adjacency: Adjacency
+    _node: int
 
     def __init__(self, line_code: str, station_code: str,
-                 english_name: str, pos: tuple[float, float]) -> None:
+                 english_name: str, pos: tuple[float, float],
+                 adjacency: Optional[Adjacency] = None) -> None:
         """Initialize a new Station with the given input values.
 
         This Station is initialized with no neighbours.
+
+        adjacency: the Adjacency to store the neighbours in. If it is not given, the station gets
+        one of its own.
         """
-        self.line_codes = {line_code}
-        self.station_code = station_code
+        self._adjacency = Adjacency() if adjacency is None else adjacency
+        self._node = self._adjacency.add_node()
+        self.line_codes = _line_codes((sys.intern(line_code),))
+        self.station_code = self._adjacency.codes[self._adjacency.station_id(station_code)]
         self.english_name = english_name
-        self.neighbours = {}
         self.coords = pos
-        self.ael_neighbours = {}
+
+    @property
+    def neighbours(self) -> dict[str, float]:
+        """Regular neighbours of this station (see the class docstring)."""
+        return self._adjacency.neighbours(self._node, False)
+
+    @property
+    def ael_neighbours(self) -> dict[str, float]:
+        """Airport Express neighbours of this station (see the class docstring)."""
+        return self._adjacency.neighbours(self._node, True)
 
     def add_line(self, line_code: str) -> None:
         """Add a line to this station
         """
-        self.line_codes.add(line_code)
+        if line_code not in self.line_codes:
+            self.line_codes = _line_codes(self.line_codes + (sys.intern(line_code),))
 
     def add_neighbour(self, station: str, value: float, ael: bool = False) -> None:
         """Add a neighbour. If ael is true, they will be added as an airport express neighbour
 
         value: is the weight between this station and the station to be added as a neighbour.
         """
-        if ael:
-            self.ael_neighbours[station] = value
+        self._adjacency.set_weight(self._node, ael, station, value)
+
+    def merge(self, station: Station) -> None:
+        """Add the lines and neighbours of station (another Station object with the same code) to
+        this station. The neighbours of station replace those of this station with the same code.
+
+        If both stations share an Adjacency, the neighbours are joined without being copied and
+        station then shares the neighbours of this station.
+        """
+        for line_code in station.line_codes:
+            self.add_line(line_code)
+        if station._adjacency is self._adjacency:
+            self._adjacency.merge(self._node, station._node)
         else:
-            self.neighbours[station] = value
+            for ael in (False, True):
+                for neighbour, weight in station._adjacency.neighbours(station._node,
+                                                                       ael).items():
+                    self.add_neighbour(neighbour, weight, ael)
+        station._adjacency = self._adjacency
+        station._node = self._node
 
     def get_weight(self, station: str, ael: bool) -> float:
         """Get weight between this station and the specified station (if it exists as a neighbour).
@@ -81,18 +253,22 @@ class Station:
         If ael is set to true, it will check in airport express neighbours also. Otherwise,
         airport express neighbours are ignored.
         """
+        adjacency = self._adjacency
         if ael:
-            if station in self.ael_neighbours:
-                return self.ael_neighbours[station]
-            elif station in self.neighbours:
-                return self.neighbours[station]
-            else:
-                raise ValueError
-        else:
-            if station in self.neighbours:
-                return self.neighbours[station]
-            else:
-                raise ValueError
+            edge = adjacency.find(self._node, True, station)
+            if edge != -1:
+                return adjacency.weights[edge]
+        edge = adjacency.find(self._node, False, station)
+        if edge != -1:
+            return adjacency.weights[edge]
+        raise ValueError
+
+
+def _line_codes(line_codes: tuple[str, ...]) -> tuple[str, ...]:
+    """Return the shared tuple equal to line_codes, so that stations on the same lines do not each
+    keep their own copy (see Station.line_codes).
+    """
+    return _LINE_CODE_TUPLES.setdefault(line_codes, line_codes)
 
 
 def get_dist(coord1: tuple[float, float], coord2: tuple[float, float]) -> float:
@@ -101,17 +277,94 @@ def get_dist(coord1: tuple[float, float], coord2: tuple[float, float]) -> float:
     return geopy.distance.distance(coord1, coord2).km
 
 
+# WGS-84 ellipsoid (the default used by geopy) in km, and the settings used by get_dists
+WGS84_MAJOR = 6378.137
+WGS84_FLATTENING = 1 / 298.257223563
+VINCENTY_ITERATIONS = 200
+VINCENTY_TOLERANCE = 1e-12
+
+
+def get_dists(coords1: np.ndarray, coords2: np.ndarray) -> np.ndarray:
+    """Get the distances between many pairs of latitude and longitude pairs at once using the
+    Vincenty formula, which is computed for every pair together using numpy. The results agree
+    with get_dist to well under a millimetre.
+
+    coords1, coords2: arrays of shape (pairs, 2) containing (lat, long) rows
+
+    return: array containing the distance (km) between coords1[i] and coords2[i] for every i
+    """
+    minor = WGS84_MAJOR * (1 - WGS84_FLATTENING)
+    reduced1 = np.arctan((1 - WGS84_FLATTENING) * np.tan(np.radians(coords1[:, 0])))
+    reduced2 = np.arctan((1 - WGS84_FLATTENING) * np.tan(np.radians(coords2[:, 0])))
+    sin_u1, cos_u1 = np.sin(reduced1), np.cos(reduced1)
+    sin_u2, cos_u2 = np.sin(reduced2), np.cos(reduced2)
+    long_diff = np.radians(coords2[:, 1] - coords1[:, 1])
+    lam = long_diff.copy()
+    converged = np.zeros(len(lam), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(VINCENTY_ITERATIONS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos_sq_alpha == 0, 0.0,
+                                    cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha)
+            c = WGS84_FLATTENING / 16 * cos_sq_alpha * (4 + WGS84_FLATTENING *
+                                                        (4 - 3 * cos_sq_alpha))
+            prev_lam = lam
+            lam = long_diff + (1 - c) * WGS84_FLATTENING * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma *
+                                         (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam - prev_lam) < VINCENTY_TOLERANCE
+            if converged.all():
+                break
+        u_sq = cos_sq_alpha * (WGS84_MAJOR ** 2 - minor ** 2) / minor ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - big_b / 6 * cos_2sigma_m *
+            (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        dists = minor * big_a * (sigma - delta_sigma)
+
+    # Vincenty does not converge for (nearly) antipodal points, so geopy is used for those.
+    for i in np.flatnonzero(~converged):
+        dists[i] = get_dist(tuple(coords1[i]), tuple(coords2[i]))
+    return dists
+
+
+# Polar radius of the earth (km) and the squared ratio of the polar and equatorial radii (WGS-84).
+# After converting latitudes to geocentric ones, the great circle distance on a sphere of this
+# radius is never longer than the distance calculated by get_dist, so it is a safe lower bound.
+EARTH_POLAR_RADIUS = 6356.752
+EARTH_AXIS_RATIO_SQ = 0.99330562
+
+
+def get_great_circle_dist(coord1: tuple[float, float], coord2: tuple[float, float]) -> float:
+    """Get the great circle (haversine) distance between 2 latitude and longitude pairs, using
+    EARTH_POLAR_RADIUS. This is faster than get_dist, but only an approximation of it.
+    """
+    lat1 = math.atan(EARTH_AXIS_RATIO_SQ * math.tan(math.radians(coord1[0])))
+    lat2 = math.atan(EARTH_AXIS_RATIO_SQ * math.tan(math.radians(coord2[0])))
+    long1, long2 = math.radians(coord1[1]), math.radians(coord2[1])
+    hav = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2) ** 2
+    return 2 * EARTH_POLAR_RADIUS * math.asin(min(1.0, math.sqrt(hav)))
+
+
 class Line:
     """A line object.
 
     Instance Attributes:
         - line_code: The three letter line code describing this line
-        - stations: a dictionary mapping containing : {position of station along line : station}
+        - stations: a dictionary mapping containing : {position of station along line : stations}
         - english_name: English name for the line
         - operating_speed: (Average) Operating speed of the trains traveling on the line
     """
+    __slots__ = ("line_code", "stations", "english_name", "operating_speed")
     line_code: str
-    stations: dict[int: list[Station]]
+    stations: dict[int, tuple[Station, ...]]
     english_name: str
     operating_speed: int
 
@@ -120,7 +373,7 @@ class Line:
 
         This Line is initialized with no Stations.
         """
-        self.line_code = line_code
+        self.line_code = sys.intern(line_code)
         self.english_name = english_name
         self.operating_speed = operating_speed
         self.stations = {}
@@ -128,128 +381,1215 @@ class Line:
     def add_station(self, station: Station, sequence: int) -> None:
         """Add a station to the line
         """
-        if sequence in self.stations:
-            self.stations[sequence].append(station)
-        else:
-            self.stations[sequence] = [station]
+        self.stations[sequence] = self.stations.get(sequence, ()) + (station,)
 
-    def add_connecion(self, sta1: Station, sta2: Station, time: bool) -> None:
+    def add_connecion(self, sta1: Station, sta2: Station, time: bool,
+                      dist: Optional[float] = None) -> None:
         """Add a connection between 2 stations on a line.
         This sets each station as a neighbour of the other (If this line is airport express then
         they will be added as Airport Express neighbours)
+
+        dist: the distance between the stations if it has already been calculated (see
+        get_dists), otherwise it is calculated using get_dist.
         """
         ael = self.line_code == "AEL"
-        weight = get_dist(sta1.coords, sta2.coords)
+        weight = get_dist(sta1.coords, sta2.coords) if dist is None else dist
         if time:
             weight = (weight / self.operating_speed) * 60 + 1
         sta1.add_neighbour(sta2.station_code, weight, ael)
         sta2.add_neighbour(sta1.station_code, weight, ael)
 
 
+class CompiledMap:
+    """A frozen version of a SystemMap where every station is given an integer index and the
+    edges are stored in compressed sparse row (CSR) form. Searches on this object work on integers
+    and flat lists only, so no neighbour dictionaries are copied or looked up while searching.
+
+    The edges of the station with index i are found at positions offsets[i] to offsets[i + 1] - 1
+    of targets, weights and ael_weights.
+
+    Instance Attributes:
+        - codes: station codes in index order (codes[i] is the station code of station i)
+        - index: a dictionary mapping containing {station_code : index}
+        - coords: coordinates of each station in index order
+        - offsets: start position of each station's edges in targets (length is stations + 1)
+        - targets: index of the station at the end of each edge
+        - weights: weight of each edge when airport express is not allowed (inf for edges that
+        only exist on the airport express)
+        - ael_weights: weight of each edge when airport express is allowed
+    """
+    codes: list[str]
+    index: dict[str, int]
+    coords: list[tuple[float, float]]
+    offsets: list[int]
+    targets: list[int]
+    weights: list[float]
+    ael_weights: list[float]
+
+    def __init__(self, system: SystemMap) -> None:
+        """Initialize a CompiledMap by freezing the stations and neighbours of the given system.
+
+        The weight of an edge is looked up the same way SystemMap.dijkstra always has, through
+        Station.get_weight on the station at the end of the edge.
+        """
+        self.codes = list(system.stations)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.coords = [system.stations[code].coords for code in self.codes]
+        self.offsets = [0]
+        self.targets = []
+        self.weights = []
+        self.ael_weights = []
+        # The neighbours of each station are generated once (see Station.neighbours)
+        neighbours = [system.stations[code].neighbours for code in self.codes]
+        ael_neighbours = [system.stations[code].ael_neighbours for code in self.codes]
+        for cur, code in enumerate(self.codes):
+            for neigh_code in list(neighbours[cur]) + [n for n in ael_neighbours[cur]
+                                                       if n not in neighbours[cur]]:
+                neigh = self.index[neigh_code]
+                self.targets.append(neigh)
+                self.weights.append(neighbours[neigh].get(code, float('inf')))
+                self.ael_weights.append(ael_neighbours[neigh].get(code, neighbours[neigh].get(
+                    code, float('inf'))))
+            self.offsets.append(len(self.targets))
+
+    def __len__(self) -> int:
+        """Return the number of stations in this compiled map."""
+        return len(self.codes)
+
+    def shortest_tree(self, source: int, airport_exp: bool = False, target: int = -1,
+                      stats: Optional[SearchStats] = None) -> tuple[list[float], list[int]]:
+        """Run dijkstra from the station with index source. If target is given, the search stops
+        as soon as the target has been popped from the priority queue. Otherwise a full shortest
+        path tree is generated.
+
+        stats: if given, the statistics of the search are added to it. Otherwise nothing is
+        counted, so the search has no extra work to do.
+
+        return: (dist, prev) where dist[i] is the weight of the shortest path to station i and
+        prev[i] is the index of the station before i on that path (-1 if there is none). If the
+        search stopped early, only the dist and prev values of the target (and stations popped
+        before it) are final.
+        """
+        offsets = self.offsets
+        targets = self.targets
+        weights = self.ael_weights if airport_exp else self.weights
+        push, pop = (heappush, heappop) if stats is None else _counting_queue(stats)
+        # Pops counted by earlier searches sharing stats are not part of this search
+        start_pops = 0 if stats is None else stats.pops
+        dist = [float('inf')] * len(self.codes)
+        prev = [-1] * len(self.codes)
+        done = [False] * len(self.codes)
+        dist[source] = 0
+        q = [(0, source)]
+        while q:
+            (cur_dist, cur) = pop(q)
+            # Stale entries are skipped (heapq has no decrease key, see SystemMap.dijkstra)
+            if done[cur]:
+                continue
+            done[cur] = True
+            if cur == target:
+                break
+            for edge in range(offsets[cur], offsets[cur + 1]):
+                new_dist = cur_dist + weights[edge]
+                neigh = targets[edge]
+                if new_dist < dist[neigh]:
+                    dist[neigh] = new_dist
+                    prev[neigh] = cur
+                    push(q, (new_dist, neigh))
+        if stats is not None:
+            self._count_settled(stats, done, target, start_pops)
+        return (dist, prev)
+
+    def _count_settled(self, stats: SearchStats, done: list[bool], target: int,
+                       start_pops: int) -> None:
+        """Add the settled, stale and relaxed counts of a finished search to stats, where done[i]
+        is whether station i was settled and start_pops is stats.pops from before the search
+        started. The edges of the target are not counted as relaxed since the search stops before
+        checking them.
+        """
+        settled = [i for i in range(len(done)) if done[i]]
+        stats.pushes += 1  # The source is put in the queue directly
+        stats.settled += len(settled)
+        stats.stale += stats.pops - start_pops - len(settled)
+        stats.relaxed += sum(self.offsets[i + 1] - self.offsets[i] for i in settled
+                             if i != target)
+
+    def a_star_tree(self, source: int, target: int, airport_exp: bool = False,
+                    scale: float = 1.0) -> tuple[list[float], list[int]]:
+        """Run A* from the station with index source to the station with index target. This is
+        dijkstra where each station in the priority queue is ordered by its distance plus the
+        great circle distance (see get_great_circle_dist) from it to the target multiplied by
+        scale. This sends the search towards the target instead of in every direction.
+
+        scale: converts km into the units of the weights. For the heuristic to be correct, no edge
+        may have a weight lower than its great circle distance multiplied by scale.
+
+        return: (dist, prev) the same as shortest_tree, where only the values of the target (and
+        stations popped before it) are final.
+        """
+        offsets = self.offsets
+        targets = self.targets
+        weights = self.ael_weights if airport_exp else self.weights
+        coords = self.coords
+        goal = coords[target]
+        dist = [float('inf')] * len(self.codes)
+        prev = [-1] * len(self.codes)
+        done = [False] * len(self.codes)
+        estimate = [-1.0] * len(self.codes)
+        dist[source] = 0
+        q = [(0, source)]
+        while q:
+            cur = heappop(q)[1]
+            if done[cur]:
+                continue
+            done[cur] = True
+            if cur == target:
+                break
+            cur_dist = dist[cur]
+            for edge in range(offsets[cur], offsets[cur + 1]):
+                new_dist = cur_dist + weights[edge]
+                neigh = targets[edge]
+                if new_dist < dist[neigh]:
+                    dist[neigh] = new_dist
+                    prev[neigh] = cur
+                    if estimate[neigh] < 0:
+                        estimate[neigh] = get_great_circle_dist(coords[neigh], goal) * scale
+                    heappush(q, (new_dist + estimate[neigh], neigh))
+        return (dist, prev)
+
+    def bidirectional_path(self, source: int, target: int, airport_exp: bool = False,
+                           stats: Optional[SearchStats] = None) -> tuple[Optional[list[str]],
+                                                                         float]:
+        """Run dijkstra from the station with index source and from the station with index target
+        at the same time, always continuing the search whose queue has the lower minimum. Every
+        edge is added in both directions with the same weight by Line.add_connecion, so the
+        search from target can use the same edges as the one from source.
+
+        Every time an edge reaches a station that has been reached by the other search, the path
+        through that station is a candidate. Once the minimums of both queues add up to at least
+        the best candidate, no shorter path can be found and the search stops.
+
+        stats: if given, the statistics of both searches are added to it (see shortest_tree).
+
+        return: (path, weight) where path is the list of station codes from source to target, or
+        (None, inf) if there is no path between them.
+        """
+        offsets = self.offsets
+        targets = self.targets
+        weights = self.ael_weights if airport_exp else self.weights
+        push, pop = (heappush, heappop) if stats is None else _counting_queue(stats)
+        # Pops counted by earlier searches sharing stats are not part of this search
+        start_pops = 0 if stats is None else stats.pops
+        # Index 0 is the search from source and index 1 the search from target
+        dist = ([float('inf')] * len(self.codes), [float('inf')] * len(self.codes))
+        prev = ([-1] * len(self.codes), [-1] * len(self.codes))
+        done = ([False] * len(self.codes), [False] * len(self.codes))
+        dist[0][source] = 0
+        dist[1][target] = 0
+        queues = ([(0, source)], [(0, target)])
+        best = 0 if source == target else float('inf')
+        meet = source
+        while queues[0] and queues[1]:
+            if queues[0][0][0] + queues[1][0][0] >= best:
+                break
+            side = 0 if queues[0][0][0] <= queues[1][0][0] else 1
+            (cur_dist, cur) = pop(queues[side])
+            if done[side][cur]:
+                continue
+            done[side][cur] = True
+            side_dist = dist[side]
+            other_dist = dist[1 - side]
+            for edge in range(offsets[cur], offsets[cur + 1]):
+                new_dist = cur_dist + weights[edge]
+                neigh = targets[edge]
+                if new_dist < side_dist[neigh]:
+                    side_dist[neigh] = new_dist
+                    prev[side][neigh] = cur
+                    push(queues[side], (new_dist, neigh))
+                    if new_dist + other_dist[neigh] < best:
+                        best = new_dist + other_dist[neigh]
+                        meet = neigh
+        if stats is not None:
+            settled = [i for i in range(len(self.codes)) if done[0][i]] + \
+                      [i for i in range(len(self.codes)) if done[1][i]]
+            stats.pushes += 2  # Both sources are put in their queues directly
+            stats.settled += len(settled)
+            stats.stale += stats.pops - start_pops - len(settled)
+            stats.relaxed += sum(offsets[i + 1] - offsets[i] for i in settled)
+        if best == float('inf'):
+            return (None, best)
+        return (self.unpack(prev[0], meet) + self.unpack(prev[1], meet)[-2::-1], best)
+
+    def bounded_tree(self, source: int, budget: float, airport_exp: bool = False,
+                     stats: Optional[SearchStats] = None) -> dict[int, float]:
+        """Run dijkstra from the station with index source, only finding the stations whose
+        shortest path weight is at most budget. Stations further than budget are never put in the
+        priority queue, so the search stops once every station within budget has been settled and
+        the rest of the network is never visited.
+
+        stats: if given, the statistics of the search are added to it (see shortest_tree).
+
+        return: a dictionary mapping containing {station index : weight of its shortest path} for
+        every station within budget (including source).
+        """
+        offsets = self.offsets
+        targets = self.targets
+        weights = self.ael_weights if airport_exp else self.weights
+        push, pop = (heappush, heappop) if stats is None else _counting_queue(stats)
+        # Pops counted by earlier searches sharing stats are not part of this search
+        start_pops = 0 if stats is None else stats.pops
+        # Only the stations that are reached are stored, since most of a large network is not
+        dist = {source: 0}
+        done = {}
+        q = [(0, source)]
+        while q:
+            (cur_dist, cur) = pop(q)
+            if cur in done:
+                continue
+            done[cur] = cur_dist
+            for edge in range(offsets[cur], offsets[cur + 1]):
+                new_dist = cur_dist + weights[edge]
+                neigh = targets[edge]
+                if new_dist <= budget and new_dist < dist.get(neigh, float('inf')):
+                    dist[neigh] = new_dist
+                    push(q, (new_dist, neigh))
+        if stats is not None:
+            stats.pushes += 1  # The source is put in the queue directly
+            stats.settled += len(done)
+            stats.stale += stats.pops - start_pops - len(done)
+            stats.relaxed += sum(offsets[i + 1] - offsets[i] for i in done)
+        return done
+
+    def k_shortest_paths(self, source: int, target: int, k: int, airport_exp: bool = False,
+                         max_overlap: float = 1.0, stats: Optional[SearchStats] = None
+                         ) -> list[tuple[list[int], float]]:
+        """Find up to k loopless paths from the station with index source to the station with
+        index target, shortest first, using Yen's algorithm. Every path after the first leaves an
+        earlier one at some station (the spur station) and takes the shortest way to target that
+        does not go back through the earlier path or repeat how another path left it.
+
+        One shortest path tree to target is generated at the start and shared by every spur
+        search (see _spur_path), so most spur paths are found without a search at all. Each path
+        is only spurred from the station where it left the path it came from onwards, since the
+        spur stations before that were already tried for the earlier path. Spur searches are also
+        put off: each one is queued with a lower bound on its weight (the cheapest first edge plus
+        the tree weight after it) and only run once that bound is the lowest in the queue, so the
+        spurs of long detours are never searched.
+
+        max_overlap: a path is skipped if more than this fraction of its weight is on edges of a
+        path that has already been returned, so alternatives are not near copies of each other.
+        Skipped paths are still spurred from, but at most k * MAX_SKIPPED_FACTOR paths are skipped.
+
+        stats: if given, the statistics of every search are added to it (see shortest_tree).
+
+        return: a list of (path, weight) where path is the list of station indices from source to
+        target.
+        """
+        to_target, next_station = self.shortest_tree(target, airport_exp, -1, stats)
+        if k <= 0 or to_target[source] == float('inf'):
+            return []
+        weights = self.ael_weights if airport_exp else self.weights
+        first = [source]
+        while first[-1] != target:
+            first.append(next_station[first[-1]])
+        # Each candidate is (weight or lower bound, order queued, path, weights along the path,
+        # spur position, removed). Paths that are found have removed set to None. Otherwise the
+        # path is the one to spur from and removed is the stations it may not go to next.
+        candidates = [(to_target[source], 0, first, [to_target[source] - to_target[station]
+                                                     for station in first], 0, None)]
+        queued = 1
+        seen = {tuple(first)}
+        spurred = []
+        routes = []
+        returned_edges = []
+        skipped = 0
+        while candidates and len(routes) < k and skipped <= k * MAX_SKIPPED_FACTOR:
+            _, _, path, along, spur_pos, removed = heappop(candidates)
+            if removed is not None:
+                spur = self._spur_path(path[:spur_pos + 1], removed, to_target, next_station,
+                                       airport_exp, stats)
+                if spur is not None and tuple(path[:spur_pos] + spur[0]) not in seen:
+                    seen.add(tuple(path[:spur_pos] + spur[0]))
+                    new_along = along[:spur_pos] + [along[spur_pos] + value for value in spur[1]]
+                    heappush(candidates, (new_along[-1], queued, path[:spur_pos] + spur[0],
+                                          new_along, spur_pos, None))
+                    queued += 1
+                continue
+
+            weight = along[-1]
+            edges = list(zip(path, path[1:]))
+            overlap = max((sum(along[i + 1] - along[i] for i, edge in enumerate(edges)
+                               if edge in route_edges) for route_edges in returned_edges),
+                          default=0.0)
+            if weight > 0 and overlap > max_overlap * weight:
+                skipped += 1
+            else:
+                routes.append((path, weight))
+                returned_edges.append(set(edges) | {(b, a) for a, b in edges})
+            spurred.append(path)
+            for i in range(spur_pos, len(path) - 1):
+                blocked = set(path[:i])
+                removed = {other[i + 1] for other in spurred
+                           if len(other) > i + 1 and other[:i + 1] == path[:i + 1]}
+                bound = min((weights[edge] + to_target[self.targets[edge]] for edge
+                             in range(self.offsets[path[i]], self.offsets[path[i] + 1])
+                             if self.targets[edge] not in removed
+                             and self.targets[edge] not in blocked), default=float('inf'))
+                if bound < float('inf'):
+                    heappush(candidates, (along[i] + bound, queued, path, along, i, removed))
+                    queued += 1
+        return routes
+
+    def _spur_path(self, root: list[int], removed: set[int], to_target: list[float],
+                   next_station: list[int], airport_exp: bool,
+                   stats: Optional[SearchStats]) -> Optional[tuple[list[int], list[float]]]:
+        """Return (path, weights along the path) of the shortest path from the last station of root
+        to the target of the tree (to_target, next_station), that does not use the other stations
+        of root or go from the last station of root straight to a station in removed. Return None
+        if there is no such path.
+
+        to_target and next_station are the dist and prev of shortest_tree run from the target.
+        Every edge is added in both directions with the same weight (see bidirectional_path), so
+        prev gives the next station on the shortest path to the target.
+
+        Removing stations and edges can only make paths longer, so to_target is a lower bound on
+        the weight left from any station and is used as the A* estimate (see a_star_tree). Once a
+        station whose tree path to the target avoids the removed stations is popped, the rest of
+        the path is taken from the tree, since nothing left in the queue can do better.
+        """
+        offsets = self.offsets
+        targets = self.targets
+        weights = self.ael_weights if airport_exp else self.weights
+        push, pop = (heappush, heappop) if stats is None else _counting_queue(stats)
+        # Pops counted by earlier searches sharing stats are not part of this search
+        start_pops = 0 if stats is None else stats.pops
+        spur = root[-1]
+        blocked = set(root[:-1])
+        # Whether the tree path from a station avoids blocked (filled in as stations are checked)
+        clear = {}
+        dist = {spur: 0}
+        prev = {spur: -1}
+        done = set()
+        found = None
+        q = [(to_target[spur], spur)]
+        while q:
+            cur = pop(q)[1]
+            if cur in done:
+                continue
+            done.add(cur)
+            if to_target[cur] == float('inf'):
+                break
+            if clear.get(cur, True) and (cur != spur or next_station[cur] not in removed):
+                found = self._tree_finish(cur, spur, prev, next_station, blocked, clear)
+                if found is not None:
+                    break
+            cur_dist = dist[cur]
+            for edge in range(offsets[cur], offsets[cur + 1]):
+                neigh = targets[edge]
+                if neigh in blocked or (cur == spur and neigh in removed):
+                    continue
+                new_dist = cur_dist + weights[edge]
+                if new_dist < dist.get(neigh, float('inf')):
+                    dist[neigh] = new_dist
+                    prev[neigh] = cur
+                    push(q, (new_dist + to_target[neigh], neigh))
+        if stats is not None:
+            stats.pushes += 1  # The spur station is put in the queue directly
+            stats.settled += len(done)
+            stats.stale += stats.pops - start_pops - len(done)
+            stats.relaxed += sum(offsets[i + 1] - offsets[i] for i in done)
+        if found is None:
+            return None
+        joined = found.index(cur)
+        return (found, [dist[station] for station in found[:joined]] +
+                [dist[cur] + to_target[cur] - to_target[station] for station in found[joined:]])
+
+    @staticmethod
+    def _tree_finish(cur: int, spur: int, prev: dict[int, int], next_station: list[int],
+                     blocked: set[int], clear: dict[int, bool]) -> Optional[list[int]]:
+        """Return the path from spur to cur (through prev) followed by the tree path from cur to
+        the target (through next_station), or None if the tree path goes through spur or a
+        station in blocked, or the joined path visits a station twice. clear is the cache of which
+        tree paths avoid these stations (see _spur_path) and is updated with the stations checked.
+        """
+        # The tree path from spur itself is checked from the station after it
+        tree_path = [next_station[cur]] if cur == spur else [cur]
+        while tree_path[-1] not in clear and tree_path[-1] not in blocked and \
+                tree_path[-1] != spur and next_station[tree_path[-1]] != -1:
+            tree_path.append(next_station[tree_path[-1]])
+        last = tree_path[-1]
+        # The tree path of the target is just the target itself
+        is_clear = clear[last] if last in clear else last not in blocked and last != spur
+        clear.update((station, is_clear) for station in tree_path)
+        if not is_clear:
+            return None
+        while next_station[tree_path[-1]] != -1:
+            tree_path.append(next_station[tree_path[-1]])
+        path = [spur] + tree_path if cur == spur else tree_path
+        while path[0] != spur:
+            path.insert(0, prev[path[0]])
+        return path if len(set(path)) == len(path) else None
+
+    def edge(self, source: int, target: int) -> int:
+        """Return the position of the edge from the station with index source to the station with
+        index target, or -1 if there is no such edge.
+        """
+        for edge in range(self.offsets[source], self.offsets[source + 1]):
+            if self.targets[edge] == target:
+                return edge
+        return -1
+
+    def reweighted(self, new_weights: dict[int, tuple[float, float]]) -> CompiledMap:
+        """Return a copy of this compiled map where the edge at each position in new_weights has
+        the given (weight, airport express weight).
+
+        Only the weights are copied, everything else is shared. This compiled map is not changed,
+        so searches that are already running on it are not affected.
+        """
+        compiled = copy.copy(self)
+        compiled.weights = self.weights.copy()
+        compiled.ael_weights = self.ael_weights.copy()
+        for edge, (weight, ael_weight) in new_weights.items():
+            compiled.weights[edge] = weight
+            compiled.ael_weights[edge] = ael_weight
+        return compiled
+
+    def with_edges(self, pairs: list[tuple[int, int]]) -> CompiledMap:
+        """Return a copy of this compiled map with an edge added in both directions between each
+        pair of station indices that are not connected already. The new edges have a weight of inf
+        (see reweighted). This compiled map is not changed.
+        """
+        extra = {}
+        for station_a, station_b in pairs:
+            if self.edge(station_a, station_b) == -1:
+                extra.setdefault(station_a, set()).add(station_b)
+                extra.setdefault(station_b, set()).add(station_a)
+        compiled = copy.copy(self)
+        compiled.offsets = self.offsets[:1]
+        compiled.targets = []
+        compiled.weights = []
+        compiled.ael_weights = []
+        # The edges between stations that get new edges are copied over in one piece, shifted by
+        # the number of new edges added before them.
+        start = 0
+        added = 0
+        for cur in sorted(extra) + [len(self.codes)]:
+            end = self.offsets[cur + 1] if cur < len(self.codes) else len(self.targets)
+            new = sorted(extra.get(cur, []))
+            compiled.targets.extend(self.targets[start:end] + new)
+            compiled.weights.extend(self.weights[start:end] + [float('inf')] * len(new))
+            compiled.ael_weights.extend(self.ael_weights[start:end] + [float('inf')] * len(new))
+            compiled.offsets.extend(offset + added for offset in
+                                    self.offsets[len(compiled.offsets):cur + 1])
+            added += len(new)
+            start = end
+        return compiled
+
+    def checksum(self) -> str:
+        """Return a hash of the stations, edges and weights of this compiled map. Compiled maps
+        with the same checksum give the same shortest paths.
+
+        Edges that can not be used at all (e.g. those left behind by removed walking links, see
+        with_edges) are skipped.
+        """
+        ael_weights = np.array(self.ael_weights, dtype=np.float64)
+        usable = ael_weights != float('inf')
+        sources = np.repeat(np.arange(len(self.codes), dtype=np.int64), np.diff(self.offsets))
+        digest = hashlib.sha256()
+        digest.update("\n".join(self.codes).encode("utf8"))
+        digest.update(sources[usable].tobytes())
+        digest.update(np.array(self.targets, dtype=np.int64)[usable].tobytes())
+        digest.update(np.array(self.weights, dtype=np.float64)[usable].tobytes())
+        digest.update(ael_weights[usable].tobytes())
+        return digest.hexdigest()
+
+    def unpack(self, prev: list[int], target: int) -> list[str]:
+        """Backtrack through prev (as returned by shortest_tree) to generate the list of station
+        codes on the path that ends at target, starting at the source station.
+        """
+        path = []
+        while target != -1:
+            path.append(self.codes[target])
+            target = prev[target]
+        return path[::-1]
+
+
+def _counting_queue(stats: SearchStats) -> tuple[Callable[[list, Any], None],
+                                                  Callable[[list], Any]]:
+    """Return versions of heappush and heappop which also count their calls in stats."""
+    def push(q: list, item: Any) -> None:
+        stats.pushes += 1
+        heappush(q, item)
+
+    def pop(q: list) -> Any:
+        stats.pops += 1
+        return heappop(q)
+
+    return (push, pop)
+
+
+# A change to the weight of one edge: (source index, target index, old weight, new weight, old
+# airport express weight, new airport express weight), see SystemMap.changes_since
+EdgeChange = tuple[int, int, float, float, float, float]
+
+
+def reachability_matrix(compiled: CompiledMap, sources: list[int], budget: float,
+                        airport_exp: bool = False) -> np.ndarray:
+    """Return an array of shape (len(sources), stations) where element [i, j] is the weight of the
+    shortest path from the station with index sources[i] to the station with index j, or inf if
+    that weight is more than budget. Each row is found by a single CompiledMap.bounded_tree.
+    """
+    reachable = np.full((len(sources), len(compiled)), float('inf'))
+    for row, source in enumerate(sources):
+        tree = compiled.bounded_tree(source, budget, airport_exp)
+        reachable[row, list(tree)] = list(tree.values())
+    return reachable
+
+
+def affected_trees(dist: np.ndarray, prev: np.ndarray, changes: list[EdgeChange],
+                   airport_exp: bool = False) -> np.ndarray:
+    """Return which shortest path trees are no longer correct after the given changes, where
+    dist[i] and prev[i] are the values of the i-th tree (see CompiledMap.shortest_tree).
+
+    An edge that became heavier only affects the trees that use it, and an edge that became
+    lighter only affects the trees it gives a shorter path to the station at its end. Every other
+    tree is still correct.
+
+    return: array of booleans where element i is whether the i-th tree is affected.
+    """
+    affected = np.zeros(len(dist), dtype=bool)
+    for source, target, old, new, old_ael, new_ael in changes:
+        if airport_exp:
+            old, new = old_ael, new_ael
+        if new > old:
+            affected |= prev[:, target] == source
+        elif new < old:
+            affected |= dist[:, source] + new < dist[:, target]
+    return affected
+
+
+class JourneyMatrix:
+    """Shortest path weights and predecessors between every pair of stations in a system, for both
+    airport express modes. Once generated, finding a journey is a table lookup instead of a search.
+
+    The first axis of dist and prev is the airport express mode (0 = not allowed, 1 = allowed),
+    the second axis is the source station and the third axis is the destination station.
+
+    Instance Attributes:
+        - codes: station codes in index order (codes[i] is the station code of station i)
+        - index: a dictionary mapping containing {station_code : index}
+        - dist: array of shape (2, stations, stations) containing shortest path weights (inf if
+        there is no path)
+        - prev: array of shape (2, stations, stations) where prev[ael, src, dst] is the index of
+        the station before dst on the shortest path from src (-1 if there is none)
+        - key: the checksum (see CompiledMap.checksum) of the compiled map the tables were
+        generated from
+    """
+    codes: list[str]
+    index: dict[str, int]
+    dist: np.ndarray
+    prev: np.ndarray
+    key: str
+
+    def __init__(self, codes: list[str], dist: np.ndarray, prev: np.ndarray, key: str) -> None:
+        """Initialize a JourneyMatrix from already generated tables.
+        See generate_journey_matrix and load_journey_matrix.
+        """
+        self.codes = codes
+        self.index = {code: i for i, code in enumerate(codes)}
+        self.dist = dist
+        self.prev = prev
+        self.key = key
+
+    def journey(self, station_start: str, station_end: str,
+                airport_exp: bool = False) -> tuple[Optional[list[str]], float]:
+        """Look up the shortest path between 2 stations. Returns the same values as
+        SystemMap.dijkstra.
+        """
+        if station_start not in self.index or station_end not in self.index:
+            return (None, 0)
+        src = self.index[station_start]
+        cur = self.index[station_end]
+        weight = float(self.dist[int(airport_exp), src, cur])
+        if weight == float('inf'):
+            return (None, 0)
+        tree = self.prev[int(airport_exp), src]
+        path = []
+        while cur != -1:
+            path.append(self.codes[cur])
+            cur = int(tree[cur])
+        return (path[::-1], weight)
+
+    def updated(self, compiled: CompiledMap, changes: list[EdgeChange]) -> JourneyMatrix:
+        """Return a copy of this matrix where only the rows (source stations) affected by the
+        given changes (see affected_trees) are generated again from compiled. This matrix is not
+        changed, so lookups that are already running on it are not affected.
+        """
+        dist = self.dist.copy()
+        prev = self.prev.copy()
+        for ael in (0, 1):
+            for src in np.flatnonzero(affected_trees(self.dist[ael], self.prev[ael], changes,
+                                                     bool(ael))).tolist():
+                tree_dist, tree_prev = compiled.shortest_tree(src, bool(ael))
+                dist[ael, src] = tree_dist
+                prev[ael, src] = tree_prev
+        return JourneyMatrix(self.codes, dist, prev, compiled.checksum())
+
+    def save(self, filename: str) -> None:
+        """Write out the tables to the given filename (as a numpy .npz file) so that they can be
+        loaded later using load_journey_matrix.
+        """
+        with open(filename, 'wb') as file:
+            np.savez(file, codes=np.array(self.codes), dist=self.dist, prev=self.prev,
+                     key=np.array(self.key))
+
+
+def generate_journey_matrix(compiled: CompiledMap) -> JourneyMatrix:
+    """Generate a JourneyMatrix by running a full dijkstra from every station in compiled, once
+    without and once with the airport express.
+    """
+    size = len(compiled)
+    dist = np.empty((2, size, size), dtype=np.float64)
+    prev = np.empty((2, size, size), dtype=np.int32)
+    for ael in (0, 1):
+        for src in range(size):
+            tree_dist, tree_prev = compiled.shortest_tree(src, bool(ael))
+            dist[ael, src] = tree_dist
+            prev[ael, src] = tree_prev
+    return JourneyMatrix(compiled.codes.copy(), dist, prev, compiled.checksum())
+
+
+def load_journey_matrix(filename: str) -> JourneyMatrix:
+    """Load a JourneyMatrix that was written out by JourneyMatrix.save. Files saved before the
+    key was stored are given an empty key, so they never match a compiled map.
+    """
+    try:
+        with np.load(filename, allow_pickle=False) as data:
+            return JourneyMatrix([str(code) for code in data['codes']], data['dist'],
+                                 data['prev'], str(data['key']) if 'key' in data else "")
+    except FileNotFoundError:
+        raise Exception(f"The file `{filename}` could not be found.")
+
+
+def route_from(compiled: CompiledMap, source: int, targets: list[int],
+               ael: bool = False) -> list[tuple[Optional[list[str]], float]]:
+    """Find the shortest paths from the station with index source to every station index in
+    targets using a single search. Returns a list of results in the same form as
+    SystemMap.dijkstra, in the order of targets.
+    """
+    # With a single target, the search can stop as soon as it has been reached
+    dist, prev = compiled.shortest_tree(source, ael, targets[0] if len(targets) == 1 else -1)
+    results = []
+    for target in targets:
+        if dist[target] == float('inf'):
+            results.append((None, 0))
+        else:
+            results.append((compiled.unpack(prev, target), dist[target]))
+    return results
+
+
+# The compiled map used by the worker processes of SystemMap.route_many
+_worker_compiled: Optional[CompiledMap] = None
+
+
+def _init_route_worker(compiled: CompiledMap) -> None:
+    """Store the compiled map in a worker process of SystemMap.route_many, so that it is only
+    sent to each worker once.
+    """
+    global _worker_compiled
+    _worker_compiled = compiled
+
+
+def _route_group(group: tuple[int, list[int], bool]) -> list[tuple[Optional[list[str]], float]]:
+    """Run route_from in a worker process of SystemMap.route_many for (source, targets, ael)."""
+    return route_from(_worker_compiled, group[0], group[1], group[2])
+
+
+# Most updates whose changes are kept by a SystemMap (see SystemMap.changes_since)
+MAX_LOGGED_UPDATES = 1000
+
+
+def _connection(station_a: str, station_b: str) -> tuple[str, str]:
+    """Return the key used for the connection between 2 stations (the codes in sorted order)."""
+    return (station_a, station_b) if station_a <= station_b else (station_b, station_a)
+
+
 class SystemMap:
     """An entire metro system map.
 
+    Updates (closures, slowdowns and temporary walking links, see close_station, close_edge,
+    scale_edge and add_walking_link) are applied on top of the stations and lines without changing
+    them, so that they can be undone.
+
     Instance Attributes:
         - lines: a dictionary mapping containing {line_code : line}
         - stations: a dictionary mapping containing {station_code : station}
+        - adjacency: the Adjacency shared by the stations loaded into this system (see
+        load_csv_stations)
+        - closed_stations: the station codes of closed stations
+        - closed_edges: the connections (see _connection) that are closed
+        - edge_scales: a dictionary mapping containing {connection : factor its weight is
+        multiplied by}
+        - walking_links: a dictionary mapping containing {connection : weight of the temporary
+        walking link between the stations}
+        - version: increases every time the compiled map (see compile) changes
     """
+    __slots__ = ("lines", "stations", "adjacency", "closed_stations", "closed_edges",
+                 "edge_scales", "walking_links", "version", "_compiled", "_base", "_matrix",
+                 "_changes", "_log_start")
     lines: dict[str, Line]
     stations: dict[str, Station]
+    adjacency: Adjacency
+    closed_stations: set[str]
+    closed_edges: set[tuple[str, str]]
+    edge_scales: dict[tuple[str, str], float]
+    walking_links: dict[tuple[str, str], float]
+    version: int
+    # Private Instance Attributes:
+    #   - _compiled: the compiled map with every update applied
+    #   - _base: the compiled map without any updates applied (it has the same edges as _compiled)
+    #   - _matrix: the JourneyMatrix generated by precompute
+    #   - _changes: the changes made by each recent update, as (version, changes)
+    #   - _log_start: the version since which the changes of every update are in _changes
+    _compiled: Optional[CompiledMap]
+    _base: Optional[CompiledMap]
+    _matrix: Optional[JourneyMatrix]
+    _changes: list[tuple[int, list[EdgeChange]]]
+    _log_start: int
 
     def __init__(self) -> None:
         """Initialize an empty system"""
         self.lines = {}
         self.stations = {}
+        self.adjacency = Adjacency()
+        self.closed_stations = set()
+        self.closed_edges = set()
+        self.edge_scales = {}
+        self.walking_links = {}
+        self.version = 0
+        self._compiled = None
+        self._base = None
+        self._matrix = None
+        self._changes = []
+        self._log_start = 0
 
     def add_station(self, station: Station) -> None:
         """Add a station to the system Map.
-        If it already exists, copy the properties of the station object to the existing station in
-        the map.
+        If it already exists, merge the station object into the existing station in the map (see
+        Station.merge).
         """
+        self._compiled = None
+        self._base = None
+        self._matrix = None
         if station.station_code in self.stations:
-            cur_sta = self.stations[station.station_code]
-            for line_code in station.line_codes:
-                cur_sta.add_line(line_code)
-            for neighbour in station.neighbours:
-                cur_sta.add_neighbour(neighbour, station.get_weight(neighbour, False))
-            for neighbour in station.ael_neighbours:
-                cur_sta.add_neighbour(neighbour, station.get_weight(neighbour, True), True)
-            self.stations[station.station_code] = cur_sta
+            self.stations[station.station_code].merge(station)
         else:
             self.stations[station.station_code] = station
 
     def add_line(self, line: Line) -> None:
         """Add a line and all the stations on the line to the system.
+
+        Stations that were already in the system are replaced on the line by the station in the
+        system, so that only one Station object is kept for each station code.
         """
         self.lines[line.line_code] = line
         for key in line.stations:
             for station in line.stations[key]:
                 self.add_station(station)
+            line.stations[key] = tuple(self.stations[station.station_code]
+                                       for station in line.stations[key])
+
+    def compile(self) -> CompiledMap:
+        """Freeze the system into a CompiledMap which is used by dijkstra. The compiled map is
+        kept until the system is changed through add_station or add_line, after which it will be
+        rebuilt the next time it is needed. Updates (see close_station etc.) are applied to it
+        directly instead.
+
+        NOTE: Changes made directly to Station objects in the system (e.g. add_neighbour) are not
+        seen by the compiled map until one of the methods above is called.
+        """
+        if self._compiled is None:
+            base = CompiledMap(self)
+            self._base = base.with_edges([(base.index[station_a], base.index[station_b])
+                                          for station_a, station_b in self.walking_links])
+            self._compiled = self._base
+            self.version += 1
+            self._changes = []
+            self._log_start = self.version
+            self._update_connections(self._updated_connections())
+        return self._compiled
+
+    def close_station(self, code: str) -> None:
+        """Close the station with the given code, so that journeys can not start, end or pass
+        through it.
+        """
+        self._check_stations(code)
+        self.closed_stations.add(code)
+        self._update_station(code)
+
+    def open_station(self, code: str) -> None:
+        """Open the station with the given code again (see close_station)."""
+        self._check_stations(code)
+        self.closed_stations.discard(code)
+        self._update_station(code)
+
+    def close_edge(self, station_a: str, station_b: str) -> None:
+        """Close the connection between the given stations (in both directions)."""
+        self._check_stations(station_a, station_b)
+        self.closed_edges.add(_connection(station_a, station_b))
+        self._update_connections([(station_a, station_b)])
+
+    def open_edge(self, station_a: str, station_b: str) -> None:
+        """Open the connection between the given stations again (see close_edge)."""
+        self._check_stations(station_a, station_b)
+        self.closed_edges.discard(_connection(station_a, station_b))
+        self._update_connections([(station_a, station_b)])
+
+    def scale_edge(self, station_a: str, station_b: str, factor: float) -> None:
+        """Multiply the weight of the connection between the given stations by factor (e.g. 1.5
+        for a segment that is running slower). A factor of 1 removes the change.
+
+        Preconditions:
+            - factor > 0
+        """
+        self._check_stations(station_a, station_b)
+        if not factor > 0:
+            raise ValueError(f"The factor {factor} is not positive.")
+        if factor == 1:
+            self.edge_scales.pop(_connection(station_a, station_b), None)
+        else:
+            self.edge_scales[_connection(station_a, station_b)] = factor
+        self._update_connections([(station_a, station_b)])
+
+    def add_walking_link(self, station_a: str, station_b: str, weight: float) -> None:
+        """Add a temporary walking link between the given stations with the given weight. If the
+        stations are already connected, the lower of the 2 weights is used.
+        """
+        self._check_stations(station_a, station_b)
+        self.walking_links[_connection(station_a, station_b)] = weight
+        self._update_connections([(station_a, station_b)])
+
+    def remove_walking_link(self, station_a: str, station_b: str) -> None:
+        """Remove the walking link between the given stations (see add_walking_link)."""
+        self._check_stations(station_a, station_b)
+        self.walking_links.pop(_connection(station_a, station_b), None)
+        self._update_connections([(station_a, station_b)])
+
+    def clear_updates(self) -> None:
+        """Undo every closure, scale and walking link."""
+        connections = self._updated_connections()
+        self.closed_stations = set()
+        self.closed_edges = set()
+        self.edge_scales = {}
+        self.walking_links = {}
+        self._update_connections(connections)
+
+    def changes_since(self, version: int) -> Optional[list[EdgeChange]]:
+        """Return every edge change made to the compiled map since the given version, in order.
+        None is returned if they are not all known (the compiled map was rebuilt since then, or
+        more than MAX_LOGGED_UPDATES updates have been made).
+        """
+        if version < self._log_start:
+            return None
+        return [change for logged, changes in self._changes if logged > version
+                for change in changes]
+
+    def _check_stations(self, *codes: str) -> None:
+        """Raise a ValueError if any of the given station codes are not in this system."""
+        for code in codes:
+            if code not in self.stations:
+                raise ValueError(f"The station `{code}` is not in the system.")
+
+    def _updated_connections(self) -> list[tuple[str, str]]:
+        """Return every connection that is changed by an update."""
+        connections = set(self.closed_edges) | set(self.edge_scales) | set(self.walking_links)
+        for code in self.closed_stations:
+            station = self.stations[code]
+            connections.update(_connection(code, neighbour) for neighbour in
+                               list(station.neighbours) + list(station.ael_neighbours))
+        return list(connections)
+
+    def _update_station(self, code: str) -> None:
+        """Apply the updates to every edge of the station with the given code."""
+        if self._compiled is not None:
+            base = self._base
+            cur = base.index[code]
+            self._update_connections([(code, base.codes[base.targets[edge]])
+                                      for edge in range(base.offsets[cur], base.offsets[cur + 1])])
+
+    def _update_connections(self, connections: list[tuple[str, str]]) -> None:
+        """Apply the updates to the edges of the given connections, replacing the compiled map
+        (and the JourneyMatrix, if there is one) with updated copies. Copies are used so that
+        searches that are already running are not affected.
+
+        Nothing is done if the system has not been compiled yet, since compile applies every
+        update.
+        """
+        if self._compiled is None:
+            return
+        base = self._base
+        compiled = self._compiled
+        pairs = [(base.index[station_a], base.index[station_b])
+                 for station_a, station_b in connections]
+        new_edges = [pair for pair in pairs if _connection(base.codes[pair[0]], base.codes[pair[1]])
+                     in self.walking_links and base.edge(pair[0], pair[1]) == -1]
+        if new_edges:
+            base = base.with_edges(new_edges)
+            compiled = compiled.with_edges(new_edges)
+        new_weights = {}
+        changes = []
+        for station_a, station_b in pairs:
+            for source, target in ((station_a, station_b), (station_b, station_a)):
+                edge = base.edge(source, target)
+                if edge == -1 or edge in new_weights:
+                    continue
+                weight, ael_weight = self._updated_weight(base, edge, source, target)
+                if (weight, ael_weight) != (compiled.weights[edge], compiled.ael_weights[edge]):
+                    new_weights[edge] = (weight, ael_weight)
+                    changes.append((source, target, compiled.weights[edge], weight,
+                                    compiled.ael_weights[edge], ael_weight))
+        if not changes and not new_edges:
+            return
+        compiled = compiled.reweighted(new_weights)
+        matrix = None if self._matrix is None else self._matrix.updated(compiled, changes)
+        self.version += 1
+        self._changes.append((self.version, changes))
+        if len(self._changes) > MAX_LOGGED_UPDATES:
+            self._log_start = self._changes.pop(0)[0]
+        self._base = base
+        self._compiled = compiled
+        self._matrix = matrix
+
+    def _updated_weight(self, base: CompiledMap, edge: int, source: int,
+                        target: int) -> tuple[float, float]:
+        """Return the (weight, airport express weight) of the edge at the given position of base
+        (from the station with index source to the station with index target) with every update
+        applied.
+        """
+        code_a, code_b = base.codes[source], base.codes[target]
+        key = _connection(code_a, code_b)
+        if code_a in self.closed_stations or code_b in self.closed_stations or \
+                key in self.closed_edges:
+            return (float('inf'), float('inf'))
+        scale = self.edge_scales.get(key, 1.0)
+        weight, ael_weight = base.weights[edge] * scale, base.ael_weights[edge] * scale
+        if key in self.walking_links:
+            weight = min(weight, self.walking_links[key])
+            ael_weight = min(ael_weight, self.walking_links[key])
+        return (weight, ael_weight)
+
+    def k_shortest(self, station_start: str, station_end: str, k: int, ael: bool = False,
+                   max_overlap: float = 1.0) -> list[tuple[list[str], float]]:
+        """Find up to k loopless alternative paths between 2 stations, shortest first (see
+        CompiledMap.k_shortest_paths). Returns a list of (path, weight) in the same form as
+        dijkstra, which is empty if there is no path or either station is not in the system.
 
-    def dijkstra(self, station_start: str, station_end: str,
-                 airport_exp: bool = False) -> tuple[Optional[list[str]], float]:
+        ael: whether airport express can be used or not.
+        max_overlap: the largest fraction of a path's weight that may be shared with a shorter
+        path that is returned (1.0 allows any overlap, lower values give more different paths).
+        """
+        if station_start not in self.stations or station_end not in self.stations:
+            return []
+        compiled = self.compile()
+        registry = get_metrics()
+        stats = None if registry is None else SearchStats()
+        paths = compiled.k_shortest_paths(compiled.index[station_start],
+                                          compiled.index[station_end], k, ael, max_overlap, stats)
+        if registry is not None:
+            registry.record_search("k_shortest", stats)
+        return [([compiled.codes[i] for i in path], weight) for path, weight in paths]
+
+    def a_star(self, station_start: str, station_end: str, airport_exp: bool = False,
+               time: bool = False) -> tuple[Optional[list[str]], float]:
+        """Shortest path between 2 stations using A* (see CompiledMap.a_star_tree). Returns the
+        same values as dijkstra.
+
+        The great circle distance to station_end is used as the estimate of the remaining weight.
+        If the weights are times, it is divided by the fastest operating speed of the lines that
+        may be used (the airport express is only considered if airport_exp is true).
+
+        Updates can make edges lighter than their great circle distance (see scale_edge and
+        add_walking_link), so the estimate is also scaled down until no updated edge is lighter
+        than it (see _update_scale). A walking link of weight 0 turns the estimate off, which is
+        the same as dijkstra.
+
+        time: whether the weights of the system are times (see load_csv_stations)
+        """
+        if station_start not in self.stations or station_end not in self.stations:
+            return (None, 0)
+        scale = 1.0
+        if time:
+            speed = max((line.operating_speed for line in self.lines.values()
+                         if airport_exp or line.line_code != "AEL"), default=0)
+            # Without a positive speed there is no lower bound, so fall back to dijkstra.
+            scale = 60 / speed if speed > 0 else 0.0
+        scale = self._update_scale(scale)
+        compiled = self.compile()
+        target = compiled.index[station_end]
+        dist, prev = compiled.a_star_tree(compiled.index[station_start], target, airport_exp,
+                                          scale)
+        if dist[target] == float('inf'):
+            # No path was found
+            return (None, 0)
+        return (compiled.unpack(prev, target), dist[target])
+
+    def _update_scale(self, scale: float) -> float:
+        """Return the largest scale at most the given one for which no edge changed by an update is
+        lighter than the great circle distance between its stations multiplied by scale, where
+        scale is such a bound for the edges without updates (see a_star).
+        """
+        if self.edge_scales:
+            scale *= min(1.0, min(self.edge_scales.values()))
+        for (station_a, station_b), weight in self.walking_links.items():
+            dist = get_great_circle_dist(self.stations[station_a].coords,
+                                         self.stations[station_b].coords)
+            if weight < dist * scale:
+                scale = weight / dist
+        return scale
+
+    def route_many(self, pairs: list[tuple[str, str]], ael: bool = False,
+                   workers: int = 1) -> list[tuple[Optional[list[str]], float]]:
+        """Find the shortest path for every (station_start, station_end) pair in pairs. Returns a
+        list of results in the same form as dijkstra, in the order of pairs.
+
+        The pairs are grouped by station_start so that only one search is run per source station
+        (see route_from). If workers is more than 1, the groups are split between that many
+        processes.
+
+        ael: whether airport express can be used or not.
+        """
+        compiled = self.compile()
+        results = [(None, 0)] * len(pairs)
+        groups = {}
+        for i, (station_start, station_end) in enumerate(pairs):
+            if station_start in self.stations and station_end in self.stations:
+                groups.setdefault(station_start, []).append(i)
+
+        tasks = [(compiled.index[source], [compiled.index[pairs[i][1]] for i in positions], ael)
+                 for source, positions in groups.items()]
+        if workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(workers, initializer=_init_route_worker,
+                                     initargs=(compiled,)) as executor:
+                chunk = max(1, len(tasks) // (workers * 4))
+                group_results = list(executor.map(_route_group, tasks, chunksize=chunk))
+        else:
+            group_results = [route_from(compiled, *task) for task in tasks]
+
+        for positions, group_result in zip(groups.values(), group_results):
+            for i, result in zip(positions, group_result):
+                results[i] = result
+        return results
+
+    def reachable_within(self, source: str, budget: float,
+                         ael: bool = False) -> dict[str, float]:
+        """Return every station that can be reached from source with a shortest path weight of
+        at most budget (minutes or km, depending on the weights of the system), as a dictionary
+        mapping containing {station_code : weight of its shortest path}. The source itself is
+        included with a weight of 0, and an unknown source gives an empty dictionary.
+
+        The search stops at the budget (see CompiledMap.bounded_tree), so a small budget only
+        visits the stations near source.
+
+        ael: whether airport express can be used or not.
+        """
+        if source not in self.stations:
+            return {}
+        compiled = self.compile()
+        registry = get_metrics()
+        stats = None if registry is None else SearchStats()
+        tree = compiled.bounded_tree(compiled.index[source], budget, ael, stats)
+        if registry is not None:
+            registry.record_search("reachable", stats)
+        return {compiled.codes[i]: weight for i, weight in tree.items()}
+
+    def reachable_matrix(self, sources: Optional[list[str]], budget: float,
+                         ael: bool = False) -> np.ndarray:
+        """Return the shortest path weights from every station in sources (every station in the
+        system if sources is None) that are at most budget, as an array of shape
+        (len(sources), stations). Element [i, j] is the weight from sources[i] to the j-th station
+        of self.stations, or inf if it is more than budget (or sources[i] is not in the system).
+
+        If precompute has been called, the rows are taken from the JourneyMatrix. Otherwise one
+        bounded search is run per source (see reachability_matrix).
+
+        ael: whether airport express can be used or not.
+        """
+        compiled = self.compile()
+        if sources is None:
+            sources = compiled.codes
+        known = [i for i, code in enumerate(sources) if code in compiled.index]
+        indices = [compiled.index[sources[i]] for i in known]
+        reachable = np.full((len(sources), len(compiled)), float('inf'))
+        if self._matrix is not None:
+            rows = self._matrix.dist[int(ael), indices]
+            reachable[known] = np.where(rows <= budget, rows, float('inf'))
+        else:
+            reachable[known] = reachability_matrix(compiled, indices, budget, ael)
+        return reachable
+
+    def precompute(self, filename: Optional[str] = None) -> JourneyMatrix:
+        """Generate the JourneyMatrix for this system so that journey becomes a table lookup.
+
+        If filename is given and contains tables generated from the same compiled map (see
+        CompiledMap.checksum), they are loaded from it instead. Otherwise the tables are generated
+        and written out to it. A ValueError is raised if filename is given while updates (see
+        close_station etc.) are applied, since the file would not match the data.
+        """
+        if filename is not None and self._updated_connections():
+            raise ValueError(f"The file `{filename}` can not be used while updates are applied.")
+        compiled = self.compile()
+        if filename is not None and os.path.exists(filename):
+            matrix = load_journey_matrix(filename)
+            if matrix.key == compiled.checksum():
+                self._matrix = matrix
+                return matrix
+        self._matrix = generate_journey_matrix(compiled)
+        if filename is not None:
+            self._matrix.save(filename)
+        return self._matrix
+
+    def journey(self, station_start: str, station_end: str,
+                airport_exp: bool = False) -> tuple[Optional[list[str]], float]:
+        """Find the shortest path between 2 stations. If precompute has been called, the path is
+        looked up from the JourneyMatrix, otherwise dijkstra is used. Returns the same values as
+        dijkstra.
+        """
+        if self._matrix is not None:
+            return self._matrix.journey(station_start, station_end, airport_exp)
+        return self.dijkstra(station_start, station_end, airport_exp)
+
+    def dijkstra(self, station_start: str, station_end: str, airport_exp: bool = False,
+                 bidirectional: bool = False) -> tuple[Optional[list[str]], float]:
         """Shortest path algorithm between 2 stations on a system map. This uses heapq from python
         in order to decrease running time. Dijkstra's runtime is based on decrease_key and pop_min
         runtime.
 
+        The search itself is run on the CompiledMap generated by compile (see
+        CompiledMap.shortest_tree).
+
         station_start: station_code of source station
         station_end: station_code of destination station
         airport_express: whether airport express can be used or not.
+        bidirectional: whether to search from both stations at once (see
+        CompiledMap.bidirectional_path), which settles fewer stations on long journeys.
         """
-        if station_start not in self.stations and station_end not in self.stations:
+        if station_start not in self.stations or station_end not in self.stations:
             return (None, 0)
-        q = []
-        visited = {}
-        heappush(q, (0, station_start, None))
-        heappush(q, (float('inf'), None, None))
-        data = (None, 0, False)
-        while q:
-            (dist, cur_station, prev) = heappop(q)
-
-            # This while loop is used because decrease key does not exist for heapq
-            # This works because if the station has been popped from the priority queue already,
-            # it means that the station already had a shorter path to it. And thus it can be
-            # ignored.
-            while cur_station in visited:
-                if len(q) == 0:
-                    # Path was not found
-                    break
-                (dist, cur_station, prev) = heappop(q)
-
-            if cur_station is None:
-                break
-
-            if cur_station == station_end:
-                data = (prev, dist, True)
-                break
-
-            visited[cur_station] = (dist, prev)
-            cur_station_obj = self.stations[cur_station]
-
-            if airport_exp:
-                # Check all neighbours if airport express is allowed
-                neighs = cur_station_obj.neighbours.copy()
-                neighs.update(cur_station_obj.ael_neighbours)
-            else:
-                # Only check regular neighbours
-                neighs = cur_station_obj.neighbours.copy()
-
-            for neigh_code in neighs:
-                neigh = self.stations[neigh_code]
-                heappush(q, (dist + neigh.get_weight(cur_station, airport_exp),
-                             neigh_code, cur_station))
-
-        if data[2]:
-            # If destination was reached, backtrack to generate a path that was taken. NOTE: Prev
-            # is used here to meet PyTa requirements (previous would have been used to avoid
-            # confusion between variables
-            prev = data[0]
-            path = [station_end]
-            while prev is not None:
-                path.append(prev)
-                prev = visited[prev][1]
-            # Reverse the path so that it starts at the source station
-            return (path[::-1], data[1])
-
-        # No path was found
-        return (None, 0)
+        compiled = self.compile()
+        source = compiled.index[station_start]
+        target = compiled.index[station_end]
+        # Search statistics are only counted if instrumentation is turned on (see metrics.py)
+        registry = get_metrics()
+        stats = None if registry is None else SearchStats()
+        if bidirectional:
+            path, weight = compiled.bidirectional_path(source, target, airport_exp, stats)
+        else:
+            dist, prev = compiled.shortest_tree(source, airport_exp, target, stats)
+            path = None if dist[target] == float('inf') else compiled.unpack(prev, target)
+            weight = dist[target]
+        if registry is not None:
+            registry.record_search("bidirectional" if bidirectional else "dijkstra", stats)
+        if path is None:
+            # No path was found
+            return (None, 0)
+        return (path, weight)
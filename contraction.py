@@ -0,0 +1,314 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Contraction Hierarchies
+
+This file contains contraction hierarchies, which make shortest path searches on large networks
+much faster after a one time preprocessing stage.
+
+Info: Stations are removed ("contracted") one at a time, from least to most important. When a
+station is removed, a shortcut edge is added between each pair of its neighbours whose shortest
+path went through it, so that the distances between the remaining stations do not change. A
+search then only ever has to move from less to more important stations, from both ends of the
+journey, which visits a very small part of the network. The shortcuts are replaced by the
+stations they skip over once the path has been found.
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+from heapq import heapify, heappop, heappush
+from typing import Optional
+
+import numpy as np
+
+from classes import CompiledMap, SystemMap
+
+# Most stations settled by each witness search while contracting. If no shorter path (witness)
+# has been found by then, the shortcut is added anyway, which is always correct.
+WITNESS_LIMIT = 100
+
+
+class ContractionHierarchy:
+    """A contraction hierarchy of a system for one airport express mode.
+
+    The upward edges (edges to stations contracted later) of the station with index i are found at
+    positions offsets[i] to offsets[i + 1] - 1 of targets, weights and middles.
+
+    Instance Attributes:
+        - codes: station codes in index order (codes[i] is the station code of station i)
+        - index: a dictionary mapping containing {station_code : index}
+        - airport_exp: whether the airport express was allowed when building the hierarchy
+        - rank: rank[i] is the position station i was contracted in
+        - offsets: start position of each station's upward edges in targets (length is
+        stations + 1)
+        - targets: index of the station at the end of each upward edge
+        - weights: weight of each upward edge
+        - middles: for shortcuts, the index of the station the shortcut skips over (the shortcut
+        replaces the edges to and from it), otherwise -1
+    """
+    codes: list[str]
+    index: dict[str, int]
+    airport_exp: bool
+    rank: list[int]
+    offsets: list[int]
+    targets: list[int]
+    weights: list[float]
+    middles: list[int]
+
+    def __init__(self, codes: list[str], airport_exp: bool, rank: list[int],
+                 upward: tuple[list[int], list[int], list[float], list[int]]) -> None:
+        """Initialize a ContractionHierarchy from already generated upward edges, given as
+        (offsets, targets, weights, middles). See contract and load_contraction_hierarchy.
+        """
+        self.codes = codes
+        self.index = {code: i for i, code in enumerate(codes)}
+        self.airport_exp = airport_exp
+        self.rank = rank
+        self.offsets, self.targets, self.weights, self.middles = upward
+
+    def __len__(self) -> int:
+        """Return the number of stations in this hierarchy."""
+        return len(self.codes)
+
+    def shortcut_count(self) -> int:
+        """Return the number of shortcuts in this hierarchy."""
+        return sum(1 for middle in self.middles if middle != -1)
+
+    def journey(self, station_start: str,
+                station_end: str) -> tuple[Optional[list[str]], float]:
+        """Find the shortest path between 2 stations. Returns the same values as
+        SystemMap.dijkstra.
+        """
+        if station_start not in self.index or station_end not in self.index:
+            return (None, 0)
+        path, weight = self.query(self.index[station_start], self.index[station_end])
+        if path is None:
+            return (None, 0)
+        return ([self.codes[i] for i in path], weight)
+
+    def query(self, source: int, target: int) -> tuple[Optional[list[int]], float]:
+        """Find the shortest path between the stations with indices source and target.
+
+        Both searches only follow upward edges. Each one stops once its queue minimum is at least
+        the best path found so far (a path through a station reached by both searches).
+
+        return: (path, weight) where path is the list of station indices from source to target
+        with every shortcut unpacked, or (None, inf) if there is no path between them.
+        """
+        offsets = self.offsets
+        targets = self.targets
+        weights = self.weights
+        # Index 0 is the search from source and index 1 the search from target
+        dist = ({source: 0}, {target: 0})
+        prev = ({source: -1}, {target: -1})
+        done = (set(), set())
+        queues = ([(0, source)], [(0, target)])
+        best = float('inf')
+        meet = -1
+        while True:
+            side = -1
+            for i in (0, 1):
+                if queues[i] and queues[i][0][0] < best and \
+                        (side == -1 or queues[i][0][0] < queues[side][0][0]):
+                    side = i
+            if side == -1:
+                break
+            (cur_dist, cur) = heappop(queues[side])
+            if cur in done[side]:
+                continue
+            done[side].add(cur)
+            if cur in dist[1 - side] and cur_dist + dist[1 - side][cur] < best:
+                best = cur_dist + dist[1 - side][cur]
+                meet = cur
+            side_dist = dist[side]
+            for edge in range(offsets[cur], offsets[cur + 1]):
+                new_dist = cur_dist + weights[edge]
+                neigh = targets[edge]
+                if new_dist < side_dist.get(neigh, float('inf')):
+                    side_dist[neigh] = new_dist
+                    prev[side][neigh] = cur
+                    heappush(queues[side], (new_dist, neigh))
+        if meet == -1:
+            return (None, best)
+        forward = _backtrack(prev[0], meet)[::-1]
+        backward = _backtrack(prev[1], meet)
+        return (self._unpack(forward + backward[1:]), best)
+
+    def _unpack(self, path: list[int]) -> list[int]:
+        """Return path with every shortcut between consecutive stations replaced by the stations
+        it skips over.
+        """
+        unpacked = [path[0]]
+        # Edges still to be unpacked, the next one at the end
+        stack = [(path[i], path[i + 1]) for i in range(len(path) - 2, -1, -1)]
+        while stack:
+            start, end = stack.pop()
+            middle = self._middle(start, end)
+            if middle == -1:
+                unpacked.append(end)
+            else:
+                stack.append((middle, end))
+                stack.append((start, middle))
+        return unpacked
+
+    def _middle(self, start: int, end: int) -> int:
+        """Return the middle of the upward edge between the stations with indices start and end
+        (stored with whichever was contracted first).
+        """
+        low, high = (start, end) if self.rank[start] < self.rank[end] else (end, start)
+        for edge in range(self.offsets[low], self.offsets[low + 1]):
+            if self.targets[edge] == high:
+                return self.middles[edge]
+        raise ValueError
+
+    def save(self, filename: str) -> None:
+        """Write out the hierarchy to the given filename (as a numpy .npz file) so that it can be
+        loaded later using load_contraction_hierarchy.
+        """
+        with open(filename, 'wb') as file:
+            np.savez(file, codes=np.array(self.codes), airport_exp=np.array(self.airport_exp),
+                     rank=np.array(self.rank, dtype=np.int32),
+                     offsets=np.array(self.offsets, dtype=np.int64),
+                     targets=np.array(self.targets, dtype=np.int32),
+                     weights=np.array(self.weights, dtype=np.float64),
+                     middles=np.array(self.middles, dtype=np.int32))
+
+
+def _backtrack(prev: dict[int, int], station: int) -> list[int]:
+    """Return the stations from station back to the start of the search that generated prev."""
+    path = []
+    while station != -1:
+        path.append(station)
+        station = prev[station]
+    return path
+
+
+def contract(compiled: CompiledMap, airport_exp: bool = False) -> ContractionHierarchy:
+    """Generate the ContractionHierarchy of compiled for the given airport express mode.
+
+    The next station to contract is the one with the lowest priority: the number of shortcuts
+    its contraction would add, minus the number of edges it would remove, plus the number of its
+    neighbours that have already been contracted (so that contractions are spread evenly over the
+    network). Priorities change as stations are contracted, so the priority of the next station
+    is checked again before it is contracted.
+    """
+    weights = compiled.ael_weights if airport_exp else compiled.weights
+    # adj[i] is a dictionary mapping containing {neighbour index : (weight, middle)} for the
+    # stations that have not been contracted yet
+    adj = [{} for _ in range(len(compiled))]
+    for cur in range(len(compiled)):
+        for edge in range(compiled.offsets[cur], compiled.offsets[cur + 1]):
+            neigh = compiled.targets[edge]
+            if weights[edge] != float('inf') and neigh != cur and \
+                    weights[edge] < adj[cur].get(neigh, (float('inf'), -1))[0]:
+                adj[cur][neigh] = (weights[edge], -1)
+    rank = [-1] * len(compiled)
+    upward = [{} for _ in range(len(compiled))]
+    contracted_neighbours = [0] * len(compiled)
+
+    def priority(station: int, shortcuts: list[tuple[int, int, float]]) -> int:
+        """Return the priority of contracting station, which would add the given shortcuts."""
+        return len(shortcuts) - len(adj[station]) + contracted_neighbours[station]
+
+    queue = [(priority(station, _find_shortcuts(adj, station)), station)
+             for station in range(len(compiled))]
+    heapify(queue)
+    while queue:
+        station = heappop(queue)[1]
+        shortcuts = _find_shortcuts(adj, station)
+        new_priority = priority(station, shortcuts)
+        if queue and new_priority > queue[0][0]:
+            heappush(queue, (new_priority, station))
+            continue
+        rank[station] = len(compiled) - len(queue) - 1
+        upward[station] = adj[station]
+        adj[station] = {}
+        for neigh in upward[station]:
+            del adj[neigh][station]
+            contracted_neighbours[neigh] += 1
+        for start, end, weight in shortcuts:
+            if weight < adj[start].get(end, (float('inf'), -1))[0]:
+                adj[start][end] = (weight, station)
+                adj[end][start] = (weight, station)
+
+    offsets = [0]
+    targets = []
+    edge_weights = []
+    middles = []
+    for station in range(len(compiled)):
+        for neigh, (weight, middle) in upward[station].items():
+            targets.append(neigh)
+            edge_weights.append(weight)
+            middles.append(middle)
+        offsets.append(len(targets))
+    return ContractionHierarchy(compiled.codes.copy(), airport_exp, rank,
+                                (offsets, targets, edge_weights, middles))
+
+
+def _find_shortcuts(adj: list[dict[int, tuple[float, int]]],
+                    station: int) -> list[tuple[int, int, float]]:
+    """Return the (start, end, weight) of every shortcut needed to contract station, which is
+    every pair of its neighbours where the path through station is shorter than any path found
+    without it (by a witness search, see _witness_search).
+    """
+    neighbours = list(adj[station].items())
+    shortcuts = []
+    for i in range(len(neighbours) - 1):
+        start, (start_weight, _) = neighbours[i]
+        ends = neighbours[i + 1:]
+        limit = start_weight + max(weight for _, (weight, _) in ends)
+        witness = _witness_search(adj, start, station, limit, {end for end, _ in ends})
+        for end, (end_weight, _) in ends:
+            if witness.get(end, float('inf')) > start_weight + end_weight:
+                shortcuts.append((start, end, start_weight + end_weight))
+    return shortcuts
+
+
+def _witness_search(adj: list[dict[int, tuple[float, int]]], source: int, skip: int,
+                    limit: float, ends: set[int]) -> dict[int, float]:
+    """Run dijkstra from source on the stations that have not been contracted, without going
+    through skip, until every station in ends has been settled, every station closer than limit
+    has been found, or WITNESS_LIMIT stations have been settled.
+
+    return: a dictionary mapping containing {station index : weight of a path to it from source}
+    """
+    dist = {source: 0}
+    done = set()
+    remaining = len(ends)
+    q = [(0, source)]
+    while q and remaining > 0 and len(done) < WITNESS_LIMIT:
+        (cur_dist, cur) = heappop(q)
+        if cur_dist > limit:
+            break
+        if cur in done:
+            continue
+        done.add(cur)
+        if cur in ends:
+            remaining -= 1
+        for neigh, (weight, _) in adj[cur].items():
+            new_dist = cur_dist + weight
+            if neigh != skip and new_dist < dist.get(neigh, float('inf')):
+                dist[neigh] = new_dist
+                heappush(q, (new_dist, neigh))
+    return dist
+
+
+def build_contraction_hierarchy(system: SystemMap,
+                                airport_exp: bool = False) -> ContractionHierarchy:
+    """Generate the ContractionHierarchy of system for the given airport express mode."""
+    return contract(system.compile(), airport_exp)
+
+
+def load_contraction_hierarchy(filename: str) -> ContractionHierarchy:
+    """Load a ContractionHierarchy that was written out by ContractionHierarchy.save."""
+    try:
+        with np.load(filename, allow_pickle=False) as data:
+            return ContractionHierarchy([str(code) for code in data['codes']],
+                                        bool(data['airport_exp']), data['rank'].tolist(),
+                                        (data['offsets'].tolist(), data['targets'].tolist(),
+                                         data['weights'].tolist(), data['middles'].tolist()))
+    except FileNotFoundError:
+        raise Exception(f"The file `{filename}` could not be found.")
@@ -12,23 +12,35 @@ please consult our Course Syllabus.
 This file is Copyright (c) 2021 Vijay Sambamurthy.
 """
 import csv
+import json
+import os
 import urllib.parse
-from collections.abc import Callable
-from typing import Any
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+# Wikipedia API used to look up station coordinates
+WIKI_API = "https://en.wikipedia.org/w/api.php"
 
-def load_utf8_csv(filename: str) -> list[list[str]]:
+# Most requests sent to the API at the same time (and the size of the connection pool)
+MAX_WORKERS = 8
+
+# How many times a failed request is retried, and the backoff factor (seconds) between retries
+RETRIES = 3
+BACKOFF = 0.5
+
+
+def stream_utf8_csv(filename: str) -> Iterator[list[str]]:
     """
-    This function is used mainly for the files provided by the MTR as it exclusively sets the
-    encoding type (read comments in function for more details).
+    Generator version of load_utf8_csv, which yields one row at a time instead of reading the
+    whole file into memory. The header is skipped.
 
     filename: A string containing the filename of the csv file that is to be read and parsed.
-
-    return: a list of lists, each element of the larger list is one row.
     """
-    data = []
     try:
         # Note that 'encoding="utf8"' is required here because the files contain
         # some traditional chinese characters and are encoded with utf8
@@ -39,46 +51,112 @@ def load_utf8_csv(filename: str) -> list[list[str]]:
 
             # Skip the header
             next(reader, None)
-            for row in reader:
-                data.append(row)
+            yield from reader
     except FileNotFoundError:
         raise Exception(f"The file `{filename}` could not be found.")
-    return data
 
 
-def remove_duplicate_stations(data: list[list[str]]) -> list[list[str]]:
-    """Function removes stations if the line code and station combination ahs been seen already.
+def load_utf8_csv(filename: str) -> list[list[str]]:
+    """
+    This function is used mainly for the files provided by the MTR as it exclusively sets the
+    encoding type (read comments in stream_utf8_csv for more details).
+
+    filename: A string containing the filename of the csv file that is to be read and parsed.
+
+    return: a list of lists, each element of the larger list is one row.
+    """
+    return list(stream_utf8_csv(filename))
+
+
+def drop_blank_rows(rows: Iterable[list[str]]) -> Iterator[list[str]]:
+    """Yields every row that is not blank. (The MTR data contains rows of only commas at the end
+    of the file, e.g. ",,,,,,")
+    """
+    for row in rows:
+        if any(cell.strip() for cell in row):
+            yield row
+
+
+def filter_station_names(rows: Iterable[list[str]],
+                         filter_dict: dict[str, str]) -> Iterator[list[str]]:
+    """Yields every row with every incorrect name in the filter generated by generate_filter
+    replaced by its corrected name inside the english station name (column 5).
+    """
+    for row in rows:
+        for incorrect, corrected in filter_dict.items():
+            row[5] = row[5].replace(incorrect, corrected)
+        yield row
+
+
+def unique_stations(rows: Iterable[list[str]]) -> Iterator[list[str]]:
+    """Yields every row whose line code and station code combination has not been seen already.
 
     This is required because the way the MTR gives data means that there is 2 entries per station
     on a line. (One for each direction along the line).
+    """
+    visited = set()
+    for row in rows:
+        comb_code = (row[0], row[2])
+        if comb_code not in visited:
+            visited.add(comb_code)
+            yield row
+
+
+def stream_stations(filename: str,
+                    filter_dict: Optional[dict[str, str]] = None) -> Iterator[list[str]]:
+    """Yields the rows of a stations csv file one at a time, without blank rows or duplicate
+    stations, and with the station names filtered if filter_dict is given.
+    """
+    rows = drop_blank_rows(stream_utf8_csv(filename))
+    if filter_dict is not None:
+        rows = filter_station_names(rows, filter_dict)
+    return unique_stations(rows)
+
+
+def remove_duplicate_stations(data: Iterable[list[str]]) -> list[list[str]]:
+    """Function removes stations if the line code and station combination has been seen already
+    (see unique_stations).
 
     return: a duplicate free version (for the purposes of this program) of the original data.
     """
-    visited = []
-    final = []
-    for row in data:
-        comb_code = row[0] + ":" + row[2]
-        if comb_code not in visited:
-            visited.append(comb_code)
-            final.append(row)
-    return final
+    return list(unique_stations(data))
 
 
-def coordinate_finder(result: requests.Response) -> tuple:
+def coordinates_by_title(result: requests.Response) -> dict[str, tuple]:
+    """
+    Filter function for the send_get_request function, used when multiple titles are looked up
+    in one request (titles separated by "|"). Returns a dictionary {title: (lat, long)} for every
+    requested title that has coordinates. Titles are the titles given in the request, before
+    wikipedia normalizes them.
     """
-    One filter function for the send_get_request function. This filter function is used for
-    getting a tuple (lat, long) from the wikipedia geoData api with type props=coordinate.
-    More information found: https://www.mediawiki.org/wiki/Extension:GeoData
+    query = result.json()['query']
+    original = {entry['to']: entry['from'] for entry in query.get('normalized', [])}
+    coordinates = {}
+    for page in query['pages'].values():
+        if 'coordinates' in page:
+            title = original.get(page['title'], page['title'])
+            coordinates[title] = (page['coordinates'][0]['lat'], page['coordinates'][0]['lon'])
+    return coordinates
+
+
+def create_session(pool_size: int = MAX_WORKERS) -> requests.Session:
+    """Creates a requests Session which keeps up to pool_size connections open so that they can be
+    reused between requests, and retries failed requests (connection errors and server errors)
+    RETRIES times with exponential backoff.
     """
-    json_data = result.json()
-    page_values = json_data['query']['pages'].values()
-    coordinates = list(page_values)[0]['coordinates'][0]
-    return (coordinates['lat'], coordinates['lon'])
+    session = requests.Session()
+    retry = Retry(total=RETRIES, backoff_factor=BACKOFF,
+                  status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
 def send_get_request(url: str,
                      filter_function: Callable[[requests.Response], Any] =
-                     lambda result: result.json()) -> Any:
+                     lambda result: result.json(),
+                     session: Optional[requests.Session] = None) -> Any:
     """
     The function sends a get request to the given url and returns the result based on the filter
     function.
@@ -88,14 +166,20 @@ def send_get_request(url: str,
     url: The url of the address where the get request is to be made to.
     filter_function: A function that takes a requests.Response object and returns a result based on
     the function. This is an optional parameter, and if not supplied, a json response will be sent.
+    session: The session (see create_session) used to send the request. If not supplied, the
+    request is sent without a session.
 
     return: resulting data passed through the filter function
     """
-    res = requests.get(url)
+    if session is None:
+        res = requests.get(url)
+    else:
+        res = session.get(url)
+    res.raise_for_status()
     return filter_function(res)
 
 
-def write_station_csv(data: list[list[str]], filename: str) -> None:
+def write_station_csv(data: Iterable[list[str]], filename: str) -> None:
     """Writes out a list of Station data to the given filename
     """
     with open(filename, 'w+', newline='', encoding='utf8') as file:
@@ -136,58 +220,89 @@ def station_name_filter(name: str, filter_dict: dict[str, str]) -> str:
     return name.replace("-", "–") + " station"
 
 
-def get_stations_coordinates(raw_stations: list[list[str]], filter_file: str) -> None:
+def fetch_coordinates(title: str, session: requests.Session,
+                      api_url: str = WIKI_API) -> tuple:
+    """Looks up the coordinates of the given wikipedia page title. The title with " (MTR)" added
+    to the end (which wikipedia uses for some stations to avoid ambiguity) is looked up in the same
+    request and used if the original title has no coordinates.
+
+    return: a tuple (lat, long)
+    """
+    titles = [title, title + " (MTR)"]
+    request_url = f"{api_url}?action=query&prop=coordinates&" + \
+                  f"titles={urllib.parse.quote('|'.join(titles))}&coprop=country&format=json"
+    coordinates = send_get_request(request_url, coordinates_by_title, session)
+    for option in titles:
+        if option in coordinates:
+            return coordinates[option]
+    raise KeyError(f"No coordinates were found for `{title}`.")
+
+
+def load_coordinate_cache(filename: str) -> dict[str, tuple]:
+    """Loads the coordinates saved by save_coordinate_cache. An empty cache is returned if the file
+    does not exist.
+
+    return: a dictionary {title: (lat, long)}
+    """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, encoding="utf8") as file:
+        return {title: tuple(coords) for title, coords in json.load(file).items()}
+
+
+def save_coordinate_cache(cache: dict[str, tuple], filename: str) -> None:
+    """Writes out the coordinates that have been looked up so far, keyed by title."""
+    with open(filename, 'w+', encoding="utf8") as file:
+        json.dump(cache, file, ensure_ascii=False, indent=1)
+
+
+def get_stations_coordinates(raw_stations: list[list[str]], filter_file: str,
+                             cache_file: Optional[str] = None, api_url: str = WIKI_API,
+                             workers: int = MAX_WORKERS) -> None:
     """Generates coordinates for each station by sending a get request to a wikipedia API.
 
+    Each station name is only looked up once (stations on multiple lines appear more than once)
+    and up to `workers` lookups are sent at the same time over a shared session. Coordinates
+    already saved in cache_file are not looked up again, and new ones are added to it.
+
     raw_stations: data loaded from the MTR information lines_and_stations.csv
     filter_file: file containing filter for generate_filter function.
+    cache_file: file used to save coordinates between runs (see save_coordinate_cache)
+    api_url: address of the wikipedia API (this can be changed to test against a local server)
 
     this function is mutating and does not return any data.
     """
     name_filter = generate_filter(filter_file)
-    total = len(raw_stations)
-    for i in range(total):
-        fixed_name = ""
+    cache = {} if cache_file is None else load_coordinate_cache(cache_file)
+    titles = [station_name_filter(row[5], name_filter) for row in raw_stations]
+    missing = list(dict.fromkeys(title for title in titles if title not in cache))
+    total = len(missing)
+
+    with create_session(workers) as session, ThreadPoolExecutor(workers) as executor:
+        futures = {executor.submit(fetch_coordinates, title, session, api_url): title
+                   for title in missing}
         try:
-            fixed_name = station_name_filter(raw_stations[i][5], name_filter)
-            url_station_name = urllib.parse.quote(fixed_name)
-            request_url = "https://en.wikipedia.org/w/api.php?action=query&prop=coordinates&" + \
-                          f"titles={url_station_name}&coprop=country&format=json"
-            print(request_url)
-
-            coords = send_get_request(request_url, coordinate_finder)
-
-            raw_stations[i].append(coords[0])
-            raw_stations[i].append(coords[1])
-        except KeyError:
-            # In the case that wikipedia added (MTR) to the station name in order to avoid ambiguity
-            print("Original Name failed, trying (MTR) version.")
-            fixed_name += " (MTR)"
-            url_station_name = urllib.parse.quote(fixed_name)
-            request_url = "https://en.wikipedia.org/w/api.php?action=query&prop=coordinates&" + \
-                          f"titles={url_station_name}&coprop=country&format=json"
-            print(request_url)
+            for i, future in enumerate(as_completed(futures)):
+                cache[futures[future]] = future.result()
+                print(f"{i + 1} of {total} stations completed.")
+        finally:
+            # Keep every coordinate found so far, even if a lookup failed
+            if cache_file is not None:
+                save_coordinate_cache(cache, cache_file)
 
-            coords = send_get_request(request_url, coordinate_finder)
-
-            raw_stations[i].append(coords[0])
-            raw_stations[i].append(coords[1])
-
-        print(f"{i + 1} of {total} stations completed.")
+    for row, title in zip(raw_stations, titles):
+        row.append(cache[title][0])
+        row.append(cache[title][1])
 
 
 if __name__ == "__main__":
 
-    # Load raw mtr provided data
-    stations = load_utf8_csv('data/mtr_lines_and_stations.csv')
-    # Remove unwanted empty csv data (There are blank lines at the end of the mtr data)
-    stations = stations[:len(stations) - 3]
-
-    # Remove duplicate stations
-    stations = remove_duplicate_stations(stations)
+    # Load raw mtr provided data, removing unwanted empty csv data (There are blank lines at the
+    # end of the mtr data) and duplicate stations
+    stations = list(stream_stations('data/mtr_lines_and_stations.csv'))
 
     # Add coordinate information
-    get_stations_coordinates(stations, 'data/filter.csv')
+    get_stations_coordinates(stations, 'data/filter.csv', 'data/coordinate_cache.json')
 
     # Write out coordinate new modified data
     write_station_csv(stations, "data/modified_lines_and_stations.csv")
@@ -0,0 +1,132 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Fares
+
+This file contains the FareTable, which stores every fare in mtr_lines_fares.csv in a numpy array
+so that the fares for a journey can be looked up directly instead of searching through the csv
+data.
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+import csv
+import os
+from typing import Optional
+
+import numpy as np
+
+from data_collection import load_utf8_csv
+
+# Number of fare types (columns OCT_ADT_FARE to SINGLE_CON_ELDERLY_FARE in the csv data)
+FARE_TYPES = 8
+
+# Fare types (position in the fares returned by FareTable.lookup)
+OCT_ADT = 0
+OCT_STU = 1
+SING_ADT = 2
+OCT_CON_CHILD = 3
+OCT_CON_ELD = 4
+OCT_CON_PWD = 5
+SING_CON_CHILD = 6
+SINGLE_CON_ELD = 7
+
+
+class FareTable:
+    """Every fare between every pair of stations.
+
+    Instance Attributes:
+        - ids: a dictionary mapping containing {station_id : index}
+        - names: a dictionary mapping containing {english_name : station_id}
+        - fares: array of shape (stations, stations, FARE_TYPES) where fares[src, dst] are the
+        fares from the station at index src to the station at index dst (nan if not available)
+    """
+    ids: dict[int, int]
+    names: dict[str, int]
+    fares: np.ndarray
+
+    def __init__(self, names: dict[str, int], fares: np.ndarray) -> None:
+        """Initialize a FareTable. The index of each station is the order it appears in names.
+        See generate_fare_table and load_fare_table.
+        """
+        self.names = names
+        self.ids = {station_id: i for i, station_id in enumerate(names.values())}
+        self.fares = fares
+
+    def lookup(self, src_id: int, dst_id: int) -> Optional[np.ndarray]:
+        """Return the fares (in the order of the fare types in the csv data) between the stations
+        with the given MTR station ids, or None if there are no fares between them.
+        """
+        if src_id not in self.ids or dst_id not in self.ids:
+            return None
+        fares = self.fares[self.ids[src_id], self.ids[dst_id]]
+        if np.isnan(fares[0]):
+            return None
+        return fares
+
+    def lookup_name(self, src_name: str, dst_name: str) -> Optional[np.ndarray]:
+        """Return the fares between the stations with the given english names, see lookup."""
+        if src_name not in self.names or dst_name not in self.names:
+            return None
+        return self.lookup(self.names[src_name], self.names[dst_name])
+
+    def save(self, prefix: str) -> None:
+        """Write out the fare table to <prefix>.npy (the fares) and <prefix>.csv (the station
+        ids and names) so that it can be memory mapped by load_fare_table.
+        """
+        out = np.lib.format.open_memmap(prefix + ".npy", mode='w+', dtype=np.float32,
+                                        shape=self.fares.shape)
+        out[:] = self.fares
+        out.flush()
+        with open(prefix + ".csv", 'w+', newline='', encoding='utf8') as file:
+            writer = csv.writer(file, delimiter=',')
+            writer.writerow(["Station ID", "English Name"])
+            for name, station_id in self.names.items():
+                writer.writerow([station_id, name])
+
+
+def generate_fare_table(filename: str) -> FareTable:
+    """Generate a FareTable from the mtr_lines_fares.csv data provided by the MTR.
+
+    filename: the fare csv file to be read.
+    """
+    data = load_utf8_csv(filename)
+    names = {}
+    for row in data:
+        names.setdefault(row[0], int(row[1]))
+        names.setdefault(row[2], int(row[3]))
+    table = FareTable(names, np.full((len(names), len(names), FARE_TYPES), np.nan,
+                                     dtype=np.float32))
+    for row in data:
+        table.fares[table.ids[int(row[1])], table.ids[int(row[3])]] = \
+            [float(value) for value in row[4:4 + FARE_TYPES]]
+    return table
+
+
+def load_fare_table(prefix: str) -> FareTable:
+    """Load a FareTable written out by FareTable.save. The fares are memory mapped (read only)
+    rather than read into memory.
+    """
+    try:
+        names = {row[1]: int(row[0]) for row in load_utf8_csv(prefix + ".csv")}
+        return FareTable(names, np.load(prefix + ".npy", mmap_mode='r'))
+    except FileNotFoundError:
+        raise Exception(f"The file `{prefix}.npy` could not be found.")
+
+
+def get_fare_table(filename: str, prefix: str) -> FareTable:
+    """Load the fare table saved at prefix if it is newer than the fare csv file. Otherwise
+    generate it from the csv file and save it at prefix for next time.
+
+    filename: the fare csv file provided by the MTR
+    prefix: location of the saved fare table (see FareTable.save)
+    """
+    if os.path.exists(prefix + ".npy") and os.path.exists(prefix + ".csv") and \
+            os.path.getmtime(prefix + ".npy") >= os.path.getmtime(filename):
+        return load_fare_table(prefix)
+    table = generate_fare_table(filename)
+    table.save(prefix)
+    return table
@@ -0,0 +1,270 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Hub Labels
+
+This file contains hub labels (2-hop distance labels), which answer shortest path weight queries
+between any 2 stations without running a search.
+
+Info: Every station is given a label, which is a list of hub stations along with the weight of
+the shortest path to each of them. The labels are chosen (by pruned landmark labeling) so that
+for every pair of stations, some station on their shortest path is a hub of both. The weight
+between 2 stations is then the lowest total over the hubs their labels have in common, which is
+found by merging the 2 sorted labels. Stations are taken from most to least important when
+generating the labels, and a search is stopped wherever the labels found so far already give the
+right weight, which keeps the labels short.
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+import os
+from bisect import bisect_left
+from heapq import heappop, heappush
+from typing import Optional
+
+import numpy as np
+
+from classes import CompiledMap, SystemMap
+from contraction import contract
+
+# Names of the arrays of a HubLabels, each of which is saved to its own .npy file
+ARRAYS = ["order", "offsets", "hubs", "dists", "parents"]
+
+
+class HubLabels:
+    """Hub labels of a system for both airport express modes.
+
+    The first axis of order and offsets is the airport express mode (0 = not allowed,
+    1 = allowed). The label of the station with index i in mode ael is found at positions
+    offsets[ael, i] to offsets[ael, i + 1] - 1 of hubs, dists and parents, sorted by hub.
+
+    Instance Attributes:
+        - codes: station codes in index order (codes[i] is the station code of station i)
+        - index: a dictionary mapping containing {station_code : index}
+        - order: array of shape (2, stations) where order[ael, r] is the index of the station
+        with rank r (stations with lower ranks are more important)
+        - offsets: array of shape (2, stations + 1) containing the start position of each label
+        - hubs: rank of the hub of each label entry
+        - dists: weight of the shortest path from the station of each label entry to its hub
+        - parents: position of the label entry (with the same hub) of the next station on the
+        shortest path from the station of each label entry to its hub (-1 for the hub itself)
+    """
+    codes: list[str]
+    index: dict[str, int]
+    order: np.ndarray
+    offsets: np.ndarray
+    hubs: np.ndarray
+    dists: np.ndarray
+    parents: np.ndarray
+
+    # Private Instance Attributes:
+    #   - _offsets: offsets as lists, which are faster to index one value at a time
+    #   - _scratch: an array of inf for every rank, used by query to look up a label by hub
+    _offsets: list[list[int]]
+    _scratch: np.ndarray
+
+    def __init__(self, codes: list[str], arrays: dict[str, np.ndarray]) -> None:
+        """Initialize HubLabels from already generated arrays, mapped as {name : array} for every
+        name in ARRAYS. See build_hub_labels and load_hub_labels.
+        """
+        self.codes = codes
+        self.index = {code: i for i, code in enumerate(codes)}
+        # Memory mapped arrays are viewed as plain arrays, which are much faster to slice
+        self.order, self.offsets, self.hubs, self.dists, self.parents = \
+            (np.asarray(arrays[name]) for name in ARRAYS)
+        self._offsets = self.offsets.tolist()
+        self._scratch = np.full(len(codes), float('inf'))
+
+    def __len__(self) -> int:
+        """Return the number of stations with labels."""
+        return len(self.codes)
+
+    def label_size(self, airport_exp: bool = False) -> float:
+        """Return the average number of hubs in a label."""
+        offsets = self._offsets[int(airport_exp)]
+        return (offsets[-1] - offsets[0]) / max(len(self.codes), 1)
+
+    def distance(self, station_start: str, station_end: str, airport_exp: bool = False) -> float:
+        """Return the weight of the shortest path between 2 stations, or inf if there is no path
+        or either station has no label.
+        """
+        if station_start not in self.index or station_end not in self.index:
+            return float('inf')
+        return self.query(self.index[station_start], self.index[station_end], airport_exp)[0]
+
+    def journey(self, station_start: str, station_end: str,
+                airport_exp: bool = False) -> tuple[Optional[list[str]], float]:
+        """Find the shortest path between 2 stations from their labels. Returns the same values as
+        SystemMap.dijkstra.
+        """
+        if station_start not in self.index or station_end not in self.index:
+            return (None, 0)
+        source = self.index[station_start]
+        target = self.index[station_end]
+        weight, hub = self.query(source, target, airport_exp)
+        if hub == -1:
+            return (None, 0)
+        # The path to the hub from target is walked the same way, then turned around
+        positions = self._to_hub(source, hub, airport_exp) + \
+            self._to_hub(target, hub, airport_exp)[-2::-1]
+        # The station of each label entry is the one whose label it falls inside
+        stations = np.searchsorted(self.offsets[int(airport_exp)], positions, 'right') - 1
+        return ([self.codes[station] for station in stations.tolist()], weight)
+
+    def query(self, source: int, target: int, airport_exp: bool = False) -> tuple[float, int]:
+        """Return (weight, hub) where weight is the weight of the shortest path between the
+        stations with index source and target, and hub is the rank of a hub on that path. If there
+        is no path, (inf, -1) is returned.
+
+        The label of source is spread out over _scratch (by hub), so the total through every hub
+        of the label of target is found with a single lookup, and hubs that are not in both
+        labels give inf.
+        """
+        offsets = self._offsets[int(airport_exp)]
+        start_a, end_a = offsets[source], offsets[source + 1]
+        start_b, end_b = offsets[target], offsets[target + 1]
+        hubs_a = self.hubs[start_a:end_a]
+        self._scratch[hubs_a] = self.dists[start_a:end_a]
+        totals = self._scratch[self.hubs[start_b:end_b]] + self.dists[start_b:end_b]
+        self._scratch[hubs_a] = float('inf')
+        if len(totals) == 0:
+            return (float('inf'), -1)
+        best = int(totals.argmin())
+        if totals[best] == float('inf'):
+            return (float('inf'), -1)
+        return (float(totals[best]), int(self.hubs[start_b + best]))
+
+    def _to_hub(self, station: int, hub: int, airport_exp: bool) -> list[int]:
+        """Return the positions of the label entries with the given hub rank of every station on
+        the shortest path from the station with index station to that hub, by following parents.
+        """
+        start = self._offsets[int(airport_exp)][station]
+        position = start + int(np.searchsorted(
+            self.hubs[start:self._offsets[int(airport_exp)][station + 1]], hub))
+        positions = []
+        while position != -1:
+            positions.append(position)
+            position = int(self.parents[position])
+        return positions
+
+    def save(self, directory: str) -> None:
+        """Write out the labels to the given directory (as one numpy .npy file per array) so that
+        they can be loaded later using load_hub_labels. Separate .npy files are used instead of
+        a single .npz file since only .npy files can be memory mapped.
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "codes.npy"), np.array(self.codes))
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+
+
+def importance_order(compiled: CompiledMap, airport_exp: bool = False) -> list[int]:
+    """Return the indices of the stations in compiled from most to least important, which is the
+    reverse of the order they are contracted in by a contraction hierarchy (see contract).
+    Stations contracted last are the ones the most shortest paths go through, so taking them
+    first stops the later searches soonest.
+    """
+    rank = contract(compiled, airport_exp).rank
+    return sorted(range(len(compiled)), key=lambda i: -rank[i])
+
+
+def _pruned_search(compiled: CompiledMap, airport_exp: bool, rank: int, root: int,
+                   labels: list[tuple[list[int], list[float], list[int]]],
+                   root_dists: list[float]) -> None:
+    """Run dijkstra from the station with index root (whose rank is rank) and add root as a hub
+    to the label of every station it reaches. A station is not added to (or searched past) if
+    the labels of it and root already have a common hub giving a path at least as short.
+
+    labels: the (hubs, dists, parents) of each station's label so far, as lists, where parents
+    are the indices of the next station on the shortest path to each hub
+    root_dists: a list of inf for every rank, used to look up the label of root by hub
+    """
+    offsets = compiled.offsets
+    targets = compiled.targets
+    weights = compiled.ael_weights if airport_exp else compiled.weights
+    root_hubs, root_hub_dists, _ = labels[root]
+    for hub, dist in zip(root_hubs, root_hub_dists):
+        root_dists[hub] = dist
+    dist = {root: 0}
+    prev = {root: -1}
+    done = set()
+    q = [(0, root)]
+    while q:
+        (cur_dist, cur) = heappop(q)
+        if cur in done:
+            continue
+        done.add(cur)
+        hubs, hub_dists, parents = labels[cur]
+        if any(root_dists[hub] + hub_dist <= cur_dist for hub, hub_dist in zip(hubs, hub_dists)):
+            continue
+        hubs.append(rank)
+        hub_dists.append(cur_dist)
+        parents.append(prev[cur])
+        for edge in range(offsets[cur], offsets[cur + 1]):
+            new_dist = cur_dist + weights[edge]
+            neigh = targets[edge]
+            if new_dist < dist.get(neigh, float('inf')):
+                dist[neigh] = new_dist
+                prev[neigh] = cur
+                heappush(q, (new_dist, neigh))
+    for hub in root_hubs:
+        root_dists[hub] = float('inf')
+
+
+def build_hub_labels(system: SystemMap) -> HubLabels:
+    """Generate the HubLabels of system for both airport express modes by pruned landmark
+    labeling: a pruned search (see _pruned_search) is run from every station in importance_order.
+    The hubs of each label are added in rank order, so every label ends up sorted by hub.
+
+    Every edge is added in both directions with the same weight (see Line.add_connecion), so one
+    label per station is enough for both directions.
+
+    NOTE: The labels are not updated when the system changes (see SystemMap.close_station), so
+    they must be generated again afterwards.
+    """
+    compiled = system.compile()
+    size = len(compiled)
+    order = np.empty((2, size), dtype=np.int32)
+    offsets = np.zeros((2, size + 1), dtype=np.int64)
+    entries = ([], [], [])
+    for ael in (0, 1):
+        order[ael] = importance_order(compiled, bool(ael))
+        labels = [([], [], []) for _ in range(size)]
+        root_dists = [float('inf')] * size
+        for rank, root in enumerate(order[ael].tolist()):
+            _pruned_search(compiled, bool(ael), rank, root, labels, root_dists)
+        offsets[ael, 0] = len(entries[0])
+        for station, (hubs, dists, _) in enumerate(labels):
+            entries[0].extend(hubs)
+            entries[1].extend(dists)
+            offsets[ael, station + 1] = len(entries[0])
+        # The next station on the path to a hub has the hub in its label (it was searched past),
+        # and every label is sorted by hub, so its entry is found by a binary search
+        starts = offsets[ael].tolist()
+        for hubs, _, parents in labels:
+            entries[2].extend(-1 if parent == -1 else
+                              starts[parent] + bisect_left(labels[parent][0], hub)
+                              for hub, parent in zip(hubs, parents))
+    return HubLabels(compiled.codes.copy(),
+                     {"order": order, "offsets": offsets,
+                      "hubs": np.array(entries[0], dtype=np.int32),
+                      "dists": np.array(entries[1], dtype=np.float64),
+                      "parents": np.array(entries[2], dtype=np.int32)})
+
+
+def load_hub_labels(directory: str, mmap: bool = True) -> HubLabels:
+    """Load HubLabels that were written out by HubLabels.save.
+
+    mmap: whether to memory map the arrays instead of reading them in, so that processes loading
+    the same labels share the memory and only read the parts of the labels they use.
+    """
+    try:
+        codes = [str(code) for code in np.load(os.path.join(directory, "codes.npy"))]
+        return HubLabels(codes, {name: np.load(os.path.join(directory, name + ".npy"),
+                                               mmap_mode='r' if mmap else None)
+                                 for name in ARRAYS})
+    except FileNotFoundError:
+        raise Exception(f"The directory `{directory}` could not be found.")
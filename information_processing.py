@@ -12,14 +12,26 @@ please consult our Course Syllabus.
 This file is Copyright (c) 2021 Vijay Sambamurthy.
 """
 import csv
+from itertools import chain
 
-from classes import SystemMap, Station, Line
+import numpy as np
+
+from classes import SystemMap, Station, Line, get_dists
+from data_collection import generate_filter, stream_stations, stream_utf8_csv, write_station_csv
+from metrics import span
 
 # Parameter to change certain station's positions in order to make the program work with less change
 # required.
 # EXCLUSIONS = { Station_code: new station position (int as a string) }
 EXCLUSIONS = {"LHP": "2.0"}
 
+# File of the station names to be replaced when loading stations, because of a typo seen in the
+# original dataset provided by MTR (see generate_filter in data_collection.py)
+FILTER_FILE = "data/filter.csv"
+
+# Largest difference allowed between the batched (numpy) weights and the weights calculated by geopy
+WEIGHT_TOLERANCE = 1e-6
+
 
 def load_csv_lines(filename: str) -> list[Line]:
     """A function designed to open lines.csv and convert each row into a Line object from classs.py.
@@ -34,7 +46,7 @@ def load_csv_lines(filename: str) -> list[Line]:
         # some traditional chinese characters and are encoded with utf8
         # according to the dataspec provided by the mtr, see:
         # https://opendata.mtr.com.hk/doc/DataDictionary.zip
-        with open(filename, encoding="utf8") as file:
+        with span("load_csv_lines.parse"), open(filename, encoding="utf8") as file:
             reader = csv.reader(file)
             next(reader, None)
             for row in reader:
@@ -44,9 +56,10 @@ def load_csv_lines(filename: str) -> list[Line]:
     return lines
 
 
-def create_connections(current_line: Line, time: bool) -> None:
-    """Creates connections within a line. The function does this by iterating through all possible
-    positions along the line and the connecting each one with the next position.
+def get_connections(current_line: Line) -> list[tuple[Station, Station]]:
+    """Returns the pairs of stations that are connected within a line. The function does this by
+    iterating through all possible positions along the line and the connecting each one with the
+    next position.
 
     EXAMPLE:
         Suppose there is a line with 5 stations, resulting in line.stations as follows:
@@ -59,15 +72,41 @@ def create_connections(current_line: Line, time: bool) -> None:
         Then the program iterates a position, connecting both station2 and station3 to station4.
         Once again, the program iterates, connecting station4 to station5.
     """
+    pairs = []
     for seq in current_line.stations:
         if seq + 1 in current_line.stations:
             for station_a in current_line.stations[seq]:
                 for station_b in current_line.stations[seq + 1]:
                     if station_b.station_code not in EXCLUSIONS:
-                        current_line.add_connecion(station_a, station_b, time)
+                        pairs.append((station_a, station_b))
+    return pairs
+
+
+def create_connections(current_line: Line, time: bool) -> None:
+    """Creates connections within a line between each pair of stations given by get_connections.
+    The distance of each connection is calculated separately using geopy.
+    """
+    for station_a, station_b in get_connections(current_line):
+        current_line.add_connecion(station_a, station_b, time)
 
 
-def load_csv_stations(filename: str, system: SystemMap, time: bool = False) -> None:
+def create_all_connections(lines: list[Line], time: bool) -> None:
+    """Creates connections within every given line, the same as create_connections. However, the
+    distances of all connections are first gathered and calculated together (see get_dists in
+    classes.py), which is much faster than calculating them one at a time.
+    """
+    pairs = [(line, station_a, station_b) for line in lines
+             for station_a, station_b in get_connections(line)]
+    if not pairs:
+        return
+    dists = get_dists(np.array([pair[1].coords for pair in pairs], dtype=np.float64),
+                      np.array([pair[2].coords for pair in pairs], dtype=np.float64))
+    for (line, station_a, station_b), dist in zip(pairs, dists.tolist()):
+        line.add_connecion(station_a, station_b, time, dist)
+
+
+def load_csv_stations(filename: str, system: SystemMap, time: bool = False,
+                      batched: bool = True) -> None:
     """Function that converts a file generated by data_collection.py into a systemMap with
     connections. This function mutates a system and does not return any values.
     It does this by creating each line first, and then setting up the connections in the line using
@@ -75,35 +114,80 @@ def load_csv_stations(filename: str, system: SystemMap, time: bool = False) -> N
 
     filename: file to be read and data to be parsed from
     time: whether to set weights as either time or distance between two stations (True = time)
+    batched: whether the connections of all lines are created together using
+    create_all_connections (True) or one line at a time using create_connections (False)
     """
-    try:
-        # Note that 'encoding="utf8"' is required here because the files contain
-        # some traditional chinese characters and are encoded with utf8
-        # according to the dataspec provided by the mtr, see:
-        # https://opendata.mtr.com.hk/doc/DataDictionary.zip
-        prev_line = Line("", "", 0)
-        with open(filename, encoding="utf8") as file:
-            reader = csv.reader(file)
-            next(reader, None)
-            for row in reader:
-                if row[2] in EXCLUSIONS:
-                    row[6] = EXCLUSIONS[row[2]]
-
-                if prev_line.line_code != row[0]:
-                    if prev_line.line_code != "":
-                        create_connections(prev_line, time)
-                        system.add_line(prev_line)
-                    prev_line = system.lines[row[0]]
-                coords = (float(row[7]), float(row[8]))
-                # Replace is put here because of a typo seen in the original dataset provided by MTR
-                current_station = Station(row[0], row[2],
-                                          row[5].replace("Whampo", "Whampoa"), coords)
-                prev_line.add_station(current_station, int(float(row[6])))
-
-            create_connections(prev_line, time)
-            system.add_line(prev_line)
-    except FileNotFoundError:
-        raise Exception(f"The file `{filename}` could not be found.")
+    loaded = []
+    prev_line = Line("", "", 0)
+    # Each stage is timed if instrumentation is turned on (see metrics.py)
+    with span("load_csv_stations.parse"):
+        # The rows are streamed one at a time (without blank rows or duplicate stations), see
+        # stream_stations in data_collection.py
+        for row in stream_stations(filename, generate_filter(FILTER_FILE)):
+            if row[2] in EXCLUSIONS:
+                row[6] = EXCLUSIONS[row[2]]
+
+            if prev_line.line_code != row[0]:
+                if prev_line.line_code != "":
+                    loaded.append(prev_line)
+                prev_line = system.lines[row[0]]
+            coords = (float(row[7]), float(row[8]))
+            current_station = Station(row[0], row[2], row[5], coords, system.adjacency)
+            prev_line.add_station(current_station, int(float(row[6])))
+        loaded.append(prev_line)
+
+    with span("load_csv_stations.connect"):
+        if batched:
+            create_all_connections(loaded, time)
+        else:
+            for current_line in loaded:
+                create_connections(current_line, time)
+
+    with span("load_csv_stations.add_line"):
+        for current_line in loaded:
+            system.add_line(current_line)
+
+
+def append_to_modified(modified: str, append: str, new: str) -> None:
+    """This function simply combines 2 csvs by adding the entries in them together and writes it out
+    to a new file.
+
+    This is required because the MTR information does not contain a line for walking (i.e. beteween
+    central and Hong Kong station). By adding a custom append.csv, we can account for this and add
+    a "line" of sorts which operates at walking speed.
+    """
+    write_station_csv(chain(stream_utf8_csv(modified), stream_utf8_csv(append)), new)
+
+
+def load_system(lines_file: str, stations_file: str, time: bool = False) -> SystemMap:
+    """Creates a new SystemMap containing the lines in lines_file and the stations (and
+    connections) in stations_file, using load_csv_lines and load_csv_stations.
+
+    time: whether to set weights as either time or distance between two stations (True = time)
+    """
+    system = SystemMap()
+    for current_line in load_csv_lines(lines_file):
+        system.add_line(current_line)
+    load_csv_stations(stations_file, system, time)
+    return system
+
+
+def max_weight_difference(system1: SystemMap, system2: SystemMap) -> float:
+    """Returns the largest difference between the weights of the same connection in two systems
+    loaded from the same data. This is used to check that create_all_connections gives the same
+    weights as create_connections.
+
+    Preconditions:
+        - system1 and system2 contain the same stations and connections
+    """
+    diff = 0.0
+    for code, station in system1.stations.items():
+        other = system2.stations[code]
+        for neighbour, weight in station.neighbours.items():
+            diff = max(diff, abs(weight - other.neighbours[neighbour]))
+        for neighbour, weight in station.ael_neighbours.items():
+            diff = max(diff, abs(weight - other.ael_neighbours[neighbour]))
+    return diff
 
 
 if __name__ == "__main__":
@@ -116,3 +200,12 @@ if __name__ == "__main__":
 
     # Add stations and connections to the system.
     load_csv_stations("data/modified_lines_and_stations.csv", main_system, True)
+
+    # Check the batched weights against the weights calculated one at a time by geopy.
+    geopy_system = SystemMap()
+    for line in load_csv_lines("data/lines.csv"):
+        geopy_system.add_line(line)
+    load_csv_stations("data/modified_lines_and_stations.csv", geopy_system, True, False)
+    difference = max_weight_difference(main_system, geopy_system)
+    print(f"Largest difference from geopy weights: {difference}")
+    assert difference < WEIGHT_TOLERANCE
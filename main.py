@@ -16,28 +16,21 @@ This file is Copyright (c) 2021 Vijay Sambamurthy.
 """
 from typing import Optional
 
+import numpy as np
 import pygame
 from pygame.color import THECOLORS
 
 from classes import SystemMap
-from data_collection import load_utf8_csv, write_station_csv
-from information_processing import load_csv_lines, load_csv_stations
+from data_collection import load_utf8_csv
+from fares import FareTable, get_fare_table, OCT_ADT
+from snapshot import get_systems
+from spatial_index import GridIndex
 from visualization import draw_circle, draw_mappings, draw_path, draw_text, initialize_screen, \
-    SQUARE_SIZE
+    LayeredScreen, SQUARE_SIZE
 
 AEL_BOX_WIDTH = 200
 AEL_BOX_HEIGHT = 50
 
-# Fare types
-OCT_ADT = 4
-OCT_STU = 5
-SING_ADT = 6
-OCT_CON_CHILD = 7
-OCT_CON_ELD = 8
-OCT_CON_PWD = 9
-SING_CON_CHILD = 10
-SINGLE_CON_ELD = 11
-
 
 def generate_box_mapping(data: list[list[str]],
                          coord_data: list[tuple[int, int]]) -> dict[str: tuple[int, int]]:
@@ -61,8 +54,16 @@ def generate_box_mapping(data: list[list[str]],
     return stations
 
 
-def get_click_station(event: pygame.event,
-                      mapped_coords: dict[str: tuple[int, int]]) -> Optional[str]:
+def build_click_index(mapped_coords: dict[str: tuple[int, int]]) -> GridIndex:
+    """Builds the grid index of the click boxes used by get_click_station. Each cell of the grid
+    is the size of a click box.
+
+    mapped_coords: the dictionary generated by generate_box_mapping
+    """
+    return GridIndex(mapped_coords, SQUARE_SIZE)
+
+
+def get_click_station(event: pygame.event, click_index: GridIndex) -> Optional[str]:
     """Based on a click event, this function will return which station was clicked.
 
     It does this by checking if the position was within the click box. Simply put, suppose the click
@@ -74,30 +75,25 @@ def get_click_station(event: pygame.event,
 
     this square size is defined by mapping and the SQUARE_SIZE parameter in visualization.py
 
-    mapped_coords: the dictionary generated by generate_box_mapping
+    Only the click boxes in the grid cells around the click are checked (see GridIndex.box_at in
+    spatial_index.py).
+
+    click_index: the index generated by build_click_index
 
     return: station code in the form of a string
     """
-    for key in mapped_coords:
-        lower_x = mapped_coords[key][0]
-        upper_x = lower_x + SQUARE_SIZE
-        if lower_x <= event.pos[0] <= upper_x:
-            lower_y = mapped_coords[key][1]
-            upper_y = lower_y + SQUARE_SIZE
-            if lower_y <= event.pos[1] <= upper_y:
-                return key
-    return None
+    return click_index.box_at(event.pos, SQUARE_SIZE)
 
 
 def set_station(sta_fr: str, sta_to: str, event: pygame.event,
-                mapped_coords: dict[str: tuple[int, int]]) -> (str, str):
+                click_index: GridIndex) -> (str, str):
     """Based on a click, this function will set either the destination station (right/middle click)
     or the source station (left click) by seeing if a station was clicked on using the
     get_click_station function.
 
     return: updated source station and destination station ids.
     """
-    key = get_click_station(event, mapped_coords)
+    key = get_click_station(event, click_index)
     if key is not None:
         if event.button == 1 and sta_to != key:
             sta_fr = key
@@ -109,7 +105,8 @@ def set_station(sta_fr: str, sta_to: str, event: pygame.event,
 def run_path(sta_fr: str, sta_to: str, system: SystemMap,
              ael_mode: bool) -> Optional[tuple[Optional[list[str]], float]]:
     """This function simply checks if valid entries have been provided for source and destination
-    stations. If so, it will call the dijkstra function from classes.py
+    stations. If so, it will call the journey method from classes.py (which is a table lookup if
+    the system has been precomputed and dijkstra otherwise)
 
     system: the generated system containing all station and line information.
     sta_fr: source station code
@@ -118,12 +115,14 @@ def run_path(sta_fr: str, sta_to: str, system: SystemMap,
     return: returns the same values as dijkstra method in classes.py
     """
     if sta_fr is not sta_to and sta_fr is not None and sta_to is not None:
-        return system.dijkstra(sta_fr, sta_to, ael_mode)
+        return system.journey(sta_fr, sta_to, ael_mode)
     return None
 
 
-def draw_ael_selector(screen: pygame.Surface, ael: bool, pos: tuple[int, int]) -> None:
+def draw_ael_selector(screen: pygame.Surface, ael: bool, pos: tuple[int, int]) -> pygame.Rect:
     """Draws the airport express mode selector button on the screen at the given position
+
+    return: the area of the screen that was drawn on.
     """
     color = "green"
     if ael:
@@ -132,10 +131,10 @@ def draw_ael_selector(screen: pygame.Surface, ael: bool, pos: tuple[int, int]) -
         text = "AIRPORT EXPRESS OFF"
         color = "red"
 
-    pygame.draw.rect(screen, THECOLORS[color], (pos[0], pos[1],
-                                                AEL_BOX_WIDTH, AEL_BOX_HEIGHT), 2)
+    rect = pygame.draw.rect(screen, THECOLORS[color], (pos[0], pos[1],
+                                                       AEL_BOX_WIDTH, AEL_BOX_HEIGHT), 2)
 
-    draw_text(screen, text, (pos[0] + 5, pos[1] + 5))
+    return rect.union(draw_text(screen, text, (pos[0] + 5, pos[1] + 5)))
 
 
 def check_ael_click(event: pygame.event, ael: bool, pos: tuple[int, int]) -> bool:
@@ -149,7 +148,7 @@ def check_ael_click(event: pygame.event, ael: bool, pos: tuple[int, int]) -> boo
 
 
 def set_price_text(path: list[str], weight_raw: float,
-                   system: SystemMap, price_data: list[list[str]], unit: str) -> str:
+                   system: SystemMap, price_data: FareTable, unit: str) -> str:
     """Returns the text for the price based on the given input parameters.
 
     return: String that represents what text to display.
@@ -161,16 +160,67 @@ def set_price_text(path: list[str], weight_raw: float,
         station1_name = system.stations[path[0]].english_name
         station2_name = system.stations[path[-1]].english_name
         # This can be changed from OCT_ADT to any of the constants described at the
-        # top of the file. From the "fare types" section.
+        # top of fares.py. From the "fare types" section.
         text = f"Octopus adult fare from {station1_name} to {station2_name}: " + \
-               str(prices[OCT_ADT]) + f"HK$, this journey is {weight} {unit}(s)"
+               f"{prices[OCT_ADT]:.2f}" + f"HK$, this journey is {weight} {unit}(s)"
     else:
         text = f"This journey is {weight} {unit}(s)"
     return text
 
 
+def draw_base_layer(image: pygame.Surface, boxes: Optional[list[tuple[int, int]]],
+                    size: tuple[int, int]) -> pygame.Surface:
+    """Returns the parts of the main program that never change (the MTR map, the click boxes and
+    the instructions) drawn onto a surface of the given size, so that they are only drawn once.
+
+    boxes: the click boxes to be shown, or None if they should not be shown.
+    """
+    base = pygame.Surface(size).convert()
+    # Draw the MTR Map (on a white background)
+    base.fill(THECOLORS['white'])
+    base.blit(image, (0, 0))
+
+    if boxes is not None:
+        draw_mappings(base, boxes)
+
+    draw_text(base, "Left click to select source, Right click for destination",
+              (20, image.get_height() + 50))
+    return base
+
+
+def draw_frame(layers: LayeredScreen, image: pygame.Surface,
+               mapping: dict[str: tuple[int, int]],
+               state: tuple[list[str], Optional[str], Optional[str], bool, str]) -> None:
+    """Draws one frame of the main program over the base layer (see draw_base_layer) and updates
+    the parts of the display that changed.
+
+    state: Tuple containing (<path generated by dijkstra>, <source station code>, <destination
+    station code>, <airport express mode>, <text describing the journey>)
+    """
+    path, station_start, station_to, ael_mode, text = state
+
+    def draw_overlay(screen: pygame.Surface) -> list[pygame.Rect]:
+        """Draw the parts of the frame that depend on state."""
+        rects = draw_path(screen, path, mapping)
+        # Create button for airport express mode
+        rects.append(draw_ael_selector(screen, ael_mode,
+                                       (image.get_width() - 300, image.get_height() + 30)))
+
+        # Draw clicked stations
+        if station_start is not None:
+            rects.append(draw_circle(screen, mapping[station_start], 'green'))
+
+        if station_to is not None:
+            rects.append(draw_circle(screen, mapping[station_to], 'red'))
+
+        rects.append(draw_text(screen, text, (20, image.get_height() + 20)))
+        return rects
+
+    layers.draw(draw_overlay)
+
+
 def run_main(boxes: list[tuple[int, int]], mapping: dict[str: tuple[int, int]],
-             system: SystemMap, price_data: list[list[str]], params: tuple[str, bool]) -> None:
+             system: SystemMap, price_data: FareTable, params: tuple[str, bool]) -> None:
     """Run the full program.
     Displays an MTR map which can be clicked. Left click sets the source station, right click
     sets the destination station. A visualization of the path will then be generated and shown.
@@ -182,36 +232,18 @@ def run_main(boxes: list[tuple[int, int]], mapping: dict[str: tuple[int, int]],
     image = pygame.image.load(r'data/mtrmap.png')
     screen = initialize_screen((image.get_width(), image.get_height() + 100),
                                [pygame.MOUSEBUTTONDOWN], "Calibration")
+    click_index = build_click_index(mapping)
     station_start = None
     station_to = None
     path = []
     text = ""
     ael_button_pos = (image.get_width() - 300, image.get_height() + 30)
     ael_mode = False
+    layers = LayeredScreen(screen, draw_base_layer(image, boxes if params[1] else None,
+                                                   screen.get_size()))
 
     while True:
-        # Draw the MTR Map (on a white background)
-        screen.fill(THECOLORS['white'])
-        screen.blit(image, (0, 0))
-        draw_path(screen, path, mapping)
-        # Create button for airport express mode
-        draw_ael_selector(screen, ael_mode, ael_button_pos)
-
-        if params[1]:
-            draw_mappings(screen, boxes)
-
-        # Draw clicked stations
-        if station_start is not None:
-            draw_circle(screen, mapping[station_start], 'green')
-
-        if station_to is not None:
-            draw_circle(screen, mapping[station_to], 'red')
-
-        draw_text(screen, text, (20, image.get_height() + 20))
-        draw_text(screen, "Left click to select source, Right click for destination",
-                  (20, image.get_height() + 50))
-
-        pygame.display.flip()
+        draw_frame(layers, image, mapping, (path, station_start, station_to, ael_mode, text))
 
         # Wait for an event (either pygame.MOUSEBUTTONDOWN or pygame.QUIT)
         event = pygame.event.wait()
@@ -219,7 +251,7 @@ def run_main(boxes: list[tuple[int, int]], mapping: dict[str: tuple[int, int]],
         if event.type == pygame.MOUSEBUTTONDOWN:
             ael_mode = check_ael_click(event, ael_mode, ael_button_pos)
             # Handle the click event
-            station_start, station_to = set_station(station_start, station_to, event, mapping)
+            station_start, station_to = set_station(station_start, station_to, event, click_index)
             result = run_path(station_start, station_to, system, ael_mode)
             if result is not None:
                 # If an actual path was generated
@@ -233,35 +265,21 @@ def run_main(boxes: list[tuple[int, int]], mapping: dict[str: tuple[int, int]],
 
 
 def get_price_info(path: list[str], system: SystemMap,
-                   price_data: list[list[str]]) -> Optional[list]:
+                   price_data: FareTable) -> Optional[np.ndarray]:
     """This function takes a path and generates the price listings for the given source and
     destination station by looking them up from the price_info data.
 
-    price_info: the data read from the mtr_lines_fares.csv file
+    price_info: the fare table generated from the mtr_lines_fares.csv file (see fares.py)
     system: a map of the entire system containing stations and lines
     path: path generated by dijkstra algorithm in classes.py
+
+    return: the fares for the journey, indexed by the fare type constants in fares.py.
     """
     if path is None:
         return None
     station_src = system.stations[path[0]].english_name
     station_dst = system.stations[path[-1]].english_name
-    for entry in price_data:
-        if entry[0] == station_src and entry[2] == station_dst:
-            return entry
-    return None
-
-
-def append_to_modified(modified: str, append: str, new: str) -> None:
-    """This function simply combines 2 csvs by adding the entries in them together and writes it out
-    to a new file.
-
-    This is required because the MTR information does not contain a line for walking (i.e. beteween
-    central and Hong Kong station). By adding a custom append.csv, we can account for this and add
-    a "line" of sorts which operates at walking speed.
-    """
-    modified_data = load_utf8_csv(modified)
-    modified_data += load_utf8_csv(append)
-    write_station_csv(modified_data, new)
+    return price_data.lookup_name(station_src, station_dst)
 
 
 def user_select_weight_mode() -> bool:
@@ -282,8 +300,8 @@ if __name__ == "__main__":
     station_data = load_utf8_csv("data/modified_lines_and_stations.csv")
     # Load raw line data
     coords = load_utf8_csv("data/coord_mappings.csv")[::-1]
-    # Load price information
-    price_info = load_utf8_csv("data/mtr_lines_fares.csv")
+    # Load price information (generated from the csv the first time and memory mapped after that)
+    price_info = get_fare_table("data/mtr_lines_fares.csv", "data/fare_table")
 
     tupled_coords = []
     for i in range(len(coords)):
@@ -293,16 +311,12 @@ if __name__ == "__main__":
     # Generate the click box mapping for use later on
     coord_mapping = generate_box_mapping(station_data, tupled_coords)
 
-    # Initialize the system
-    main_system = SystemMap()
-
-    # Add all the lines to the system
-    for line in load_csv_lines("data/lines.csv"):
-        main_system.add_line(line)
-
-    # Append the required modifications to the raw data (read append_to_modified())
-    append_to_modified("data/modified_lines_and_stations.csv",
-                       "data/append.csv", "data/modified_lines_and_stations_APPENDED.csv")
+    # Load the systems (for both units) from the snapshot, or build them if the data has changed.
+    # This also appends the required modifications to the raw data (read append_to_modified() in
+    # information_processing.py)
+    all_systems = get_systems("data/lines.csv", "data/modified_lines_and_stations.csv",
+                              "data/append.csv", "data/modified_lines_and_stations_APPENDED.csv",
+                              "data/system_snapshot.pickle")
 
     # Set the units the user would like.
     unit_bool = user_select_weight_mode()
@@ -311,8 +325,10 @@ if __name__ == "__main__":
     else:
         units = "km"
 
-    # Load the data into the system
-    load_csv_stations("data/modified_lines_and_stations_APPENDED.csv", main_system, unit_bool)
+    main_system = all_systems[unit_bool]
+
+    # Generate (or load) every journey ahead of time so that clicks are simple table lookups.
+    main_system.precompute(f"data/journey_matrix_{units}.npz")
 
     # Change False to True if you would like the click boxes to be shown.
     run_main(tupled_coords, coord_mapping, main_system, price_info, (units, False))
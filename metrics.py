@@ -0,0 +1,172 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Metrics
+
+This file contains the optional instrumentation of the program. While no Metrics registry is
+enabled (the default), nothing is recorded and the searches and loaders run exactly as they
+normally would.
+
+Once enabled (see enable), SystemMap.dijkstra records its search statistics (see SearchStats) and
+the loaders in information_processing.py record how long each of their stages took. These can be
+exported in the Prometheus text format or as JSON, or passed to listener functions as they happen.
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+import json
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Optional
+
+
+class SearchStats:
+    """Statistics of a single search.
+
+    Instance Attributes:
+        - pushes: number of entries pushed onto the priority queue
+        - pops: number of entries popped from the priority queue
+        - stale: number of popped entries that were skipped because their station had already been
+        settled (heapq has no decrease key)
+        - settled: number of stations whose shortest path was found
+        - relaxed: number of edges checked from settled stations
+    """
+    pushes: int
+    pops: int
+    stale: int
+    settled: int
+    relaxed: int
+
+    def __init__(self) -> None:
+        """Initialize SearchStats with every count at 0."""
+        self.pushes = 0
+        self.pops = 0
+        self.stale = 0
+        self.settled = 0
+        self.relaxed = 0
+
+    def as_dict(self) -> dict[str, int]:
+        """Return the statistics as a dictionary {name: count}."""
+        return {"pushes": self.pushes, "pops": self.pops, "stale": self.stale,
+                "settled": self.settled, "relaxed": self.relaxed}
+
+
+class Metrics:
+    """A registry of counters and timing spans.
+
+    Instance Attributes:
+        - counters: a dictionary mapping containing {counter name : total}
+        - spans: a dictionary mapping containing {span name : [times recorded, total seconds]}
+        - listeners: functions called with (name, values) every time a search or span is recorded
+    """
+    counters: dict[str, float]
+    spans: dict[str, list[float]]
+    listeners: list[Callable[[str, dict[str, float]], None]]
+
+    def __init__(self) -> None:
+        """Initialize an empty Metrics registry."""
+        self.counters = {}
+        self.spans = {}
+        self.listeners = []
+
+    def add(self, name: str, value: float = 1) -> None:
+        """Add value to the counter with the given name."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_search(self, name: str, stats: SearchStats) -> None:
+        """Add the statistics of one search to the counters <name>.searches, <name>.pushes, etc."""
+        values = stats.as_dict()
+        self.add(name + ".searches")
+        for key, value in values.items():
+            self.add(f"{name}.{key}", value)
+        for listener in self.listeners:
+            listener(name, values)
+
+    def record_span(self, name: str, seconds: float) -> None:
+        """Record that the span with the given name took the given number of seconds."""
+        span = self.spans.setdefault(name, [0, 0.0])
+        span[0] += 1
+        span[1] += seconds
+        for listener in self.listeners:
+            listener(name, {"seconds": seconds})
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the code run inside a with statement as the span with the given name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.perf_counter() - start)
+
+    def reset(self) -> None:
+        """Remove every recorded counter and span (listeners are kept)."""
+        self.counters = {}
+        self.spans = {}
+
+    def to_json(self) -> str:
+        """Return the counters and spans as a JSON string."""
+        return json.dumps({"counters": self.counters,
+                           "spans": {name: {"count": span[0], "seconds": span[1]}
+                                     for name, span in self.spans.items()}}, indent=2)
+
+    def to_prometheus(self, prefix: str = "mtr") -> str:
+        """Return the counters and spans in the Prometheus text exposition format. Counters are
+        named <prefix>_<name>_total and spans are a summary named <prefix>_span_seconds with the
+        span name as a label.
+        """
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            metric = f"{prefix}_{_metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        if self.spans:
+            lines.append(f"# TYPE {prefix}_span_seconds summary")
+        for name, (count, seconds) in sorted(self.spans.items()):
+            lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {seconds}')
+            lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _metric_name(name: str) -> str:
+    """Return name with every character that is not allowed in a Prometheus metric name replaced
+    by an underscore.
+    """
+    return "".join(char if char.isalnum() or char == "_" else "_" for char in name)
+
+
+# The enabled registry (None while instrumentation is turned off)
+_active: Optional[Metrics] = None
+
+
+def enable(metrics: Optional[Metrics] = None) -> Metrics:
+    """Turn on instrumentation, recording into the given registry (or a new one), and return the
+    registry.
+    """
+    global _active
+    _active = Metrics() if metrics is None else metrics
+    return _active
+
+
+def disable() -> None:
+    """Turn off instrumentation."""
+    global _active
+    _active = None
+
+
+def get_metrics() -> Optional[Metrics]:
+    """Return the enabled registry, or None if instrumentation is turned off."""
+    return _active
+
+
+def span(name: str) -> ContextManager:
+    """Return a context manager timing the span with the given name in the enabled registry, or one
+    that does nothing if instrumentation is turned off.
+    """
+    if _active is None:
+        return nullcontext()
+    return _active.span(name)
@@ -0,0 +1,299 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Multi-Criteria Routing
+
+This file finds every journey between 2 stations that is not beaten in all of journey weight,
+number of line changes and fare by another journey (the Pareto set), in a single search. This
+gives the fastest journey and the journey with the fewest changes together.
+
+Info: Each edge is given the lines that run along it (the line codes its 2 stations share, see
+Station.line_codes). Walking (the lines in WALKING_LINES, or edges whose stations share no line,
+such as temporary walking links) does not count as a line change. Since MTR fares are charged
+from the station a journey enters to the station it leaves, walking out of one station and into
+another starts a new fare.
+
+A search keeps labels (weight, changes, fare so far) instead of a single weight per station.
+Labels are taken from the priority queue in order of weight plus the shortest weight to the
+destination, and a label is dropped as soon as another label at the same station (or a journey
+already found) is at least as good in every criterion.
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+from heapq import heappop, heappush
+from typing import Optional
+
+from classes import CompiledMap, SystemMap, WALKING_LINES
+from fares import FareTable, OCT_ADT
+
+# Line index given to walking edges (see ParetoRouter.edge_lines)
+WALK = -2
+
+# Line index of labels that have not been on a train yet
+NO_LINE = -1
+
+# A journey of the Pareto set, as (path, weight, line changes, fare)
+ParetoJourney = tuple[list[str], float, int, float]
+
+# Journeys whose weights differ by less than this are treated as having the same weight, so that
+# rounding errors do not keep a journey with more changes or a higher fare
+WEIGHT_TOLERANCE = 1e-9
+
+
+class ParetoRouter:
+    """Finds the Pareto set of journeys (see pareto.py) between stations of a system.
+
+    Instance Attributes:
+        - system: the system the journeys are found in (updates to it are seen by the next
+        search)
+        - fares: the fare table used for the fare of each journey, or None to give every journey
+        a fare of 0 (fares missing from the table also count as 0)
+        - fare_type: the fare type used (see the constants in fares.py)
+        - line_codes: line codes in index order (the lines of edge_lines)
+        - walk_links: a dictionary mapping containing {station index : indices of the stations
+        it has a walking edge to}, in the compiled map edge_lines was last generated for
+    """
+    system: SystemMap
+    fares: Optional[FareTable]
+    fare_type: int
+    line_codes: list[str]
+    walk_links: dict[int, list[int]]
+    # Private Instance Attributes:
+    #   - _targets: the edge targets of the compiled map _edge_lines was generated for
+    #   - _edge_lines: the lines of every edge of that compiled map, for each airport express
+    #   mode (see edge_lines)
+    #   - _fare_cache: a dictionary mapping containing {(entry index, exit index) : fare}
+    _targets: Optional[list[int]]
+    _edge_lines: tuple[list[tuple[int, ...]], list[tuple[int, ...]]]
+    _fare_cache: dict[tuple[int, int], float]
+
+    def __init__(self, system: SystemMap, fares: Optional[FareTable] = None,
+                 fare_type: int = OCT_ADT) -> None:
+        """Initialize a ParetoRouter for the given system."""
+        self.system = system
+        self.fares = fares
+        self.fare_type = fare_type
+        self.line_codes = []
+        self.walk_links = {}
+        self._targets = None
+        self._edge_lines = ([], [])
+        self._fare_cache = {}
+
+    def edge_lines(self, compiled: CompiledMap, airport_exp: bool) -> list[tuple[int, ...]]:
+        """Return the indices (in line_codes) of the lines along every edge of compiled, or
+        (WALK,) for walking edges.
+
+        The edges that are only on the airport express (or use the airport express weight, if it
+        is allowed) are given the AEL line, and every other edge is given the lines its stations
+        share other than AEL. The lines are only generated again once the edges of the system
+        change, not when only their weights are updated (see CompiledMap.reweighted).
+        """
+        if compiled.targets is not self._targets:
+            self._fare_cache = {}
+            self.line_codes = list(self.system.lines)
+            line_index = {code: i for i, code in enumerate(self.line_codes)}
+            stations = [self.system.stations[code] for code in compiled.codes]
+            self._edge_lines = ([], [])
+            self.walk_links = {}
+            for cur in range(len(compiled)):
+                for edge in range(compiled.offsets[cur], compiled.offsets[cur + 1]):
+                    shared = set(stations[cur].line_codes).intersection(
+                        stations[compiled.targets[edge]].line_codes)
+                    trains = sorted(line_index[code] for code in shared - WALKING_LINES
+                                    if code != "AEL" and code in line_index)
+                    normal = tuple(trains) if trains else (WALK,)
+                    ael = (line_index["AEL"],) if "AEL" in line_index else normal
+                    self._edge_lines[0].append(ael if compiled.weights[edge] == float('inf')
+                                               else normal)
+                    self._edge_lines[1].append(ael if compiled.ael_weights[edge] !=
+                                               compiled.weights[edge] else normal)
+                    if WALK in self._edge_lines[0][-1] or WALK in self._edge_lines[1][-1]:
+                        self.walk_links.setdefault(cur, []).append(compiled.targets[edge])
+            self._targets = compiled.targets
+        return self._edge_lines[int(airport_exp)]
+
+    def fare(self, compiled: CompiledMap, entry: int, leave: int) -> float:
+        """Return the fare from the station with index entry to the station with index leave."""
+        if self.fares is None or entry == leave:
+            return 0.0
+        if (entry, leave) not in self._fare_cache:
+            found = self.fares.lookup_name(
+                self.system.stations[compiled.codes[entry]].english_name,
+                self.system.stations[compiled.codes[leave]].english_name)
+            self._fare_cache[(entry, leave)] = 0.0 if found is None else \
+                float(found[self.fare_type])
+        return self._fare_cache[(entry, leave)]
+
+    def journeys(self, station_start: str, station_end: str,
+                 airport_exp: bool = False) -> list[ParetoJourney]:
+        """Return the Pareto set of journeys between 2 stations, sorted by weight. The first
+        journey is always a shortest path (the same weight as SystemMap.dijkstra), and no 2
+        journeys have the same weight, changes and fare.
+
+        A label at a station is beaten by another label there that was on the same train line
+        (or no train yet) with at most as many changes, or that was on another line with at least
+        one change fewer, as long as its fare is also at most as high. Labels are grouped by line
+        at each station.
+
+        The fare of a label is only known up to the station its current fare is left at, which is
+        either a walking station or the destination (an exit). So one label's fare is at most
+        another's if its fare so far plus the fare from its entry station to each exit is at most
+        the other's (see _exit_fares), which only needs the fares so far if the entry stations
+        are the same.
+
+        A label is also dropped once a journey already found is at least as good as the best any
+        journey continuing it could be: its weight plus the shortest weight to the destination,
+        its changes and its fare so far plus the lowest remaining fare.
+        """
+        if station_start not in self.system.stations or station_end not in self.system.stations:
+            return []
+        compiled = self.system.compile()
+        source = compiled.index[station_start]
+        target = compiled.index[station_end]
+        lines = self.edge_lines(compiled, airport_exp)
+        offsets = compiled.offsets
+        targets = compiled.targets
+        weights = compiled.ael_weights if airport_exp else compiled.weights
+        # The edges are the same in both directions, so this is the shortest weight from each
+        # station to the target
+        remaining = compiled.shortest_tree(target, airport_exp)[0]
+        if remaining[source] == float('inf'):
+            return []
+        # labels[i] is (weight, changes, fare so far, station, line, fare entry station, index of
+        # the label it was extended from)
+        labels = [(0.0, 0, 0.0, source, NO_LINE, source, -1)]
+        # settled[i] is a dictionary mapping containing {line : [(changes, fare, entry)]} of the
+        # labels at station i that have been taken from the queue
+        settled = [None] * len(compiled)
+        found = []
+        # A dictionary mapping containing {entry : (lowest remaining fare, exit fares)}
+        after_walk = self._after_walk_fares(compiled, target)
+        exit_fares = {source: self._exit_fares(compiled, source, target, after_walk)}
+        q = [(remaining[source], 0, 0.0, 0)]
+        while q:
+            parent = heappop(q)[3]
+            weight, changes, fare, station, line, entry, _ = labels[parent]
+            if station == target:
+                # Journeys are found in order of weight
+                total = fare + self.fare(compiled, entry, target)
+                if not any(other[1] <= changes and other[2] <= total for other in found):
+                    found = [other for other in found
+                             if not (other[0] > weight - WEIGHT_TOLERANCE and
+                                     other[1] >= changes and other[2] >= total)]
+                    found.append((weight, changes, total, parent))
+                continue
+            if _beaten(settled[station], exit_fares, line, entry, changes, fare):
+                continue
+            if settled[station] is None:
+                settled[station] = {}
+            settled[station].setdefault(line, []).append((changes, fare, entry))
+            for edge in range(offsets[station], offsets[station + 1]):
+                neigh = targets[edge]
+                new_weight = weight + weights[edge]
+                estimate = new_weight + remaining[neigh]
+                if estimate == float('inf'):
+                    continue
+                for new_line in lines[edge]:
+                    if new_line == WALK:
+                        new = (new_weight, changes, fare + self.fare(compiled, entry, station),
+                               neigh, line, neigh if self.fares is not None else entry, parent)
+                    else:
+                        new = (new_weight, changes + (line not in (NO_LINE, new_line)), fare,
+                               neigh, new_line, entry, parent)
+                    if new[5] not in exit_fares:
+                        exit_fares[new[5]] = self._exit_fares(compiled, new[5], target,
+                                                              after_walk)
+                    # Any journey continuing this label has at least this weight, changes and
+                    # fare
+                    lowest_fare = new[2] + exit_fares[new[5]][0]
+                    if found and any(other[0] <= estimate and other[1] <= new[1] and
+                                     other[2] <= lowest_fare for other in found):
+                        continue
+                    if settled[neigh] is not None and \
+                            _beaten(settled[neigh], exit_fares, new[4], new[5], new[1], new[2]):
+                        continue
+                    labels.append(new)
+                    heappush(q, (estimate, new[1], new[2], len(labels) - 1))
+        # Fares are stored as float32 in the fare table, so they are rounded to cents as in main.py
+        return [(_path(compiled, labels, journey[3]), journey[0], journey[1],
+                 round(journey[2], 2)) for journey in found]
+
+    def _after_walk_fares(self, compiled: CompiledMap, target: int) -> dict[int, float]:
+        """Return a dictionary mapping containing {station index : lowest fare to target after
+        walking from it} for the stations in walk_links.
+
+        The lowest fare to target from each station walked to (allowing more walking) is found
+        by dijkstra, where going from one of these stations to another costs the fare to a
+        station that walks to it.
+        """
+        if self.fares is None:
+            return {}
+        walked_from = {}
+        for station, ends in self.walk_links.items():
+            for end in ends:
+                walked_from.setdefault(end, []).append(station)
+        lowest = {end: self.fare(compiled, end, target) for end in walked_from}
+        remaining = set(walked_from)
+        while remaining:
+            cur = min(remaining, key=lowest.get)
+            remaining.remove(cur)
+            for other in remaining:
+                lowest[other] = min([lowest[other]] +
+                                    [self.fare(compiled, other, station) + lowest[cur]
+                                     for station in walked_from[cur]])
+        return {station: min(lowest[end] for end in ends)
+                for station, ends in self.walk_links.items()}
+
+    def _exit_fares(self, compiled: CompiledMap, entry: int, target: int,
+                    after_walk: dict[int, float]) -> tuple[float, tuple[float, ...]]:
+        """Return (lowest remaining fare, exit fares) of a label with the given fare entry station
+        on the way to target, where the exit fares are the fares from entry to each station in
+        walk_links and then to target.
+
+        Without walking again the remaining fare is the one from entry to target. Otherwise it is
+        the fare from entry to the station walked from plus the lowest fare after walking from
+        it (see _after_walk_fares).
+        """
+        if self.fares is None:
+            return (0.0, ())
+        fares = tuple(self.fare(compiled, entry, station)
+                      for station in list(self.walk_links) + [target])
+        return (min([fares[-1]] + [fare + after_walk[station] for station, fare
+                                   in zip(self.walk_links, fares)]), fares)
+
+
+def _beaten(settled: Optional[dict[int, list[tuple[int, float, int]]]],
+            exit_fares: dict[int, tuple[float, tuple[float, ...]]], line: int, entry: int,
+            changes: int, fare: float) -> bool:
+    """Return whether a label (see ParetoRouter.journeys) on the given line, entry station,
+    changes and fare so far is beaten by one of the settled labels at its station. Every settled
+    label has at most the weight of the label.
+    """
+    if settled is None:
+        return False
+    for other_line, bucket in settled.items():
+        # A label on another line needs to change lines to continue on this one
+        extra = 0 if other_line in (line, NO_LINE) else 1
+        for other_changes, other_fare, other_entry in bucket:
+            if other_changes + extra > changes:
+                continue
+            if other_entry == entry:
+                if other_fare <= fare:
+                    return True
+            elif all(other_fare + other_exit <= fare + exit_fare for other_exit, exit_fare
+                     in zip(exit_fares[other_entry][1], exit_fares[entry][1])):
+                return True
+    return False
+
+
+def _path(compiled: CompiledMap, labels: list[tuple], label: int) -> list[str]:
+    """Return the station codes on the journey of labels[label], back to the first label."""
+    path = []
+    while label != -1:
+        path.append(compiled.codes[labels[label][3]])
+        label = labels[label][6]
+    return path[::-1]
@@ -0,0 +1,142 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Route Cache
+
+This file contains the RouteCache, which answers journeys from full shortest path trees. Since
+users usually keep the same source station and only change the destination, the tree of a source
+is generated once and every later journey from that source is answered from it.
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from classes import CompiledMap, EdgeChange, SystemMap, affected_trees
+
+
+class RouteCache:
+    """A least recently used cache of shortest path trees, keyed by (source station code, airport
+    express mode, weight mode). When the trees use more than max_bytes, the least recently used
+    trees are removed.
+
+    Instance Attributes:
+        - systems: a dictionary mapping containing {time : system}, where time describes the
+        weights of the system as in load_csv_stations
+        - max_bytes: the most memory (in bytes) the cached trees may use
+        - hits: number of journeys answered from a cached tree
+        - misses: number of journeys that needed a new tree to be generated
+        - evictions: number of trees that were removed to stay within max_bytes
+    """
+    systems: dict[bool, SystemMap]
+    max_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+    # Private Instance Attributes:
+    #   - _trees: the cached (dist, prev) trees (see CompiledMap.shortest_tree), in order of use
+    #   - _compiled: the compiled map of each system the cached trees were generated from
+    #   - _versions: the version of each system the cached trees were generated from
+    #   - _bytes: memory used by the cached trees
+    _trees: OrderedDict[tuple[str, bool, bool], tuple[np.ndarray, np.ndarray]]
+    _compiled: dict[bool, Optional[CompiledMap]]
+    _versions: dict[bool, int]
+    _bytes: int
+
+    def __init__(self, systems: dict[bool, SystemMap], max_bytes: int = 64 * 1024 * 1024) -> None:
+        """Initialize an empty RouteCache for the given systems."""
+        self.systems = systems
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._trees = OrderedDict()
+        self._compiled = {time: None for time in systems}
+        self._versions = {time: 0 for time in systems}
+        self._bytes = 0
+
+    def tree(self, source: str, airport_exp: bool = False,
+             time: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        """Return the full shortest path tree (dist, prev) from source, using the cached tree if
+        there is one.
+
+        Preconditions:
+            - time in self.systems
+            - source in self.systems[time].stations
+        """
+        system = self.systems[time]
+        compiled = system.compile()
+        if compiled is not self._compiled[time]:
+            # The system has changed since the cached trees were generated. If the changes are
+            # known (see SystemMap.changes_since), only the trees they affect are removed.
+            changes = system.changes_since(self._versions[time])
+            if self._compiled[time] is None or changes is None:
+                self.invalidate(time)
+            else:
+                self._invalidate_affected(time, changes)
+            self._compiled[time] = compiled
+            self._versions[time] = system.version
+
+        key = (source, airport_exp, time)
+        if key in self._trees:
+            self.hits += 1
+            self._trees.move_to_end(key)
+            return self._trees[key]
+
+        self.misses += 1
+        dist, prev = compiled.shortest_tree(compiled.index[source], airport_exp)
+        tree = (np.array(dist, dtype=np.float64), np.array(prev, dtype=np.int32))
+        self._trees[key] = tree
+        self._bytes += tree[0].nbytes + tree[1].nbytes
+        while self._bytes > self.max_bytes and len(self._trees) > 1:
+            self._remove(next(iter(self._trees)))
+            self.evictions += 1
+        return tree
+
+    def journey(self, station_start: str, station_end: str, airport_exp: bool = False,
+                time: bool = False) -> tuple[Optional[list[str]], float]:
+        """Find the shortest path between 2 stations from the tree of station_start. Returns the
+        same values as SystemMap.dijkstra.
+        """
+        system = self.systems[time]
+        if station_start not in system.stations or station_end not in system.stations:
+            return (None, 0)
+        dist, prev = self.tree(station_start, airport_exp, time)
+        compiled = self._compiled[time]
+        target = compiled.index[station_end]
+        if dist[target] == float('inf'):
+            # No path was found
+            return (None, 0)
+        return (compiled.unpack(prev, target), float(dist[target]))
+
+    def invalidate(self, time: Optional[bool] = None) -> None:
+        """Remove the cached trees of the system with the given weight mode (or of every system if
+        time is None).
+        """
+        for key in [key for key in self._trees if time is None or key[2] == time]:
+            self._remove(key)
+
+    def _invalidate_affected(self, time: bool, changes: list[EdgeChange]) -> None:
+        """Remove the cached trees of the system with the given weight mode that are affected by
+        the given changes (see affected_trees).
+        """
+        for key in [key for key in self._trees if key[2] == time]:
+            dist, prev = self._trees[key]
+            if affected_trees(dist[np.newaxis], prev[np.newaxis], changes, key[1])[0]:
+                self._remove(key)
+
+    def stats(self) -> dict[str, int]:
+        """Return the counters of this cache, which can be used to choose max_bytes."""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "trees": len(self._trees), "bytes": self._bytes}
+
+    def _remove(self, key: tuple[str, bool, bool]) -> None:
+        """Remove the tree with the given key from the cache."""
+        dist, prev = self._trees.pop(key)
+        self._bytes -= dist.nbytes + prev.nbytes
@@ -0,0 +1,366 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Routing Service
+
+This file runs a headless HTTP service (using asyncio, without pygame) which answers journey, fare
+and nearest station requests with JSON. The systems, fares and station index are loaded once when
+the service starts. Searches are run in a pool of worker processes so that the event loop is never
+blocked by them.
+
+Usage:
+    python routing_service.py --port 8080 --workers 4
+    python routing_service.py --updates data/updates.txt --update-port 8081
+
+Updates (see updates.py) can be read from a file as it is written to, or sent to the update port
+one per line. Each update is applied to the systems straight away, and new searches use the
+updated systems while searches that were already running finish on the old ones. The edge changes
+made by updates are sent to the workers along with each search, and the workers are only restarted
+(with freshly compiled maps) once too many changes have built up.
+
+Endpoints (all GET):
+    /route?from=<station code>&to=<station code>&ael=<0 or 1>&unit=<min or km>
+    /fare?from=<station code>&to=<station code>
+    /nearest?lat=<latitude>&long=<longitude>&k=<number of stations>
+    /stats  (latency of every endpoint)
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
+
+from classes import CompiledMap, EdgeChange, SystemMap, route_from
+from fares import FareTable, get_fare_table, OCT_ADT, OCT_STU, SING_ADT, OCT_CON_CHILD, \
+    OCT_CON_ELD, OCT_CON_PWD, SING_CON_CHILD, SINGLE_CON_ELD
+from snapshot import get_systems
+from spatial_index import GeoIndex, build_station_index
+from updates import apply_update, follow_file, serve_updates
+
+# Names used for each fare type in /fare responses
+FARE_NAMES = {"OCT_ADT": OCT_ADT, "OCT_STU": OCT_STU, "SING_ADT": SING_ADT,
+              "OCT_CON_CHILD": OCT_CON_CHILD, "OCT_CON_ELD": OCT_CON_ELD,
+              "OCT_CON_PWD": OCT_CON_PWD, "SING_CON_CHILD": SING_CON_CHILD,
+              "SINGLE_CON_ELD": SINGLE_CON_ELD}
+
+# Number of recent requests per endpoint that latency statistics are calculated from
+LATENCY_WINDOW = 10000
+
+# Most stations returned by /nearest
+MAX_NEAREST = 50
+
+# Most edge changes sent to the workers along with each search before they are restarted
+MAX_SENT_CHANGES = 200
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    """Exception raised while handling a request, which is sent back to the client with the given
+    HTTP status.
+
+    Instance Attributes:
+        - status: the HTTP status code to respond with
+    """
+    status: int
+
+    def __init__(self, status: int, message: str) -> None:
+        """Initialize a RequestError with the given status and message."""
+        super().__init__(message)
+        self.status = status
+
+
+class LatencyStats:
+    """The latencies (in milliseconds) of the most recent requests to each endpoint.
+
+    Instance Attributes:
+        - counts: a dictionary mapping containing {endpoint : total number of requests}
+        - recent: a dictionary mapping containing {endpoint : latencies of the most recent
+        LATENCY_WINDOW requests}
+    """
+    counts: dict[str, int]
+    recent: dict[str, deque]
+
+    def __init__(self) -> None:
+        """Initialize LatencyStats with no requests recorded."""
+        self.counts = {}
+        self.recent = {}
+
+    def record(self, endpoint: str, latency: float) -> None:
+        """Record one request to endpoint which took latency milliseconds."""
+        self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+        self.recent.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(latency)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Return the request count and mean, median, 99th percentile and max latency (ms) of each
+        endpoint.
+        """
+        summary = {}
+        for endpoint, latencies in self.recent.items():
+            ordered = sorted(latencies)
+            summary[endpoint] = {
+                "count": self.counts[endpoint],
+                "mean_ms": sum(ordered) / len(ordered),
+                "p50_ms": ordered[len(ordered) // 2],
+                "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+                "max_ms": ordered[-1]
+            }
+        return summary
+
+
+# The compiled maps (mapped as {time : compiled map}) used by the worker processes
+_worker_maps: dict[bool, CompiledMap] = {}
+
+# The number of edge changes (mapped as {time : number of changes}) applied to each compiled map
+# in _worker_maps since the worker process was started
+_worker_applied: dict[bool, int] = {}
+
+
+def _init_worker(compiled: dict[bool, CompiledMap]) -> None:
+    """Store the compiled maps in a worker process, so that they are only sent to it once."""
+    _worker_maps.update(compiled)
+    _worker_applied.update((time_mode, 0) for time_mode in compiled)
+
+
+def _find_route(time_mode: bool, source: int, target: int, ael: bool,
+                changes: tuple[EdgeChange, ...]) -> tuple[Optional[list[str]], float]:
+    """Find the shortest path between the stations with the given indices in a worker process.
+
+    changes: every edge change made to the compiled map since the worker process was started, in
+    order. Only the ones that have not been applied in this process yet are applied.
+    """
+    applied = _worker_applied[time_mode]
+    if applied < len(changes):
+        compiled = _worker_maps[time_mode]
+        new = changes[applied:]
+        # Walking links can add edges which the compiled map of this process does not have yet
+        new_edges = [(source_a, target_a) for source_a, target_a, *_ in new
+                     if compiled.edge(source_a, target_a) == -1]
+        if new_edges:
+            compiled = compiled.with_edges(new_edges)
+        _worker_maps[time_mode] = compiled.reweighted(
+            {compiled.edge(source_a, target_a): (weight, ael_weight)
+             for source_a, target_a, _, weight, _, ael_weight in new})
+        _worker_applied[time_mode] = len(changes)
+    return route_from(_worker_maps[time_mode], source, [target], ael)[0]
+
+
+class RoutingService:
+    """The data and worker pool used to answer requests.
+
+    Instance Attributes:
+        - systems: a dictionary mapping containing {time : system}
+        - fares: the fare table used for /fare
+        - station_index: the index used for /nearest
+        - executor: the pool of processes that searches are run in
+        - latency: latencies of the requests handled so far
+    """
+    systems: dict[bool, SystemMap]
+    fares: FareTable
+    station_index: GeoIndex
+    executor: ProcessPoolExecutor
+    latency: LatencyStats
+
+    # Private Instance Attributes:
+    #   - _workers: number of worker processes
+    #   - _versions: a dictionary mapping containing {time : version of the system whose compiled
+    #   map the workers were started with}
+    #   - _changes: a dictionary mapping containing {time : every edge change made to the system
+    #   since the workers were started}
+    _workers: int
+    _versions: dict[bool, int]
+    _changes: dict[bool, tuple[EdgeChange, ...]]
+
+    def __init__(self, systems: dict[bool, SystemMap], fares: FareTable, workers: int) -> None:
+        """Initialize the service and start its worker processes."""
+        self.systems = systems
+        self.fares = fares
+        self.station_index = build_station_index(systems[True])
+        self._workers = workers
+        self.executor = self._start_executor()
+        self.latency = LatencyStats()
+
+    def _start_executor(self) -> ProcessPoolExecutor:
+        """Return a new pool of worker processes searching the current compiled maps."""
+        compiled = {time_mode: system.compile() for time_mode, system in self.systems.items()}
+        self._versions = {time_mode: system.version for time_mode, system in self.systems.items()}
+        self._changes = {time_mode: () for time_mode in self.systems}
+        return ProcessPoolExecutor(self._workers, initializer=_init_worker, initargs=(compiled,))
+
+    def apply_update(self, line: str) -> bool:
+        """Apply the given update line to the systems (see apply_update in updates.py).
+
+        The edge changes made by the update are sent to the workers along with new searches (see
+        _find_route), so the workers are kept. They are only replaced by a new pool with the
+        updated compiled maps once more than MAX_SENT_CHANGES changes have been made (or the
+        changes are not known, see SystemMap.changes_since), and the old pool is shut down once
+        the searches already sent to it have finished.
+        """
+        versions = {time_mode: system.version for time_mode, system in self.systems.items()}
+        if not apply_update(self.systems, line):
+            return False
+        # Updates that change nothing (e.g. opening a station that is open) keep the same version
+        changes = {time_mode: system.changes_since(self._versions[time_mode])
+                   for time_mode, system in self.systems.items()
+                   if system.version != versions[time_mode]}
+        if any(new is None or len(new) > MAX_SENT_CHANGES for new in changes.values()):
+            old_executor = self.executor
+            self.executor = self._start_executor()
+            old_executor.shutdown(wait=False)
+        else:
+            self._changes.update((time_mode, tuple(new)) for time_mode, new in changes.items())
+        return True
+
+    async def handle(self, path: str) -> tuple[int, Any]:
+        """Handle the request for the given path (including the query string) and return the
+        (HTTP status, JSON data) of the response.
+        """
+        url = urllib.parse.urlsplit(path)
+        params = {key: values[0] for key, values in urllib.parse.parse_qs(url.query).items()}
+        endpoints = {"/route": self.route, "/fare": self.fare, "/nearest": self.nearest}
+        start = time.perf_counter()
+        try:
+            if url.path == "/stats":
+                return (200, self.latency.summary())
+            if url.path not in endpoints:
+                raise RequestError(404, f"Unknown endpoint `{url.path}`.")
+            return (200, await endpoints[url.path](params))
+        except RequestError as error:
+            return (error.status, {"error": str(error)})
+        finally:
+            if url.path in endpoints:
+                self.latency.record(url.path, (time.perf_counter() - start) * 1000)
+
+    async def route(self, params: dict[str, str]) -> dict[str, Any]:
+        """Find the journey between the stations in params["from"] and params["to"]."""
+        time_mode = params.get("unit", "min") != "km"
+        system = self.systems[time_mode]
+        src, dst = self._stations(params, system)
+        compiled = system.compile()
+        path, weight = await asyncio.get_running_loop().run_in_executor(
+            self.executor, _find_route, time_mode, compiled.index[src], compiled.index[dst],
+            params.get("ael", "0") in ("1", "true"), self._changes[time_mode])
+        if path is None:
+            raise RequestError(404, f"No path was found from `{src}` to `{dst}`.")
+        return {"from": src, "to": dst, "path": path, "weight": weight,
+                "unit": "min" if time_mode else "km"}
+
+    async def fare(self, params: dict[str, str]) -> dict[str, Any]:
+        """Look up the fares between the stations in params["from"] and params["to"]."""
+        system = self.systems[True]
+        src, dst = self._stations(params, system)
+        prices = self.fares.lookup_name(system.stations[src].english_name,
+                                        system.stations[dst].english_name)
+        if prices is None:
+            raise RequestError(404, f"No fares were found from `{src}` to `{dst}`.")
+        return {"from": src, "to": dst,
+                "fares": {name: round(float(prices[i]), 2) for name, i in FARE_NAMES.items()}}
+
+    async def nearest(self, params: dict[str, str]) -> list[dict[str, Any]]:
+        """Find the params["k"] (default 1) stations closest to (params["lat"], params["long"])."""
+        try:
+            coord = (float(params["lat"]), float(params["long"]))
+            k = min(int(params.get("k", "1")), MAX_NEAREST)
+        except (KeyError, ValueError):
+            raise RequestError(400, "`lat` and `long` (and optionally `k`) must be numbers.")
+        if not (math.isfinite(coord[0]) and math.isfinite(coord[1])):
+            raise RequestError(400, "`lat` and `long` must be finite numbers.")
+        if k < 1:
+            raise RequestError(400, "`k` must be at least 1.")
+        return [{"station": code, "name": self.systems[True].stations[code].english_name,
+                 "km": dist} for code, dist in self.station_index.nearest(coord, k)]
+
+    def _stations(self, params: dict[str, str], system: SystemMap) -> tuple[str, str]:
+        """Return the (from, to) station codes in params, checking that they exist in system."""
+        for key in ("from", "to"):
+            if params.get(key) not in system.stations:
+                raise RequestError(400, f"`{key}` must be a valid station code.")
+        return (params["from"], params["to"])
+
+    async def serve_client(self, reader: asyncio.StreamReader,
+                           writer: asyncio.StreamWriter) -> None:
+        """Answer the HTTP requests sent over one connection until it is closed."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3 or parts[0] != "GET":
+                    status, data = (400, {"error": "Only GET requests are supported."})
+                else:
+                    try:
+                        status, data = await self.handle(parts[1])
+                    except Exception as error:
+                        status, data = (500, {"error": str(error)})
+                keep_alive = headers.get("connection", "").lower() != "close" and \
+                    parts[-1:] == ["HTTP/1.1"]
+                body = json.dumps(data).encode("utf8")
+                writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(body)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                             .encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def run_service(service: RoutingService, host: str, port: int,
+                      updates_file: Optional[str] = None,
+                      update_port: Optional[int] = None) -> None:
+    """Serve requests on host:port until the process is stopped. Updates are read from
+    updates_file and accepted on update_port if they are given (see updates.py).
+    """
+    server = await asyncio.start_server(service.serve_client, host, port)
+    print(f"Routing service listening on {host}:{port}")
+    tasks = []
+    if updates_file is not None:
+        tasks.append(asyncio.create_task(follow_file(updates_file, service.apply_update)))
+    if update_port is not None:
+        tasks.append(asyncio.create_task(serve_updates(service.apply_update, host, update_port)))
+        print(f"Accepting updates on {host}:{update_port}")
+    async with server:
+        await asyncio.gather(server.serve_forever(), *tasks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve MTR journeys over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=2, help="number of search processes")
+    parser.add_argument("--updates", help="file to read updates from as it is written to")
+    parser.add_argument("--update-port", type=int, help="port to accept updates on")
+    args = parser.parse_args()
+
+    all_systems = get_systems("data/lines.csv", "data/modified_lines_and_stations.csv",
+                              "data/append.csv", "data/modified_lines_and_stations_APPENDED.csv",
+                              "data/system_snapshot.pickle")
+    fare_table = get_fare_table("data/mtr_lines_fares.csv", "data/fare_table")
+    routing_service = RoutingService(all_systems, fare_table, args.workers)
+    try:
+        asyncio.run(run_service(routing_service, args.host, args.port, args.updates,
+                                args.update_port))
+    finally:
+        routing_service.executor.shutdown()
@@ -0,0 +1,98 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Snapshots
+
+This file saves fully built SystemMaps (for both time and distance weights) to a single binary
+file so that later runs of the program can load them directly instead of parsing the csv files and
+calculating every weight again.
+
+A snapshot is tied to the contents of the csv files it was built from. If any of them change (or
+the snapshot format changes), the snapshot is ignored and has to be rebuilt.
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+import hashlib
+import os
+import pickle
+from typing import Optional
+
+from classes import SystemMap
+from information_processing import FILTER_FILE, append_to_modified, load_system
+
+# Increase this whenever SystemMap (or any of the classes it contains) changes so that old
+# snapshots are rebuilt.
+SNAPSHOT_VERSION = 3
+
+
+def hash_files(filenames: list[str]) -> str:
+    """Returns a hash of the contents of the given files (in order). This is used as the key of a
+    snapshot.
+    """
+    digest = hashlib.sha256()
+    for filename in filenames:
+        try:
+            with open(filename, 'rb') as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+        except FileNotFoundError:
+            raise Exception(f"The file `{filename}` could not be found.")
+    return digest.hexdigest()
+
+
+def save_snapshot(filename: str, key: str, systems: dict[bool, SystemMap]) -> None:
+    """Write out the given systems to filename along with the snapshot version and key.
+
+    systems: a dictionary mapping containing {time : system}, where time describes the weights of
+    the system as in load_csv_stations.
+    """
+    for system in systems.values():
+        # Compile now so that the compiled maps are saved in the snapshot as well.
+        system.compile()
+    # Write to a temporary file first so that other processes never load half of a snapshot.
+    with open(filename + ".tmp", 'wb') as file:
+        pickle.dump((SNAPSHOT_VERSION, key), file, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(systems, file, pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + ".tmp", filename)
+
+
+def load_snapshot(filename: str, key: str) -> Optional[dict[bool, SystemMap]]:
+    """Load the systems saved by save_snapshot. None is returned if the file does not exist or was
+    saved with a different snapshot version or key.
+
+    NOTE: snapshots are loaded with pickle, so only snapshots written by this program should be
+    loaded.
+    """
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as file:
+        try:
+            if pickle.load(file) != (SNAPSHOT_VERSION, key):
+                return None
+            return pickle.load(file)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            # The snapshot is damaged or refers to classes that no longer exist.
+            return None
+
+
+def get_systems(lines_file: str, modified: str, append: str, new: str,
+                snapshot_file: str) -> dict[bool, SystemMap]:
+    """Returns the system with time weights and the system with distance weights, mapped as
+    {time : system}.
+
+    These are loaded from snapshot_file if it was built from the current versions of the given
+    files and FILTER_FILE. Otherwise, the modifications are appended to the raw data (see
+    append_to_modified), both systems are built from the csv files and then saved to snapshot_file
+    for next time.
+    """
+    key = hash_files([lines_file, modified, append, FILTER_FILE])
+    systems = load_snapshot(snapshot_file, key)
+    if systems is None:
+        append_to_modified(modified, append, new)
+        systems = {True: load_system(lines_file, new, True),
+                   False: load_system(lines_file, new, False)}
+        save_snapshot(snapshot_file, key, systems)
+    return systems
@@ -0,0 +1,225 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Spatial Index
+
+This file contains grid indexes which find the points (click boxes on the screen or stations on the
+earth) around a position without checking every single point.
+
+Info: The space is split into square cells of the same size, and each point is stored in the cell
+it lies in. A search then only has to look at the cells around the position it was given.
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+import math
+from heapq import nsmallest
+from typing import Optional
+
+from classes import SystemMap, get_great_circle_dist
+
+# Approximate km per degree of latitude, used to project coordinates onto a flat grid
+KM_PER_DEGREE = 110.574
+
+# Projected distances are within this factor of great circle distances (for areas the size of a
+# city or region), so searches on the grid are widened by it before checking the real distances.
+PROJECTION_MARGIN = 1.1
+
+
+class GridIndex:
+    """A grid index of named points in a flat 2D space (e.g. pixels).
+
+    Instance Attributes:
+        - cell_size: width and height of each cell of the grid
+        - points: a dictionary mapping containing {key : (x, y)}
+    """
+    cell_size: float
+    points: dict[str, tuple[float, float]]
+    # Private Instance Attributes:
+    #   - _cells: a dictionary mapping containing {(column, row) : keys of the points in the cell}
+    #   - _order: the position of each key in points, used to break ties the same way every time
+    #   - _bounds: the (min column, min row, max column, max row) of all cells containing points
+    _cells: dict[tuple[int, int], list[str]]
+    _order: dict[str, int]
+    _bounds: tuple[int, int, int, int]
+
+    def __init__(self, points: dict[str, tuple[float, float]], cell_size: float) -> None:
+        """Initialize a GridIndex containing the given points.
+
+        Preconditions:
+            - cell_size > 0
+        """
+        self.cell_size = cell_size
+        self.points = points
+        self._cells = {}
+        self._order = {}
+        for key, point in points.items():
+            self._order[key] = len(self._order)
+            self._cells.setdefault(self._cell(point), []).append(key)
+        if self._cells:
+            columns = [cell[0] for cell in self._cells]
+            rows = [cell[1] for cell in self._cells]
+            self._bounds = (min(columns), min(rows), max(columns), max(rows))
+        else:
+            self._bounds = (0, 0, -1, -1)
+
+    def add(self, key: str, point: tuple[float, float]) -> None:
+        """Add a point to the index after it has been created.
+
+        Preconditions:
+            - key not in self.points
+        """
+        self.points[key] = point
+        self._order[key] = len(self._order)
+        cell = self._cell(point)
+        self._cells.setdefault(cell, []).append(key)
+        if len(self._cells) == 1 and len(self._cells[cell]) == 1:
+            self._bounds = (cell[0], cell[1], cell[0], cell[1])
+        else:
+            self._bounds = (min(self._bounds[0], cell[0]), min(self._bounds[1], cell[1]),
+                            max(self._bounds[2], cell[0]), max(self._bounds[3], cell[1]))
+
+    def box_at(self, pos: tuple[float, float], box_size: float) -> Optional[str]:
+        """Return the key of the point whose box contains pos, where each point is the top left
+        corner of a square box of width box_size. If multiple boxes contain pos, the one whose
+        point was given first is returned. None is returned if no box contains pos.
+        """
+        found = None
+        for key in self._keys_between((pos[0] - box_size, pos[1] - box_size), pos):
+            point = self.points[key]
+            if point[0] <= pos[0] <= point[0] + box_size and \
+                    point[1] <= pos[1] <= point[1] + box_size:
+                if found is None or self._order[key] < self._order[found]:
+                    found = key
+        return found
+
+    def within(self, pos: tuple[float, float], radius: float) -> list[tuple[str, float]]:
+        """Return (key, distance) for every point at most radius away from pos, closest first."""
+        results = []
+        for key in self._keys_between((pos[0] - radius, pos[1] - radius),
+                                      (pos[0] + radius, pos[1] + radius)):
+            dist = math.dist(pos, self.points[key])
+            if dist <= radius:
+                results.append((dist, self._order[key], key))
+        return [(key, dist) for dist, _, key in sorted(results)]
+
+    def nearest(self, pos: tuple[float, float], k: int = 1) -> list[tuple[str, float]]:
+        """Return (key, distance) for the k points closest to pos, closest first.
+
+        The cells are searched in growing square rings around the cell of pos. The search stops
+        once k points have been found that are closer than anything in the next ring could be.
+        """
+        if k <= 0 or not self.points:
+            return []
+        column, row = self._cell(pos)
+        max_ring = max(column - self._bounds[0], self._bounds[2] - column,
+                       row - self._bounds[1], self._bounds[3] - row, 0)
+        found = []
+        ring = 0
+        while ring <= max_ring:
+            for cell in _ring_cells(column, row, ring):
+                for key in self._cells.get(cell, []):
+                    found.append((math.dist(pos, self.points[key]), self._order[key], key))
+            # Every point in a later ring is at least this far away from pos
+            if len(found) >= k and nsmallest(k, found)[-1][0] <= ring * self.cell_size:
+                break
+            ring += 1
+        return [(key, dist) for dist, _, key in nsmallest(k, found)]
+
+    def _cell(self, point: tuple[float, float]) -> tuple[int, int]:
+        """Return the (column, row) of the cell containing point."""
+        return (math.floor(point[0] / self.cell_size), math.floor(point[1] / self.cell_size))
+
+    def _keys_between(self, low: tuple[float, float], high: tuple[float, float]) -> list[str]:
+        """Return the keys of every point in the cells overlapping the rectangle from low to
+        high.
+        """
+        low_cell = self._cell(low)
+        high_cell = self._cell(high)
+        keys = []
+        for column in range(max(low_cell[0], self._bounds[0]),
+                            min(high_cell[0], self._bounds[2]) + 1):
+            for row in range(max(low_cell[1], self._bounds[1]),
+                             min(high_cell[1], self._bounds[3]) + 1):
+                keys.extend(self._cells.get((column, row), []))
+        return keys
+
+
+def _ring_cells(column: int, row: int, ring: int) -> list[tuple[int, int]]:
+    """Return the cells that are exactly ring cells away (horizontally or vertically) from the
+    given cell.
+    """
+    if ring == 0:
+        return [(column, row)]
+    cells = []
+    for i in range(-ring, ring + 1):
+        cells.append((column + i, row - ring))
+        cells.append((column + i, row + ring))
+    for i in range(-ring + 1, ring):
+        cells.append((column - ring, row + i))
+        cells.append((column + ring, row + i))
+    return cells
+
+
+class GeoIndex:
+    """A grid index of named points on the earth, given as (lat, long) coordinates. Distances are
+    in km.
+
+    The coordinates are projected onto a flat grid (equirectangular projection) to find the
+    candidate points, and the returned distances are great circle distances (see
+    get_great_circle_dist in classes.py).
+
+    Instance Attributes:
+        - coords: a dictionary mapping containing {key : (lat, long)}
+        - grid: the GridIndex of the projected coordinates (in km)
+        - long_scale: km per degree of longitude used by the projection
+    """
+    coords: dict[str, tuple[float, float]]
+    grid: GridIndex
+    long_scale: float
+
+    def __init__(self, coords: dict[str, tuple[float, float]], cell_km: float = 1.0) -> None:
+        """Initialize a GeoIndex containing the given coordinates, with cells of cell_km km.
+
+        Preconditions:
+            - cell_km > 0
+        """
+        self.coords = coords
+        mean_lat = sum(coord[0] for coord in coords.values()) / len(coords) if coords else 0.0
+        self.long_scale = KM_PER_DEGREE * math.cos(math.radians(mean_lat))
+        self.grid = GridIndex({key: self._project(coord) for key, coord in coords.items()},
+                              cell_km)
+
+    def nearest(self, coord: tuple[float, float], k: int = 1) -> list[tuple[str, float]]:
+        """Return (key, km) for the k points closest to coord, closest first.
+
+        The k closest points on the grid give an upper bound for the distance of the k closest
+        points, and every point within that distance is then checked.
+        """
+        found = self.grid.nearest(self._project(coord), k)
+        if not found:
+            return []
+        furthest = max(get_great_circle_dist(coord, self.coords[key]) for key, _ in found)
+        return self.within(coord, furthest)[:k]
+
+    def within(self, coord: tuple[float, float], radius: float) -> list[tuple[str, float]]:
+        """Return (key, km) for every point at most radius km away from coord, closest first."""
+        results = []
+        for key, _ in self.grid.within(self._project(coord), radius * PROJECTION_MARGIN):
+            dist = get_great_circle_dist(coord, self.coords[key])
+            if dist <= radius:
+                results.append((key, dist))
+        # sorted is stable, so points at the same distance stay in the order they were given
+        return sorted(results, key=lambda result: result[1])
+
+    def _project(self, coord: tuple[float, float]) -> tuple[float, float]:
+        """Project coord onto the flat grid (in km)."""
+        return (coord[1] * self.long_scale, coord[0] * KM_PER_DEGREE)
+
+
+def build_station_index(system: SystemMap, cell_km: float = 1.0) -> GeoIndex:
+    """Return a GeoIndex of the coordinates of every station in system, keyed by station code."""
+    return GeoIndex({code: station.coords for code, station in system.stations.items()}, cell_km)
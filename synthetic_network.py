@@ -0,0 +1,263 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Synthetic Networks
+
+This file generates made up networks of any size, written out in the same format as the MTR data
+(lines.csv, the stations csv and the fares csv), so that the rest of the program can be tested on
+networks much larger than the MTR.
+
+The same parameters and seed always generate exactly the same files.
+
+Usage:
+    python synthetic_network.py data/synthetic_10k --size 10k --seed 1
+
+Info: Each line starts at a station of an earlier line and moves in a slowly turning direction,
+adding a station about every STOP_SPACING km. Some stops join a nearby station of another line
+instead of adding a new one (an interchange). An express line (using the line code AEL, so that it
+is treated the same as the Airport Express) connects some of the busiest interchanges, and walking
+links (line code WLK, the same as data/append.csv) join nearby stations.
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+import argparse
+import csv
+import math
+import os
+import random
+from typing import Optional
+
+from data_collection import write_station_csv
+from fares import FARE_TYPES
+from spatial_index import GridIndex, KM_PER_DEGREE
+
+# Position of the centre of every generated network (lat, long)
+ORIGIN = (22.35, 114.15)
+
+# Average distance between consecutive stations on a line (km)
+STOP_SPACING = 1.2
+
+# Speeds (km/h) of the generated lines, the express line and walking links
+LINE_SPEEDS = (80, 80, 120)
+EXPRESS_SPEED = 135
+WALKING_SPEED = 4
+
+# Furthest distance (km) between 2 stations joined by a walking link
+WALKING_DISTANCE = 0.8
+
+# Fares are only generated between the stations with the lowest ids, since a full fare table
+# grows with the square of the number of stations (see FareTable).
+FARE_STATIONS = 500
+
+# Parameters (lines, stations per line, express stops, walking links) generating networks of about
+# the given number of stations (with the default interchange density)
+SIZES = {
+    "1k": (50, 22, 10, 20),
+    "10k": (250, 44, 20, 200),
+    "100k": (1000, 110, 40, 2000)
+}
+
+
+class SyntheticNetwork:
+    """A generated network, in the same form as the csv data.
+
+    Instance Attributes:
+        - lines: rows of lines.csv (line code, line speed, line name)
+        - stations: rows of the stations csv, in the same columns as
+        data/modified_lines_and_stations_APPENDED.csv
+        - positions: a dictionary mapping containing {station code : (x, y)} where x and y are
+        the km east and north of ORIGIN
+    """
+    lines: list[list[str]]
+    stations: list[list[str]]
+    positions: dict[str, tuple[float, float]]
+
+    def __init__(self) -> None:
+        """Initialize an empty SyntheticNetwork."""
+        self.lines = []
+        self.stations = []
+        self.positions = {}
+
+    def coords(self, code: str) -> tuple[float, float]:
+        """Return the (lat, long) of the station with the given code."""
+        x, y = self.positions[code]
+        lat = ORIGIN[0] + y / KM_PER_DEGREE
+        return (round(lat, 6),
+                round(ORIGIN[1] + x / (KM_PER_DEGREE * math.cos(math.radians(ORIGIN[0]))), 6))
+
+    def add_line_rows(self, line_code: str, codes: list[str], sequences: list[int]) -> None:
+        """Add a row to stations for each of the given stations on the given line."""
+        for code, seq in zip(codes, sequences):
+            station_id = int(code[1:])
+            lat, long = self.coords(code)
+            self.stations.append([line_code, "DT", code, str(station_id), f"站{station_id}",
+                                  f"Station {station_id}", f"{seq:.2f}", str(lat), str(long)])
+
+
+def generate_network(lines: int, stations_per_line: int, seed: int, interchange: float = 0.1,
+                     express_stops: int = 0, walking_links: int = 0) -> SyntheticNetwork:
+    """Generate a network of the given number of lines, each with stations_per_line stations.
+
+    interchange: chance of each stop joining a nearby station of another line, instead of adding a
+    new station
+    express_stops: number of stations on the express line (no express line is generated if this
+    is less than 2)
+    walking_links: number of walking links between pairs of nearby stations
+
+    Preconditions:
+        - lines > 0 and stations_per_line > 1
+        - 0 <= interchange <= 1
+    """
+    rand = random.Random(seed)
+    network = SyntheticNetwork()
+    # Stations are spread over a square whose area grows with the number of stops
+    half_width = math.sqrt(lines * stations_per_line) * STOP_SPACING / 2
+    index = GridIndex(network.positions, STOP_SPACING)
+    line_counts = {}
+
+    def new_station(pos: tuple[float, float]) -> str:
+        """Add a new station at pos and return its code."""
+        code = f"S{len(network.positions) + 1}"
+        index.add(code, pos)
+        line_counts[code] = 0
+        return code
+
+    for number in range(1, lines + 1):
+        line_code = f"L{number}"
+        network.lines.append([line_code, str(rand.choice(LINE_SPEEDS)), f"Line {number}"])
+        pos = (rand.uniform(-half_width, half_width), rand.uniform(-half_width, half_width))
+        heading = rand.uniform(0, 2 * math.pi)
+        codes = []
+        for _ in range(stations_per_line):
+            code = None
+            if not codes and network.positions:
+                # Lines start at a station of an earlier line so that the network is connected
+                code = f"S{rand.randint(1, len(network.positions))}"
+            elif codes and rand.random() < interchange:
+                code = next((key for key, _ in index.within(pos, STOP_SPACING)
+                             if key not in codes), None)
+            if code is None:
+                code = new_station(pos)
+            codes.append(code)
+            line_counts[code] += 1
+            pos = network.positions[code]
+            heading += rand.gauss(0, 0.3)
+            step = STOP_SPACING * rand.uniform(0.7, 1.3)
+            pos = (pos[0] + step * math.cos(heading), pos[1] + step * math.sin(heading))
+            if abs(pos[0]) > half_width or abs(pos[1]) > half_width:
+                # Turn back towards the centre of the network
+                heading += math.pi
+                pos = (max(-half_width, min(half_width, pos[0])),
+                       max(-half_width, min(half_width, pos[1])))
+        network.add_line_rows(line_code, codes, list(range(1, len(codes) + 1)))
+
+    if express_stops >= 2:
+        network.lines.append(["AEL", str(EXPRESS_SPEED), "Express Line"])
+        # The busiest interchanges, from west to east
+        busiest = sorted(line_counts, key=lambda key: (-line_counts[key], int(key[1:])))
+        codes = sorted(busiest[:express_stops], key=lambda key: network.positions[key])
+        network.add_line_rows("AEL", codes, list(range(1, len(codes) + 1)))
+
+    if walking_links > 0:
+        network.lines.append(["WLK", str(WALKING_SPEED), "Walking"])
+        network.add_line_rows("WLK", *_walking_pairs(network, index, walking_links, rand))
+    return network
+
+
+def _walking_pairs(network: SyntheticNetwork, index: GridIndex, links: int,
+                   rand: random.Random) -> tuple[list[str], list[int]]:
+    """Return the (station codes, sequences) of the rows of up to links walking links.
+
+    Each link is given its own 2 sequences, with a gap between links so that they are not
+    connected to each other (see get_connections in information_processing.py). A station is only
+    used by one link, since rows repeating a station on the same line are removed when loading.
+    """
+    codes = []
+    sequences = []
+    used = set()
+    candidates = list(network.positions)
+    rand.shuffle(candidates)
+    for start in candidates:
+        if len(codes) >= links * 2:
+            break
+        if start in used:
+            continue
+        end = next((key for key, _ in index.within(network.positions[start], WALKING_DISTANCE)
+                    if key != start and key not in used), None)
+        if end is not None:
+            used.update((start, end))
+            codes.extend((start, end))
+            sequences.extend((len(sequences) // 2 * 3 + 1, len(sequences) // 2 * 3 + 2))
+    return (codes, sequences)
+
+
+def generate_fares(network: SyntheticNetwork,
+                   fare_stations: int = FARE_STATIONS) -> list[list[str]]:
+    """Return the rows of a fares csv (in the same columns as data/mtr_lines_fares.csv) between
+    every pair of the fare_stations stations with the lowest ids. Fares grow with the straight line
+    distance between the stations.
+    """
+    codes = sorted(network.positions, key=lambda key: int(key[1:]))[:fare_stations]
+    rows = []
+    for src in codes:
+        for dst in codes:
+            adult = 0.0
+            if src != dst:
+                adult = round(4.0 + 0.55 * math.dist(network.positions[src],
+                                                     network.positions[dst]), 1)
+            single = math.ceil(adult * 2) / 2
+            fares = [adult, round(adult / 2, 1), single, round(adult / 2, 1), min(adult, 2.0),
+                     min(adult, 2.0), round(single / 2, 1), round(single / 2, 1)]
+            rows.append([f"Station {src[1:]}", src[1:], f"Station {dst[1:]}", dst[1:]] +
+                        [f"{fare:.2f}" for fare in fares[:FARE_TYPES]])
+    return rows
+
+
+def write_network(directory: str, network: SyntheticNetwork,
+                  fare_stations: int = FARE_STATIONS) -> None:
+    """Write out the network to <directory>/lines.csv, <directory>/stations.csv and
+    <directory>/fares.csv.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "lines.csv"), 'w+', newline='', encoding='utf8') as file:
+        writer = csv.writer(file, delimiter=',')
+        writer.writerow(["Line Code", "Line Speed", "Line Name"])
+        writer.writerows(network.lines)
+    write_station_csv(network.stations, os.path.join(directory, "stations.csv"))
+    with open(os.path.join(directory, "fares.csv"), 'w+', newline='', encoding='utf8') as file:
+        writer = csv.writer(file, delimiter=',')
+        writer.writerow(["SRC_STATION_NAME", "SRC_STATION_ID", "DEST_STATION_NAME",
+                         "DEST_STATION_ID", "OCT_ADT_FARE", "OCT_STD_FARE", "SINGLE_ADT_FARE",
+                         "OCT_CON_CHILD_FARE", "OCT_CON_ELDERLY_FARE", "OCT_CON_PWD_FARE",
+                         "SINGLE_CON_CHILD_FARE", "SINGLE_CON_ELDERLY_FARE"])
+        writer.writerows(generate_fares(network, fare_stations))
+
+
+def generate_size(directory: str, size: str, seed: int,
+                  interchange: Optional[float] = None) -> SyntheticNetwork:
+    """Generate a network of one of the SIZES and write it out to directory (see
+    write_network).
+    """
+    lines, per_line, express, walking = SIZES[size]
+    network = generate_network(lines, per_line, seed, 0.1 if interchange is None else interchange,
+                               express, walking)
+    write_network(directory, network)
+    return network
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic MTR-style network.")
+    parser.add_argument("directory", help="folder to write the csv files to")
+    parser.add_argument("--size", choices=list(SIZES), default="1k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--interchange", type=float, help="chance of each stop being an "
+                                                          "interchange (default: 0.1)")
+    args = parser.parse_args()
+
+    generated = generate_size(args.directory, args.size, args.seed, args.interchange)
+    print(f"Generated {len(generated.positions)} stations on {len(generated.lines)} lines "
+          f"in {args.directory}")
@@ -0,0 +1,368 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Timetable Routing
+
+This file contains a timetable of the trains in a system and the Connection Scan Algorithm, which
+finds the earliest arrival at every station for a given departure time. Unlike
+SystemMap.dijkstra, journeys include the time spent waiting for each train.
+
+Info: A connection is one train moving from one station to the next, with a departure and an
+arrival time. Every connection is stored in flat lists sorted by departure time, so a query is a
+single pass over the connections that depart after the departure time. A connection is taken if
+the train was already boarded earlier or if its departure station has been reached by then. The
+scan stops once the connections depart after the earliest arrival at the destination.
+
+No real timetable data is needed: generate_timetable builds one from the station sequence of each
+line and the line speeds in lines.csv, with trains leaving both ends of every route once per
+headway.
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+from bisect import bisect_left
+from typing import Optional
+
+import numpy as np
+
+from classes import Line, Station, SystemMap, WALKING_LINES, get_dists
+from information_processing import get_connections
+
+# Times are in minutes after midnight. Trains start running at SERVICE_START and the last ones
+# leave the ends of their routes at SERVICE_END.
+SERVICE_START = 6 * 60
+SERVICE_END = 24 * 60
+
+# Minutes between trains on each route of a line, for lines not in HEADWAYS
+DEFAULT_HEADWAY = 4
+HEADWAYS = {"AEL": 10, "DRL": 8}
+
+
+class Timetable:
+    """A timetable of every train in a system.
+
+    A route is the sequence of stations one train stops at (a line with a branch has a route for
+    each branch, in each direction). The stations of route r are found at positions
+    route_offsets[r] to route_offsets[r + 1] - 1 of route_stops and route_times, and the walking
+    links of the station with index i at positions walk_offsets[i] to walk_offsets[i + 1] - 1 of
+    walk_targets and walk_times.
+
+    Instance Attributes:
+        - codes: station codes in index order (codes[i] is the station code of station i)
+        - index: a dictionary mapping containing {station_code : index}
+        - dep_times: departure time of each connection (sorted)
+        - arr_times: arrival time of each connection
+        - dep_stops: index of the station each connection departs from
+        - arr_stops: index of the station each connection arrives at
+        - trips: the trip (train) running each connection
+        - trip_routes: the route of each trip
+        - trip_starts: the time each trip leaves the first station of its route
+        - route_offsets: start position of each route's stations in route_stops (length is
+        routes + 1)
+        - route_stops: index of each station on each route, in the order they are visited
+        - route_times: minutes from the first station of the route until leaving each station
+        - route_lines: line code of each route
+        - walk_offsets: start position of each station's walking links in walk_targets (length is
+        stations + 1)
+        - walk_targets: index of the station at the end of each walking link
+        - walk_times: minutes taken by each walking link
+    """
+    codes: list[str]
+    index: dict[str, int]
+    dep_times: list[float]
+    arr_times: list[float]
+    dep_stops: list[int]
+    arr_stops: list[int]
+    trips: list[int]
+    trip_routes: list[int]
+    trip_starts: list[float]
+    route_offsets: list[int]
+    route_stops: list[int]
+    route_times: list[float]
+    route_lines: list[str]
+    walk_offsets: list[int]
+    walk_targets: list[int]
+    walk_times: list[float]
+    # Private Instance Attributes:
+    #   - _ael_trips: whether each trip runs on the airport express
+    _ael_trips: list[bool]
+
+    def __init__(self, codes: list[str],
+                 connections: tuple[list[float], list[float], list[int], list[int], list[int]],
+                 trips: tuple[list[int], list[float]],
+                 routes: tuple[list[int], list[int], list[float], list[str]],
+                 walks: tuple[list[int], list[int], list[float]]) -> None:
+        """Initialize a Timetable from already generated connections, given as (dep_times,
+        arr_times, dep_stops, arr_stops, trips) sorted by departure time, trips, given as
+        (trip_routes, trip_starts), routes, given as (route_offsets, route_stops, route_times,
+        route_lines), and walking links, given as (walk_offsets, walk_targets, walk_times). See
+        generate_timetable and load_timetable.
+        """
+        self.codes = codes
+        self.index = {code: i for i, code in enumerate(codes)}
+        self.dep_times, self.arr_times, self.dep_stops, self.arr_stops, self.trips = connections
+        self.trip_routes, self.trip_starts = trips
+        self.route_offsets, self.route_stops, self.route_times, self.route_lines = routes
+        self.walk_offsets, self.walk_targets, self.walk_times = walks
+        self._ael_trips = [self.route_lines[route] == "AEL" for route in self.trip_routes]
+
+    def __len__(self) -> int:
+        """Return the number of connections in this timetable."""
+        return len(self.dep_times)
+
+    def journey(self, station_start: str, station_end: str, departure: float,
+                airport_exp: bool = False) -> tuple[Optional[list[str]], float]:
+        """Find the journey between 2 stations leaving station_start at departure (minutes after
+        midnight) that arrives the earliest. Returns the same values as SystemMap.dijkstra, except
+        that the weight is the number of minutes from departure until arriving at station_end
+        (including waiting for trains).
+        """
+        if station_start not in self.index or station_end not in self.index:
+            return (None, 0)
+        source = self.index[station_start]
+        target = self.index[station_end]
+        arrival, reached_by = self.scan(source, departure, target, airport_exp)
+        if arrival[target] == float('inf'):
+            return (None, 0)
+        return ([self.codes[i] for i in self._backtrack(source, target, arrival, reached_by)],
+                arrival[target] - departure)
+
+    def earliest_arrivals(self, station_start: str, departure: float,
+                          airport_exp: bool = False) -> dict[str, float]:
+        """Return the earliest arrival time (minutes after midnight) at every station that can be
+        reached from station_start leaving at departure, as a dictionary mapping containing
+        {station_code : arrival time}.
+        """
+        if station_start not in self.index:
+            return {}
+        arrival = self.scan(self.index[station_start], departure, -1, airport_exp)[0]
+        return {self.codes[i]: time for i, time in enumerate(arrival) if time != float('inf')}
+
+    def scan(self, source: int, departure: float, target: int = -1,
+             airport_exp: bool = False) -> tuple[list[float], list[int]]:
+        """Run the Connection Scan Algorithm from the station with index source, leaving at
+        departure. If target is given, the scan stops once no connection can arrive at the
+        target earlier. Otherwise every connection after departure is scanned.
+
+        Walking links are only followed one at a time (a station reached by walking is not walked
+        on from), which finds every walk as long as no 2 walking links share a station.
+
+        return: (arrival, reached_by) where arrival[i] is the earliest arrival time at station i
+        and reached_by[i] is the connection that arrived at station i at that time (or the
+        station it was walked to from, as -2 - station index, or -1 for the source and unreached
+        stations).
+        """
+        dep_times = self.dep_times
+        arr_times = self.arr_times
+        dep_stops = self.dep_stops
+        arr_stops = self.arr_stops
+        trips = self.trips
+        ael_trips = self._ael_trips
+        arrival = [float('inf')] * len(self.codes)
+        reached_by = [-1] * len(self.codes)
+        boarded = set()
+        arrival[source] = departure
+        self._walk(source, arrival, reached_by)
+        for conn in range(bisect_left(dep_times, departure), len(dep_times)):
+            dep = dep_times[conn]
+            if target != -1 and dep >= arrival[target]:
+                break
+            trip = trips[conn]
+            if trip not in boarded:
+                if arrival[dep_stops[conn]] > dep or (ael_trips[trip] and not airport_exp):
+                    continue
+                boarded.add(trip)
+            stop = arr_stops[conn]
+            if arr_times[conn] < arrival[stop]:
+                arrival[stop] = arr_times[conn]
+                reached_by[stop] = conn
+                self._walk(stop, arrival, reached_by)
+        return (arrival, reached_by)
+
+    def _walk(self, stop: int, arrival: list[float], reached_by: list[int]) -> None:
+        """Update the arrival times of the stations that can be walked to from stop."""
+        for link in range(self.walk_offsets[stop], self.walk_offsets[stop + 1]):
+            neigh = self.walk_targets[link]
+            if arrival[stop] + self.walk_times[link] < arrival[neigh]:
+                arrival[neigh] = arrival[stop] + self.walk_times[link]
+                reached_by[neigh] = -2 - stop
+
+    def _backtrack(self, source: int, target: int, arrival: list[float],
+                   reached_by: list[int]) -> list[int]:
+        """Return the station indices on the journey found by scan from source to target,
+        including the stations each train passes through.
+
+        Each train is boarded at the last station before the one it was taken to that was reached
+        (by another train or walking) in time to board it. Boarding any earlier gives the same
+        arrival times, but may go back and forth through the same stations.
+        """
+        path = [target]
+        stop = target
+        while stop != source:
+            conn = reached_by[stop]
+            if conn < -1:
+                stop = -2 - conn
+                path.append(stop)
+                continue
+            trip = self.trips[conn]
+            route = self.trip_routes[trip]
+            position = self.route_stops.index(stop, self.route_offsets[route],
+                                              self.route_offsets[route + 1]) - 1
+            while True:
+                stop = self.route_stops[position]
+                path.append(stop)
+                if reached_by[stop] < 0 or self.trips[reached_by[stop]] != trip:
+                    if arrival[stop] <= self.trip_starts[trip] + self.route_times[position]:
+                        break
+                position -= 1
+        return path[::-1]
+
+    def save(self, filename: str) -> None:
+        """Write out the timetable to the given filename (as a numpy .npz file) so that it can be
+        loaded later using load_timetable.
+        """
+        with open(filename, 'wb') as file:
+            np.savez(file, codes=np.array(self.codes),
+                     dep_times=np.array(self.dep_times, dtype=np.float64),
+                     arr_times=np.array(self.arr_times, dtype=np.float64),
+                     dep_stops=np.array(self.dep_stops, dtype=np.int32),
+                     arr_stops=np.array(self.arr_stops, dtype=np.int32),
+                     trips=np.array(self.trips, dtype=np.int32),
+                     trip_routes=np.array(self.trip_routes, dtype=np.int32),
+                     trip_starts=np.array(self.trip_starts, dtype=np.float64),
+                     route_offsets=np.array(self.route_offsets, dtype=np.int64),
+                     route_stops=np.array(self.route_stops, dtype=np.int32),
+                     route_times=np.array(self.route_times, dtype=np.float64),
+                     route_lines=np.array(self.route_lines),
+                     walk_offsets=np.array(self.walk_offsets, dtype=np.int64),
+                     walk_targets=np.array(self.walk_targets, dtype=np.int32),
+                     walk_times=np.array(self.walk_times, dtype=np.float64))
+
+
+def get_routes(line: Line) -> list[list[Station]]:
+    """Return every route of the given line in one direction: each path along the connections of
+    the line (see get_connections) from a station with no connection from an earlier position to
+    one with no connection to a later position.
+    """
+    following = {}
+    has_earlier = set()
+    for station_a, station_b in get_connections(line):
+        following.setdefault(station_a.station_code, []).append(station_b)
+        has_earlier.add(station_b.station_code)
+    routes = []
+    stack = [[station] for seq in sorted(line.stations, reverse=True)
+             for station in line.stations[seq]
+             if station.station_code in following and station.station_code not in has_earlier]
+    while stack:
+        route = stack.pop()
+        if route[-1].station_code in following:
+            stack.extend(route + [station] for station in following[route[-1].station_code])
+        else:
+            routes.append(route)
+    return routes
+
+
+def generate_timetable(system: SystemMap, headways: Optional[dict[str, float]] = None,
+                       start: float = SERVICE_START, end: float = SERVICE_END) -> Timetable:
+    """Generate a Timetable of the lines in system, where trains leave both ends of every route
+    (see get_routes) every headway minutes from start until end.
+
+    Trains take the same time between stations as the time weights of load_csv_stations (the
+    distance at the line's operating speed, plus 1 minute at the station). The lines in
+    WALKING_LINES become walking links instead, at the same speed.
+
+    headways: a dictionary mapping containing {line_code : minutes between trains}, used instead
+    of HEADWAYS and DEFAULT_HEADWAY for the lines it contains
+    """
+    headways = HEADWAYS if headways is None else {**HEADWAYS, **headways}
+    codes = list(system.stations)
+    index = {code: i for i, code in enumerate(codes)}
+    route_lines = []
+    route_stops = []
+    walks = []
+    for line in system.lines.values():
+        if line.line_code in WALKING_LINES:
+            walks.extend((line, station_a, station_b)
+                         for station_a, station_b in get_connections(line))
+            continue
+        for route in get_routes(line):
+            for stations in (route, route[::-1]):
+                route_lines.append(line)
+                route_stops.append(stations)
+
+    # The time between every pair of consecutive stations is calculated together (see get_dists)
+    segments = [(stations[i], stations[i + 1]) for stations in route_stops
+                for i in range(len(stations) - 1)] + [walk[1:] for walk in walks]
+    dists = get_dists(np.array([pair[0].coords for pair in segments], dtype=np.float64),
+                      np.array([pair[1].coords for pair in segments], dtype=np.float64))
+    speeds = np.array([line.operating_speed for line, stations in zip(route_lines, route_stops)
+                       for _ in range(len(stations) - 1)] +
+                      [walk[0].operating_speed for walk in walks], dtype=np.float64)
+    times = dists / speeds * 60 + 1
+
+    columns = ([], [], [], [], [])
+    trip_routes = []
+    trip_starts = []
+    route_times = []
+    position = 0
+    for route, (line, stations) in enumerate(zip(route_lines, route_stops)):
+        stops = np.array([index[station.station_code] for station in stations], dtype=np.int32)
+        elapsed = np.concatenate(([0], np.cumsum(times[position:position + len(stations) - 1])))
+        position += len(stations) - 1
+        route_times.extend(elapsed.tolist())
+        departures = np.arange(start, end + 1e-9, headways.get(line.line_code, DEFAULT_HEADWAY))
+        first_trip = len(trip_routes)
+        trip_routes.extend([route] * len(departures))
+        trip_starts.extend(departures.tolist())
+        columns[0].append((departures[:, None] + elapsed[:-1]).ravel())
+        columns[1].append((departures[:, None] + elapsed[1:]).ravel())
+        columns[2].append(np.tile(stops[:-1], len(departures)))
+        columns[3].append(np.tile(stops[1:], len(departures)))
+        columns[4].append(np.repeat(np.arange(first_trip, len(trip_routes)), len(stops) - 1))
+    dep_times, arr_times, dep_stops, arr_stops, trips = \
+        (np.concatenate(column) if column else np.empty(0) for column in columns)
+    # Sorted by departure time, and by arrival time between connections departing together
+    order = np.lexsort((arr_times, dep_times))
+
+    walk_links = [[] for _ in codes]
+    for (_, station_a, station_b), time in zip(walks, times[position:].tolist()):
+        walk_links[index[station_a.station_code]].append((index[station_b.station_code], time))
+        walk_links[index[station_b.station_code]].append((index[station_a.station_code], time))
+    walk_offsets = [0]
+    for links in walk_links:
+        walk_offsets.append(walk_offsets[-1] + len(links))
+
+    route_offsets = [0]
+    for stations in route_stops:
+        route_offsets.append(route_offsets[-1] + len(stations))
+    return Timetable(codes,
+                     (dep_times[order].tolist(), arr_times[order].tolist(),
+                      dep_stops[order].astype(int).tolist(), arr_stops[order].astype(int).tolist(),
+                      trips[order].astype(int).tolist()),
+                     (trip_routes, trip_starts),
+                     (route_offsets, [index[station.station_code] for stations in route_stops
+                                      for station in stations],
+                      route_times, [line.line_code for line in route_lines]),
+                     (walk_offsets, [neigh for links in walk_links for neigh, _ in links],
+                      [time for links in walk_links for _, time in links]))
+
+
+def load_timetable(filename: str) -> Timetable:
+    """Load a Timetable that was written out by Timetable.save."""
+    try:
+        with np.load(filename, allow_pickle=False) as data:
+            return Timetable([str(code) for code in data['codes']],
+                             (data['dep_times'].tolist(), data['arr_times'].tolist(),
+                              data['dep_stops'].tolist(), data['arr_stops'].tolist(),
+                              data['trips'].tolist()),
+                             (data['trip_routes'].tolist(), data['trip_starts'].tolist()),
+                             (data['route_offsets'].tolist(), data['route_stops'].tolist(),
+                              data['route_times'].tolist(),
+                              [str(line) for line in data['route_lines']]),
+                             (data['walk_offsets'].tolist(), data['walk_targets'].tolist(),
+                              data['walk_times'].tolist()))
+    except FileNotFoundError:
+        raise Exception(f"The file `{filename}` could not be found.")
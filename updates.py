@@ -0,0 +1,164 @@
+"""CSC111 Winter 2021 Project: MTR Journey Times, Supporting Material: Network Updates
+
+This file reads updates to the systems (closures, slowdowns and temporary walking links, see
+SystemMap.close_station etc.) one line at a time, from a file that is being written to or from a
+socket, so that journeys change during an incident without reloading any of the csv data.
+
+Update format (one update per line, blank lines and lines starting with # are ignored):
+    close_station <station code>
+    open_station <station code>
+    close_edge <station code> <station code>
+    open_edge <station code> <station code>
+    scale_edge <station code> <station code> <factor>
+    add_walk <station code> <station code>
+    remove_walk <station code> <station code>
+    clear
+
+Copyright and Usage Information
+===============================
+
+All forms of distribution of this code, whether as given or with any changes, are
+expressly prohibited. For more information on copyright for CSC111 materials,
+please consult our Course Syllabus.
+
+This file is Copyright (c) 2021 Vijay Sambamurthy.
+"""
+import asyncio
+import sys
+from collections.abc import Callable, Iterable
+from typing import Optional
+
+from classes import SystemMap, get_dist
+
+# Number of arguments of each update
+COMMANDS = {"close_station": 1, "open_station": 1, "close_edge": 2, "open_edge": 2,
+            "scale_edge": 3, "add_walk": 2, "remove_walk": 2, "clear": 0}
+
+# Walking speed (km/h) used for walking links if the system has no WLK line (see data/lines.csv)
+WALKING_SPEED = 4
+
+# Seconds between checks for new lines in a file that is being followed
+POLL_INTERVAL = 0.1
+
+
+def parse_update(line: str) -> Optional[tuple[str, list[str]]]:
+    """Return the (command, arguments) of the given update line, or None if the line is blank or
+    a comment. A ValueError is raised if the line is not a valid update.
+    """
+    parts = line.split()
+    if not parts or parts[0].startswith("#"):
+        return None
+    if parts[0] not in COMMANDS:
+        raise ValueError(f"Unknown update `{parts[0]}`.")
+    if len(parts) - 1 != COMMANDS[parts[0]]:
+        raise ValueError(f"`{parts[0]}` takes {COMMANDS[parts[0]]} argument(s).")
+    return (parts[0], parts[1:])
+
+
+def walking_weight(system: SystemMap, station_a: str, station_b: str, time: bool) -> float:
+    """Return the weight of a walking link between the given stations, calculated the same way as
+    the weight of a connection on the WLK line (see Line.add_connecion).
+    """
+    for code in (station_a, station_b):
+        if code not in system.stations:
+            raise ValueError(f"The station `{code}` is not in the system.")
+    weight = get_dist(system.stations[station_a].coords, system.stations[station_b].coords)
+    if time:
+        speed = system.lines["WLK"].operating_speed if "WLK" in system.lines else WALKING_SPEED
+        weight = (weight / speed) * 60 + 1
+    return weight
+
+
+def apply_update(systems: dict[bool, SystemMap], line: str) -> bool:
+    """Apply the given update line to every system. Returns whether the line was an update (and
+    not blank or a comment). A ValueError is raised if the update is not valid.
+
+    systems: a dictionary mapping containing {time : system}, where time describes the weights of
+    the system as in load_csv_stations
+    """
+    update = parse_update(line)
+    if update is None:
+        return False
+    command, args = update
+    if command == "scale_edge":
+        try:
+            factor = float(args[2])
+        except ValueError:
+            raise ValueError(f"The factor `{args[2]}` is not a number.")
+    for time, system in systems.items():
+        if command == "close_station":
+            system.close_station(args[0])
+        elif command == "open_station":
+            system.open_station(args[0])
+        elif command == "close_edge":
+            system.close_edge(args[0], args[1])
+        elif command == "open_edge":
+            system.open_edge(args[0], args[1])
+        elif command == "scale_edge":
+            system.scale_edge(args[0], args[1], factor)
+        elif command == "add_walk":
+            system.add_walking_link(args[0], args[1],
+                                    walking_weight(system, args[0], args[1], time))
+        elif command == "remove_walk":
+            system.remove_walking_link(args[0], args[1])
+        else:
+            system.clear_updates()
+    return True
+
+
+def apply_updates(systems: dict[bool, SystemMap], lines: Iterable[str]) -> int:
+    """Apply every update in lines (see apply_update) and return the number of updates applied."""
+    return sum(1 for line in lines if apply_update(systems, line))
+
+
+async def follow_file(filename: str, handle: Callable[[str], bool]) -> None:
+    """Call handle with every line of the given file, and then with every line that is added to it
+    afterwards, until cancelled. Invalid updates are reported and skipped.
+
+    handle: applies one update line, e.g. RoutingService.apply_update or apply_update with the
+    systems given (using functools.partial)
+    """
+    try:
+        file = open(filename, encoding="utf8")
+    except FileNotFoundError:
+        raise Exception(f"The file `{filename}` could not be found.")
+    with file:
+        partial = ""
+        while True:
+            partial += file.readline()
+            if not partial.endswith("\n"):
+                # Wait for the rest of the line to be written
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            try:
+                handle(partial)
+            except ValueError as error:
+                print(f"Skipped update `{partial.strip()}`: {error}", file=sys.stderr)
+            partial = ""
+
+
+async def serve_updates(handle: Callable[[str], bool], host: str, port: int) -> None:
+    """Accept update lines sent to host:port, calling handle (see follow_file) with each one until
+    cancelled. Each line is answered with "ok" or "error: <reason>".
+    """
+    async def serve_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Apply the updates sent over one connection until it is closed."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    handle(line.decode("utf8"))
+                    writer.write(b"ok\n")
+                except ValueError as error:
+                    writer.write(f"error: {error}\n".encode("utf8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(serve_client, host, port)
+    async with server:
+        await server.serve_forever()
@@ -14,12 +14,26 @@ please consult our Course Syllabus.
 
 This file is Copyright (c) 2021 Vijay Sambamurthy.
 """
+from collections.abc import Callable
+from typing import Optional
+
 from pygame.colordict import THECOLORS
 import pygame
 
 # Size of click boxes
 SQUARE_SIZE = 30
 
+# Font used for all text. Fonts and rendered text are cached because looking up a system font is
+# very slow, see get_font and render_text.
+FONT_NAME = 'inconsolata'
+FONT_SIZE = 22
+
+# Most rendered text surfaces kept by render_text
+TEXT_CACHE_SIZE = 256
+
+_fonts: dict[tuple[str, int], pygame.font.Font] = {}
+_rendered_text: dict[tuple[str, str], pygame.Surface] = {}
+
 
 def initialize_screen(screen_size: tuple[int, int], allowed: list, name: str) -> pygame.Surface:
     """Initialize pygame and the display window.
@@ -32,6 +46,9 @@ def initialize_screen(screen_size: tuple[int, int], allowed: list, name: str) ->
     """
     pygame.display.init()
     pygame.font.init()
+    # Cached fonts and text may belong to a previous initialization of pygame.font
+    _fonts.clear()
+    _rendered_text.clear()
     screen = pygame.display.set_mode(screen_size)
     screen.fill(THECOLORS['white'])
     pygame.display.flip()
@@ -57,48 +74,115 @@ def draw_mappings(screen: pygame.Surface, positions: list[tuple[int, int]]) -> N
 
 
 def draw_path(screen: pygame.Surface, path: list[str],
-              mapping: dict[str, tuple[int, int]]) -> None:
+              mapping: dict[str, tuple[int, int]]) -> list[pygame.Rect]:
     """Draws the given path that was generated by the dijkstra algorithm.
 
     path: path generated by SystemMap.dijkstra method.
     mapping: dictionary containing station codes and their respective click box positions.
 
+    return: the areas of the screen that were drawn on.
+
     Preconditions:
         - All elements in path are a valid key in mapping
         - All values in mappings are on the screen
     """
     if path == [] or path is None:
-        return
+        return []
     add = int(SQUARE_SIZE / 2)
     start = (mapping[path[0]][0] + add, mapping[path[0]][1] + add)
-    pygame.draw.circle(screen, THECOLORS['blue'], start, 4)
+    rects = [pygame.draw.circle(screen, THECOLORS['blue'], start, 4)]
     for count in range(len(path) - 1):
         cur_point = mapping[path[count]]
         next_point = mapping[path[count + 1]]
         cur_point_mod = (cur_point[0] + add, cur_point[1] + add)
         next_point_mod = (next_point[0] + add, next_point[1] + add)
-        pygame.draw.line(screen, THECOLORS['blue'], cur_point_mod, next_point_mod, 10)
-        pygame.draw.circle(screen, THECOLORS['blue'], next_point_mod, 4)
+        rects.append(pygame.draw.line(screen, THECOLORS['blue'], cur_point_mod, next_point_mod,
+                                      10))
+        rects.append(pygame.draw.circle(screen, THECOLORS['blue'], next_point_mod, 4))
+    return rects
 
 
-def draw_circle(screen: pygame.Surface, point: tuple[int, int], color: str) -> None:
+def draw_circle(screen: pygame.Surface, point: tuple[int, int], color: str) -> pygame.Rect:
     """Draws a circle at the center of the given click box's location with the given color.
 
     point: Position at which the circle is to be drawn
     color: a string representing the color to be used (defined by THECOLORS from pygame)
+
+    return: the area of the screen that was drawn on.
     """
     modified_point = (point[0] + int(SQUARE_SIZE / 2), point[1] + int(SQUARE_SIZE / 2))
-    pygame.draw.circle(screen, THECOLORS[color], modified_point, 8)
+    return pygame.draw.circle(screen, THECOLORS[color], modified_point, 8)
+
+
+def get_font(name: str = FONT_NAME, size: int = FONT_SIZE) -> pygame.font.Font:
+    """Return the system font with the given name and size, only looking it up the first time."""
+    if (name, size) not in _fonts:
+        _fonts[(name, size)] = pygame.font.SysFont(name, size)
+    return _fonts[(name, size)]
 
 
-def draw_text(screen: pygame.Surface, text: str, pos: tuple[int, int]) -> None:
+def render_text(text: str, color: str = 'black') -> pygame.Surface:
+    """Return the given text rendered in the default font, reusing the surface if the same text
+    has been rendered recently.
+    """
+    key = (text, color)
+    if key not in _rendered_text:
+        if len(_rendered_text) >= TEXT_CACHE_SIZE:
+            _rendered_text.clear()
+        _rendered_text[key] = get_font().render(text, True, THECOLORS[color])
+    return _rendered_text[key]
+
+
+def draw_text(screen: pygame.Surface, text: str, pos: tuple[int, int]) -> pygame.Rect:
     """Draw the given text to the pygame screen at the given position.
     This function has not been modified much from assignment 1 of CSC111.
 
     pos: represents the *upper-left corner* of the text.
+
+    return: the area of the screen that was drawn on.
     """
-    font = pygame.font.SysFont('inconsolata', 22)
-    text_surface = font.render(text, True, THECOLORS['black'])
+    text_surface = render_text(text)
     width, height = text_surface.get_size()
-    screen.blit(text_surface,
-                pygame.Rect(pos, (pos[0] + width, pos[1] + height)))
+    return screen.blit(text_surface,
+                       pygame.Rect(pos, (pos[0] + width, pos[1] + height)))
+
+
+class LayeredScreen:
+    """A screen made of a static base layer (drawn once) and an overlay which is redrawn every
+    frame. Only the areas the overlay draws on are restored and updated, instead of redrawing and
+    updating the whole screen.
+
+    Instance Attributes:
+        - screen: the pygame screen that is drawn to
+        - base: the static base layer, the same size as screen
+    """
+    screen: pygame.Surface
+    base: pygame.Surface
+    # Private Instance Attributes:
+    #   - _dirty: the areas drawn on by the overlay in the last frame
+    #   - _full: whether the whole screen has to be updated in the next frame
+    _dirty: list[pygame.Rect]
+    _full: bool
+
+    def __init__(self, screen: pygame.Surface, base: pygame.Surface) -> None:
+        """Initialize a LayeredScreen, drawing the base layer onto the screen."""
+        self.screen = screen
+        self.base = base
+        self._dirty = []
+        self._full = True
+        screen.blit(base, (0, 0))
+
+    def draw(self, draw_overlay: Callable[[pygame.Surface], list[Optional[pygame.Rect]]]) -> None:
+        """Draw one frame: the areas of the last overlay are restored from the base layer, then
+        draw_overlay is called to draw the new overlay (returning the areas it drew on) and only
+        the changed areas of the display are updated.
+        """
+        for rect in self._dirty:
+            self.screen.blit(self.base, rect, rect)
+        drawn = [rect for rect in draw_overlay(self.screen) if rect is not None]
+        if self._full:
+            pygame.display.flip()
+            self._full = False
+        else:
+            pygame.display.update(self._dirty + drawn)
+        self._dirty = drawn